@@ -0,0 +1,73 @@
+"""
+Benchmark for context-window management over a long session.
+
+Simulates a few hundred turns, each with a reply and a command output, and prints the
+prompt size of every tenth turn with and without rolling summarization. Without it the
+prompt grows with every turn; with it the prompt stays under the budget. The summarizer
+is a stand-in that answers after a delay, so the numbers show how often a turn had to
+wait for a summary rather than the quality of one.
+
+    python -m benchmarks.bench_context [--turns 200] [--budget 20000]
+"""
+import argparse
+import asyncio
+import time
+
+from chatsh.context import ContextManager
+from chatsh.conversation import ConversationHistory
+from chatsh.reducer import estimate_tokens
+
+REPLY = "Let me check that.\n```sh\nls -la /var/log\n```\n" * 4
+OUTPUT = "-rw-r--r-- 1 root root 12345 Jan  1 00:00 syslog\n" * 40
+SUMMARY_DELAY = 0.05  # seconds the stand-in summarizer takes
+THINK_TIME = 0.01  # seconds between turns, in which a summary can finish in the background
+
+
+async def fake_summarizer(transcript: str) -> str:
+    await asyncio.sleep(SUMMARY_DELAY)
+    return "- " + "\n- ".join(f"turn about {line[:40]}" for line in transcript.splitlines()[1::8][:30])
+
+
+class NullChat:
+    messages: list = []
+
+
+def prompt_tokens(history: ConversationHistory) -> int:
+    return sum(estimate_tokens(message["content"]) for message in history.get_chat_messages())
+
+
+async def run(turns: int, budget: int) -> None:
+    plain, managed = ConversationHistory(), ConversationHistory()
+    manager = ContextManager(managed, NullChat(), budget, fake_summarizer)
+    waited = compactions = 0
+    started = time.perf_counter()
+    print(f"{'turn':>6}{'unbounded':>12}{'managed':>12}")
+    for turn in range(1, turns + 1):
+        before = time.perf_counter()
+        result = await manager.apply()
+        if result is not None:
+            compactions += 1
+            if time.perf_counter() - before > SUMMARY_DELAY / 2:
+                waited += 1
+        for history in (plain, managed):
+            history.add_entry('user', f"turn {turn}: what is filling up the disk?")
+            history.add_entry('assistant', REPLY)
+            history.entries[-1].execution_output = OUTPUT
+        manager.maybe_start()
+        if turn % 10 == 0:
+            print(f"{turn:>6}{prompt_tokens(plain):>12}{prompt_tokens(managed):>12}")
+        await asyncio.sleep(THINK_TIME)
+    manager.cancel()
+    print(f"{compactions} compactions, {waited} of them waited on; {time.perf_counter() - started:.2f}s total")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=200, help="number of turns")
+    parser.add_argument("--budget", type=int, default=20_000, help="context budget in tokens")
+    args = parser.parse_args()
+    asyncio.run(run(args.turns, args.budget))
+
+
+if __name__ == "__main__":
+    main()
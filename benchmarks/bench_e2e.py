@@ -0,0 +1,293 @@
+"""
+End-to-end benchmark of a long interactive session, offline.
+
+Starts benchmarks.fake_llm and points the vendor SDK at it, then runs main_loop with
+scripted user messages, confirming every command. Every --report-every turns it prints,
+for the turns since the previous line: the prompt size the history has grown to, turn
+latency (from sending a message to the next prompt, p50 and p90), time to first token,
+render CPU and process CPU per turn, resident memory, log write time per turn and the
+size of the log on disk.
+
+The figures of the last window, and the log write time of the whole session, are
+compared with a stored baseline. Any that got worse by more than --tolerance is flagged
+as a regression, and the exit status is 1. The figures depend on the machine: record a
+baseline with --save-baseline before a change, then run again after it.
+
+    python -m benchmarks.bench_e2e [--turns 200] [--vendor anthropic] [--rate 1000] [--latency 0.02]
+                                   [--baseline FILE] [--save-baseline] [--tolerance 0.25]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from rich.console import Console
+
+import chatsh.chatsh
+from chatsh.chat import chat
+from chatsh.chatsh import load_system_prompt, main_loop
+from chatsh.context import DEFAULT_BUDGET
+from chatsh.interaction_log import InteractionType, default_log_dir, iter_interactions
+from chatsh.scheduler import RateLimiter, ScheduledChat
+from chatsh.telemetry import percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = Path(__file__).with_name("bench_e2e.baseline.json")
+# The model each vendor is benchmarked with; the fake server answers for any model
+VENDOR_MODELS = {"anthropic": "s", "openai": "g"}
+# A fixed description, so the prompt is the same on every machine
+SYSTEM_DESCRIPTION = "\nThe user's shell is bash on Linux.\n"
+# figure -> (label, smallest change worth flagging); below it a change is noise
+FIGURES = {
+    "turn_p50_ms": ("turn latency p50, ms", 5.0),
+    "turn_p90_ms": ("turn latency p90, ms", 10.0),
+    "first_token_ms": ("time to first token, ms", 5.0),
+    "render_ms": ("render CPU per turn, ms", 1.0),
+    "cpu_ms": ("process CPU per turn, ms", 5.0),
+    "rss_growth_mb": ("memory growth after the first window, MB", 2.0),
+    "log_write_ms": ("time a turn waits on the log, over the session, ms", 2.0),
+    "log_kb_per_turn": ("log size per turn, KB", 1.0),
+}
+
+
+class Sample(NamedTuple):
+    """The process as a prompt appears."""
+    wall: float
+    cpu: float
+    rss_mb: float
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+        # only the peak is available elsewhere; in bytes on macOS, kilobytes on Linux
+        scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def disk_kb(directory: Path) -> float:
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(directory) for name in names) / 1024
+
+
+class ScriptedPrompt:
+    """Stands in for UndeletablePrompt: types the messages, then Ctrl-D, and samples the process."""
+
+    def __init__(self, messages: Iterable[str]):
+        self.messages = iter(messages)
+        self.samples: List[Sample] = []
+
+    async def get_input(self) -> str:
+        self.samples.append(Sample(time.perf_counter(), time.process_time(), rss_mb()))
+        try:
+            return next(self.messages)
+        except StopIteration:
+            raise EOFError from None
+
+
+class AutoConfirm:
+    """Stands in for rich's Confirm: every command runs."""
+
+    @staticmethod
+    def ask(*args, **kwargs) -> bool:
+        return True
+
+
+@contextmanager
+def offline(directory: Path, base_url: str):
+    """
+    Point the vendor SDKs at base_url, with HOME (and so the logs) in directory and a
+    no-op `gh` for the transcript upload on exit.
+    """
+    bin_dir = directory / "bin"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    (bin_dir / "gh").write_text("#!/bin/sh\nexit 0\n")
+    (bin_dir / "gh").chmod(0o755)
+    config = directory / ".config"
+    config.mkdir(exist_ok=True)
+    for vendor in VENDOR_MODELS:
+        (config / f"{vendor}.token").write_text("fake-key\n")
+    saved = dict(os.environ)
+    os.environ.update(HOME=str(directory), XDG_CACHE_HOME=str(directory / "cache"),
+                      ANTHROPIC_BASE_URL=base_url, OPENAI_BASE_URL=f"{base_url}/v1",
+                      PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+@contextmanager
+def scripted_terminal(prompt: ScriptedPrompt):
+    """main_loop reads prompt, confirms everything and renders to a terminal nobody sees."""
+    saved = chatsh.chatsh.UndeletablePrompt, chatsh.chatsh.Confirm, chatsh.chatsh.console
+    with open(os.devnull, "w") as screen:
+        chatsh.chatsh.UndeletablePrompt = lambda: prompt
+        chatsh.chatsh.Confirm = AutoConfirm
+        chatsh.chatsh.console = Console(file=screen, force_terminal=True, width=120)
+        try:
+            yield
+        finally:
+            chatsh.chatsh.UndeletablePrompt, chatsh.chatsh.Confirm, chatsh.chatsh.console = saved
+
+
+async def run_session(turns: int, vendor: str, directory: Path, base_url: str,
+                      context_budget: Optional[int] = DEFAULT_BUDGET):
+    """
+    One scripted session against the server at base_url.
+
+    @return: the samples (one per prompt, so turns + 1) and the telemetry of every reply.
+    """
+    prompt = ScriptedPrompt(f"step {turn}: show me the next batch of lines" for turn in range(1, turns + 1))
+    with offline(directory, base_url), scripted_terminal(prompt):
+        await main_loop(ScheduledChat(limiter=RateLimiter(), make_backend=chat),
+                        load_system_prompt() + SYSTEM_DESCRIPTION, VENDOR_MODELS[vendor],
+                        context_budget=context_budget)
+        log_file = next(default_log_dir().glob("interaction_log_*.jsonl"))
+    telemetry = []
+    errors = []
+    async for interaction in iter_interactions(log_file):
+        if interaction.type == InteractionType.LLM_RESPONSE:
+            telemetry.append(interaction.metadata["telemetry"])
+        elif interaction.type == InteractionType.ERROR:
+            errors.append(interaction.content)
+    if len(telemetry) < turns:
+        raise RuntimeError(f"{turns - len(telemetry)} turns failed, the first with: {errors[0] if errors else '?'}")
+    return prompt.samples, telemetry
+
+
+def windows(samples: List[Sample], telemetry: List[dict], size: int) -> List[dict]:
+    """Figures for every size turns."""
+    rows = []
+    for start in range(0, len(telemetry), size):
+        end = min(start + size, len(telemetry))
+        latencies = [(samples[turn + 1].wall - samples[turn].wall) * 1000 for turn in range(start, end)]
+        replies = telemetry[start:end]
+        count = end - start
+        rows.append({
+            "turns": end,
+            "prompt_tokens": replies[-1].get("input_tokens", 0),
+            "turn_p50_ms": percentile(latencies, 50),
+            "turn_p90_ms": percentile(latencies, 90),
+            "first_token_ms": percentile([reply["time_to_first_token"] * 1000 for reply in replies], 50),
+            "render_ms": sum(reply["render_seconds"] for reply in replies) * 1000 / count,
+            "cpu_ms": (samples[end].cpu - samples[start].cpu) * 1000 / count,
+            "rss_mb": samples[end].rss_mb,
+            "log_write_ms": sum(reply.get("log_write_seconds", 0) for reply in replies) * 1000 / count,
+        })
+    return rows
+
+
+def format_rows(rows: List[dict]) -> str:
+    lines = [f"{'turns':>6} {'prompt tok':>10} {'p50 ms':>8} {'p90 ms':>8} {'ttft ms':>8} {'render':>7} "
+             f"{'cpu ms':>7} {'rss MB':>7} {'log ms':>7}"]
+    for row in rows:
+        lines.append(f"{row['turns']:6d} {row['prompt_tokens']:10d} {row['turn_p50_ms']:8.1f} "
+                     f"{row['turn_p90_ms']:8.1f} {row['first_token_ms']:8.1f} {row['render_ms']:7.2f} "
+                     f"{row['cpu_ms']:7.1f} {row['rss_mb']:7.1f} {row['log_write_ms']:7.2f}")
+    return "\n".join(lines)
+
+
+def figures(rows: List[dict], telemetry: List[dict], log_kb: float) -> Dict[str, float]:
+    """The last window's figures, the ones a baseline keeps."""
+    last = rows[-1]
+    result = {name: round(last[name], 3) for name in FIGURES if name in last}
+    result["rss_growth_mb"] = round(last["rss_mb"] - rows[0]["rss_mb"], 3)
+    # batches are written every second or so, in whichever turn is running: too lumpy for one window
+    result["log_write_ms"] = round(sum(reply.get("log_write_seconds", 0) for reply in telemetry)
+                                   * 1000 / len(telemetry), 3)
+    result["log_kb_per_turn"] = round(log_kb / last["turns"], 3)
+    return result
+
+
+def compare(current: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """One line per figure that got worse than baseline by more than tolerance (a fraction) and the noise floor."""
+    regressions = []
+    for name, (label, floor) in FIGURES.items():
+        if name not in current or name not in baseline:
+            continue
+        worse = current[name] - baseline[name]
+        if worse > floor and worse > abs(baseline[name]) * tolerance:
+            regressions.append(f"{label}: {baseline[name]:.2f} -> {current[name]:.2f}")
+    return regressions
+
+
+def start_fake_llm(args) -> tuple:
+    """The fake vendor in a process of its own, so its work is not measured; returns it and its URL."""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_llm", "--port", "0", "--rate", str(args.rate),
+         "--latency", str(args.latency), "--reply-tokens", str(args.reply_tokens),
+         "--output-lines", str(args.output_lines)],
+        stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    line = server.stdout.readline()
+    if not line:
+        raise RuntimeError("the fake LLM server did not start")
+    return server, line.split()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--report-every", type=int, default=25, metavar="TURNS")
+    parser.add_argument("--vendor", choices=list(VENDOR_MODELS), default="anthropic",
+                        help="the SDK that talks to the fake server")
+    parser.add_argument("--rate", type=float, default=1000.0, help="tokens per second the server streams")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds before the first token")
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--output-lines", type=int, default=40, help="lines printed by each reply's command")
+    parser.add_argument("--context-budget", type=int, default=DEFAULT_BUDGET, metavar="TOKENS",
+                        help="as chatsh's; 0 lets the history grow without summaries")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="record this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="fraction by which a figure may get worse before it is a regression")
+    args = parser.parse_args()
+    config = {name: getattr(args, name) for name in
+              ("turns", "report_every", "vendor", "rate", "latency", "reply_tokens", "output_lines", "context_budget")}
+
+    server, base_url = start_fake_llm(args)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            samples, telemetry = asyncio.run(run_session(args.turns, args.vendor, Path(tmp), base_url,
+                                                         args.context_budget))
+            log_kb = disk_kb(Path(tmp) / ".local" / "share" / "chatsh_history")
+    finally:
+        server.terminate()
+        server.wait()
+    rows = windows(samples, telemetry, args.report_every)
+    print(format_rows(rows))
+    current = figures(rows, telemetry, log_kb)
+    print(f"log on disk: {log_kb:.0f} KB")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({"config": config, "figures": current}, indent=2) + "\n")
+        print(f"saved the baseline to {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}; record one with --save-baseline")
+        return
+    baseline = json.loads(args.baseline.read_text())
+    if baseline["config"] != config:
+        print(f"the baseline in {args.baseline} was recorded with other settings ({baseline['config']}); not comparing")
+        return
+    regressions = compare(current, baseline["figures"], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
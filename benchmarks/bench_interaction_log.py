@@ -0,0 +1,96 @@
+"""
+Benchmark for interaction log traversal on large logs.
+
+Builds a synthetic log of 100k interactions shaped like a long session in which replies
+were regenerated now and then (so the tree branches), writes it as JSONL, then times
+loading it and walking it: ancestor walks from the deepest leaf, subtree iteration,
+branch enumeration and playback.
+
+    python -m benchmarks.bench_interaction_log [--size 100000] [--legacy]
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from chatsh.interaction_log import InteractionLog, InteractionType
+
+BRANCH_EVERY = 50  # every so many turns a reply is regenerated, forking the conversation
+
+
+async def build_log(size: int, log_dir: Path) -> InteractionLog:
+    log = InteractionLog(log_dir=log_dir)
+    parent = None
+    while log.next_id <= size:
+        user_id = await log.add_interaction(InteractionType.USER_MESSAGE, "list the files", parent_id=parent)
+        reply_id = await log.add_interaction(InteractionType.LLM_RESPONSE, "```sh\nls\n```", parent_id=user_id)
+        if user_id % BRANCH_EVERY == 1:
+            await log.add_interaction(InteractionType.LLM_RESPONSE, "```sh\nls -la\n```", parent_id=user_id)
+        parent = await log.add_interaction(InteractionType.CODE_EXECUTION_OUTPUT, "a b c", parent_id=reply_id)
+    await log.close()
+    return log
+
+
+def legacy_branch(interactions, interaction_id):
+    """The previous get_conversation_branch: rebuilds the id map and prepends."""
+    branch = []
+    current_id = interaction_id
+    id_map = {i.interaction_id: i for i in interactions}
+    while current_id is not None and current_id in id_map:
+        interaction = id_map[current_id]
+        branch.insert(0, interaction)
+        current_id = interaction.parent_id
+    return branch
+
+
+def legacy_playback(interactions, start_id):
+    branch = legacy_branch(interactions, start_id)
+    branch_ids = {i.interaction_id for i in branch}
+    return branch + [i for i in interactions
+                     if i.timestamp > branch[-1].timestamp
+                     and (i.parent_id in branch_ids or i.interaction_id in branch_ids)]
+
+
+def timed(label, function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    print(f"{label:<28} {time.perf_counter() - started:8.4f}s")
+    return result
+
+
+async def run(size: int, legacy: bool) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        log = await build_log(size, Path(tmp))
+        print(f"{'build + write':<28} {time.perf_counter() - started:8.4f}s  ({len(log.interactions)} interactions)")
+
+        started = time.perf_counter()
+        log = await InteractionLog.load_from_file(log.current_file)
+        print(f"{'load':<28} {time.perf_counter() - started:8.4f}s")
+
+        leaf = log.interactions[-1].interaction_id
+        middle = log.interactions[len(log.interactions) // 2].interaction_id
+        branch = timed("branch to deepest leaf", lambda: list(reversed(list(log.iter_ancestors(leaf)))))
+        print(f"{'  depth':<28} {len(branch):8d}")
+        timed("subtree of the root", lambda: sum(1 for _ in log.iter_subtree(None)))
+        branches = timed("enumerate branches", lambda: sum(1 for _ in log.iter_branches()))
+        print(f"{'  branches':<28} {branches:8d}")
+        started = time.perf_counter()
+        await log.playback_conversation(middle)
+        print(f"{'playback from the middle':<28} {time.perf_counter() - started:8.4f}s")
+        if legacy:
+            timed("legacy branch to leaf", legacy_branch, log.interactions, leaf)
+            timed("legacy playback from middle", legacy_playback, log.interactions, middle)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=100_000, help="number of interactions")
+    parser.add_argument("--legacy", action="store_true", help="also time the previous implementation")
+    args = parser.parse_args()
+    asyncio.run(run(args.size, args.legacy))
+
+
+if __name__ == "__main__":
+    main()
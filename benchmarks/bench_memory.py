@@ -0,0 +1,72 @@
+"""
+Benchmark for the memory a long session holds.
+
+Simulates a multi-day session: every turn logs a user message, a reply, a command and
+its output, and adds them to the conversation history. Each launch also logs the system
+prompt again. The benchmark prints the Python heap in use every so many turns, with
+bodies kept inline and with them in a BlobStore. With a store, the heap should grow only
+by the small records, not by the outputs.
+
+    python -m benchmarks.bench_memory [--turns 5000] [--output-kb 8]
+"""
+import argparse
+import asyncio
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from chatsh.blob_store import BlobStore
+from chatsh.conversation import ConversationHistory
+from chatsh.interaction_log import InteractionLog
+
+SYSTEM_PROMPT = "You are ChatSH, an AI language model that specializes in assisting users with tasks.\n" * 200
+TURNS_PER_LAUNCH = 100
+REPORT_EVERY = 1000
+
+
+def command_output(turn: int, size: int) -> str:
+    line = f"{turn:08d} -rw-r--r-- 1 root root 12345 Jan  1 00:00 syslog.{turn}\n"
+    return line * (size // len(line))
+
+
+async def simulate(turns: int, output_size: int, log_dir: Path, blobs) -> None:
+    history = ConversationHistory(blobs)
+    log = InteractionLog(log_dir=log_dir, blobs=blobs, tag="plain" if blobs is None else "blobs")
+    for turn in range(turns):
+        if turn % TURNS_PER_LAUNCH == 0:
+            await log.record_system_message(SYSTEM_PROMPT)
+        user_id = await log.record_user_message(f"what changed in the logs, turn {turn}?")
+        reply = f"Let me look.\n```sh\nls -la /var/log | tail -n {turn}\n```"
+        reply_id = await log.record_llm_response(reply, user_id)
+        prompt_id = await log.record_code_execution_prompt(f"ls -la /var/log | tail -n {turn}", reply_id)
+        await log.record_code_execution_decision(True, prompt_id)
+        output = command_output(turn, output_size)
+        await log.record_code_output(output, prompt_id)
+        history.add_entry('user', f"what changed in the logs, turn {turn}?")
+        history.add_entry('assistant', reply, output)
+        await asyncio.sleep(0)  # the user's think time, in which the log writer runs
+        if (turn + 1) % REPORT_EVERY == 0 or turn + 1 == turns:
+            current, _ = tracemalloc.get_traced_memory()
+            print(f"  turn {turn + 1:6d}  {current / 2 ** 20:8.1f} MB")
+    await log.close()
+
+
+async def run(turns: int, output_kb: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, blobs in [("inline", None), ("blob store", BlobStore(Path(tmp) / "blobs"))]:
+            print(label)
+            tracemalloc.start()
+            await simulate(turns, output_kb * 1024, Path(tmp), blobs)
+            tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=5000)
+    parser.add_argument("--output-kb", type=int, default=8, help="size of each command output")
+    args = parser.parse_args()
+    asyncio.run(run(args.turns, args.output_kb))
+
+
+if __name__ == "__main__":
+    main()
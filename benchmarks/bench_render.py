@@ -0,0 +1,105 @@
+"""
+Micro-benchmark for streaming reply rendering.
+
+Replays replies of 10-100 KB chunk by chunk into a terminal-like console and reports the
+CPU time spent rendering. Replies come from interaction logs when given, otherwise a
+synthetic reply mixing paragraphs, lists and code fences is used.
+
+    python -m benchmarks.bench_render [--legacy] [--log ~/.local/share/chatsh_history/interaction_log_*.jsonl]
+"""
+import argparse
+import asyncio
+import io
+import time
+from pathlib import Path
+
+from rich.console import Console
+from rich.live import Live
+from rich.markdown import Markdown
+
+from chatsh.interaction_log import InteractionType, iter_interactions
+from chatsh.render import StreamingMarkdown
+
+SIZES_KB = [10, 30, 100]
+CHUNK_SIZE = 16  # roughly one streamed token delta
+
+SAMPLE_REPLY = """Here is what the script below does:
+
+1. finds every log file under the current directory
+2. keeps only the lines with an error
+3. counts them per file
+
+```sh
+fd -e log | while read -r f; do
+  printf '%s %s\\n' "$(rg -c ERROR "$f" || echo 0)" "$f"
+done | sort -rn | head -n 20
+```
+
+The counts are sorted so the noisiest files come first. If `fd` is not available, use
+`find . -name '*.log'` instead; the rest of the pipeline is the same.
+
+"""
+
+
+async def load_replies(log_files):
+    replies = []
+    for log_file in log_files:
+        async for interaction in iter_interactions(Path(log_file)):
+            if interaction.type == InteractionType.LLM_RESPONSE:
+                replies.append(interaction.content)
+    return replies
+
+
+def build_reply(size_kb, replies):
+    source = "\n\n".join(replies) if replies else SAMPLE_REPLY
+    target = size_kb * 1024
+    return (source * (target // len(source) + 1))[:target]
+
+
+def chunks(text):
+    for i in range(0, len(text), CHUNK_SIZE):
+        yield text[i:i + CHUNK_SIZE]
+
+
+def terminal():
+    return Console(file=io.StringIO(), force_terminal=True, width=100)
+
+
+def render_streaming(text):
+    with StreamingMarkdown(terminal()) as renderer:
+        for chunk in chunks(text):
+            renderer.feed(chunk)
+
+
+def render_legacy(text):
+    """The previous renderer: re-parse the whole reply on every chunk."""
+    message = ""
+    with Live(console=terminal(), refresh_per_second=4) as live:
+        for chunk in chunks(text):
+            message += chunk
+            live.update(Markdown(message))
+
+
+def measure(render, text):
+    started = time.process_time()
+    render(text)
+    return time.process_time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--log", nargs="*", default=[], help="interaction logs to take replies from")
+    parser.add_argument("--legacy", action="store_true", help="also time the old full re-render (minutes at 100 KB)")
+    args = parser.parse_args()
+
+    replies = asyncio.run(load_replies(args.log))
+    for size_kb in SIZES_KB:
+        text = build_reply(size_kb, replies)
+        line = f"{size_kb:>4} KB  streaming {measure(render_streaming, text):7.3f}s CPU"
+        if args.legacy:
+            line += f"  legacy {measure(render_legacy, text):7.3f}s CPU"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
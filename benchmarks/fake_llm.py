@@ -0,0 +1,231 @@
+"""
+A fake LLM vendor for offline benchmarks: a local HTTP server that streams replies in
+the Anthropic Messages and OpenAI Chat Completions formats.
+
+Point a vendor SDK at it with ANTHROPIC_BASE_URL or OPENAI_BASE_URL; any API key works.
+Each reply starts after --latency seconds and then streams at --rate tokens per second,
+so a benchmark sees the same vendor timing on every machine and every run. Replies are
+made from the request by a reply function. The default one answers every turn with some
+markdown and a sh block that prints --output-lines lines.
+
+    python -m benchmarks.fake_llm [--port 8765] [--rate 100] [--latency 0.2] [--reply-tokens 120]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import re
+from typing import AsyncIterator, Callable, List, Optional
+
+# Roughly one token each: a word with the whitespace before it
+TOKEN = re.compile(r"\s*\S+|\s+")
+# Bytes of request per prompt token, for the usage the server reports
+BYTES_PER_TOKEN = 4
+
+PROSE = [
+    "Let me check that for you.",
+    "The command below lists what we need;",
+    "it only reads, so it is safe to run.",
+    "- `seq` prints the numbers",
+    "- `sed` labels every line",
+    "If the output looks wrong, **tell me** and we will try another way.",
+]
+
+
+def tokens(text: str) -> List[str]:
+    return TOKEN.findall(text)
+
+
+def make_reply(reply_tokens: int = 120, output_lines: int = 40) -> Callable[[dict], str]:
+    """A reply function: about reply_tokens of markdown, then a command printing output_lines lines."""
+    def reply(request: dict) -> str:
+        turn = sum(1 for message in request.get("messages", []) if message["role"] == "user")
+        lines, count = [], 0
+        for sentence in itertools.cycle(PROSE):
+            if count >= reply_tokens:
+                break
+            lines.append(sentence)
+            count += len(tokens(sentence))
+        prose = "\n".join(lines)
+        return (f"Turn {turn}. {prose}\n\n"
+                f"```sh\nseq 1 {output_lines} | sed 's/^/turn {turn} line /'\n```\n")
+    return reply
+
+
+def _sse(event: Optional[str], data: dict) -> bytes:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data)}\n\n".encode()
+
+
+class FakeLLM:
+    """
+    The server. start() returns its base URL; requests and request_bytes count what it
+    has been sent, e.g. to see the prompt grow with the history.
+    """
+
+    def __init__(self, rate: float = 100.0, latency: float = 0.2,
+                 reply: Optional[Callable[[dict], str]] = None):
+        """rate is in tokens per second (0: as fast as possible); latency in seconds."""
+        self.rate = rate
+        self.latency = latency
+        self.reply = reply or make_reply()
+        self.requests = 0
+        self.request_bytes = 0
+        self.server = None
+        self._connections = {}  # handler task -> its writer
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.server = await asyncio.start_server(self._serve, host, port)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            # kept-alive connections end too, so their handlers return before the loop stops
+            for writer in self._connections.values():
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self.server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # one request after another on a kept-alive connection, as the SDKs pool them
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, version = request_line.decode().split()
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                self.request_bytes += len(body)
+                chunked = version == "HTTP/1.1"
+                await self._respond(writer, method, path.split("?")[0], body, chunked)
+                if not chunked or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            del self._connections[asyncio.current_task()]
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, method: str, path: str, body: bytes,
+                       chunked: bool) -> None:
+        if method != "POST" or not path.endswith(("/messages", "/chat/completions")):
+            return await self._send_json(writer, 404, {"type": "error", "error": {
+                "type": "not_found_error", "message": f"no route for {method} {path}"}})
+        request = json.loads(body)
+        reply = tokens(self.reply(request))
+        input_tokens = len(body) // BYTES_PER_TOKEN
+        anthropic = path.endswith("/messages")
+        if not request.get("stream"):
+            await asyncio.sleep(self.latency + (len(reply) / self.rate if self.rate else 0))
+            text = "".join(reply)
+            payload = (_anthropic_message(request, text, input_tokens, len(reply)) if anthropic
+                       else _openai_completion(request, text, input_tokens, len(reply)))
+            return await self._send_json(writer, 200, payload)
+
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\ncache-control: no-cache\r\n"
+                     + (b"transfer-encoding: chunked\r\n" if chunked else b"connection: close\r\n") + b"\r\n")
+        events = (_anthropic_events if anthropic else _openai_events)(request, self._paced(reply), input_tokens,
+                                                                       len(reply))
+        async for event in events:
+            writer.write(b"%x\r\n%s\r\n" % (len(event), event) if chunked else event)
+            await writer.drain()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict) -> None:
+        data = json.dumps(payload).encode()
+        reason = "OK" if status == 200 else "Not Found"
+        writer.write(f"HTTP/1.1 {status} {reason}\r\ncontent-type: application/json\r\n"
+                     f"content-length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    async def _paced(self, reply: List[str]) -> AsyncIterator[str]:
+        await asyncio.sleep(self.latency)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for index, token in enumerate(reply):
+            if self.rate:
+                delay = started + index / self.rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield token
+
+
+def _anthropic_message(request: dict, text: str, input_tokens: int, output_tokens: int) -> dict:
+    return {"id": "msg_fake", "type": "message", "role": "assistant", "model": request.get("model", "fake"),
+            "content": [{"type": "text", "text": text}], "stop_reason": "end_turn", "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}}
+
+
+async def _anthropic_events(request: dict, reply: AsyncIterator[str], input_tokens: int,
+                            output_tokens: int) -> AsyncIterator[bytes]:
+    message = _anthropic_message(request, "", input_tokens, 1)
+    message["content"], message["stop_reason"] = [], None
+    yield _sse("message_start", {"type": "message_start", "message": message})
+    yield _sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                       "content_block": {"type": "text", "text": ""}})
+    async for token in reply:
+        yield _sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                           "delta": {"type": "text_delta", "text": token}})
+    yield _sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+    yield _sse("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                 "usage": {"output_tokens": output_tokens}})
+    yield _sse("message_stop", {"type": "message_stop"})
+
+
+def _openai_completion(request: dict, text: str, input_tokens: int, output_tokens: int) -> dict:
+    return {"id": "chatcmpl-fake", "object": "chat.completion", "created": 0, "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens}}
+
+
+async def _openai_events(request: dict, reply: AsyncIterator[str], input_tokens: int,
+                         output_tokens: int) -> AsyncIterator[bytes]:
+    chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0,
+             "model": request.get("model", "fake")}
+    async for token in reply:
+        yield _sse(None, {**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": token},
+                                                "finish_reason": None}]})
+    yield _sse(None, {**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    if request.get("stream_options", {}).get("include_usage"):
+        yield _sse(None, {**chunk, "choices": [], "usage": {
+            "prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens}})
+    yield b"data: [DONE]\n\n"
+
+
+async def serve(port: int, rate: float, latency: float, reply_tokens: int, output_lines: int) -> None:
+    server = FakeLLM(rate, latency, make_reply(reply_tokens, output_lines))
+    print(f"fake LLM listening on {await server.start(port=port)}", flush=True)
+    await server.server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8765, help="0 picks a free port")
+    parser.add_argument("--rate", type=float, default=100.0, help="tokens per second (0: unpaced)")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--output-lines", type=int, default=40, help="lines printed by each reply's command")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port, args.rate, args.latency, args.reply_tokens, args.output_lines))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,21 @@
-from .chatsh import main
-from .chat import *
+import sys
+
+
+def main():
+    """The chatsh command: attach to a running `chatsh --daemon` if there is one, else run here."""
+    # only the thin client is imported until we know the daemon cannot take the session
+    from chatsh.client import attach
+    status = attach(sys.argv[1:])
+    if status is not None:
+        sys.exit(status)
+    from chatsh.chatsh import main as run
+    return run()
+
+
+def __getattr__(name):
+    # the names of chatsh.chat, imported when first used rather than by every `chatsh`
+    import importlib
+    try:
+        return getattr(importlib.import_module("chatsh.chat"), name)
+    except AttributeError:
+        raise AttributeError(f"module 'chatsh' has no attribute '{name}'") from None
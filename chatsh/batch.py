@@ -0,0 +1,241 @@
+"""
+Headless mode: run tasks without a terminal, for scripts and CI jobs.
+
+    chatsh -p "remove the build directories under ~/src" --auto-execute safe
+    echo "which process listens on port 8080?" | chatsh -p -
+    chatsh --tasks tasks.jsonl --jobs 16 --auto-execute always > results.jsonl
+
+Each task is its own conversation with its own interaction log. Commands the model asks
+for run only if the --auto-execute policy allows them, and their output goes back to the
+model until it answers without a command or --max-turns is reached. Tasks run on a
+bounded pool of workers. Each task writes one JSON object to stdout when it finishes,
+and everything else goes to stderr.
+
+A tasks file has one task per line: a JSON string, or an object with "prompt" and
+optionally "id" and "model".
+"""
+import asyncio
+import contextlib
+import json
+import re
+import sys
+import time
+from dataclasses import dataclass
+from enum import auto
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from chatsh.blob_store import BlobStore
+from chatsh.chat import MODELS, Chat, UsageEvent
+from chatsh.code_preview import CodePreview, preview_code
+from chatsh.conversation import ConversationHistory
+from chatsh.execution import execute_code, remove_spills
+from chatsh.interaction_log import AutoNameLower, FsyncPolicy, InteractionLog
+from chatsh.reducer import ReducerConfig, reduce_output
+from chatsh.resume import SYSTEM_PROMPT_KEY
+
+DEFAULT_JOBS = 4
+DEFAULT_MAX_TURNS = 10
+# The user turn that carries a command's output back to the model
+CONTINUE_MESSAGE = "Continue with the task. Reply without a code block once it is done."
+
+
+class AutoExecute(AutoNameLower):
+    NEVER = auto()   # report the command without running it
+    SAFE = auto()    # run commands that pass the syntax check and match no risk pattern
+    ALWAYS = auto()  # run every command
+
+
+@dataclass
+class Task:
+    prompt: str
+    id: str
+    model: Optional[str] = None
+
+
+def parse_tasks(lines: Iterable[str]) -> List[Task]:
+    tasks = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line)
+        except json.JSONDecodeError as error:
+            raise ValueError(f"line {number}: {error}") from None
+        if isinstance(spec, str):
+            spec = {"prompt": spec}
+        if not isinstance(spec, dict) or not isinstance(spec.get("prompt"), str):
+            raise ValueError(f"line {number}: expected a string or an object with a \"prompt\"")
+        tasks.append(Task(spec["prompt"], str(spec.get("id", number)), spec.get("model")))
+    return tasks
+
+
+def may_run(policy: AutoExecute, preview: CodePreview) -> bool:
+    if policy == AutoExecute.ALWAYS:
+        return True
+    if policy == AutoExecute.SAFE:
+        return preview.risk == "low" and preview.syntax_ok is not False
+    return False
+
+
+def log_tag(task_id: str) -> str:
+    return re.sub(r"[^\w.-]", "_", task_id)[:40]
+
+
+async def ask(chat_instance: Chat, message: str, system_prompt: str, model: str) -> Tuple[str, Optional[dict]]:
+    chunks = []
+    usage = None
+    async for chunk in chat_instance.ask(message, system=system_prompt, model=model, max_tokens=8192,
+                                         system_cacheable=True, history_cacheable=True, stream=True):
+        if isinstance(chunk, UsageEvent):
+            usage = chunk.usage
+        else:
+            chunks.append(chunk)
+    return "".join(chunks), usage
+
+
+async def run_task(task: Task, chat_instance: Chat, system_prompt: str, model: str,
+                   policy: AutoExecute = AutoExecute.NEVER, max_turns: int = DEFAULT_MAX_TURNS,
+                   timeout: Optional[float] = None, reducer: Optional[ReducerConfig] = None,
+                   log_dir: Optional[Path] = None, log_fsync: FsyncPolicy = FsyncPolicy.BATCH,
+                   history_store=None, blobs: Optional[BlobStore] = None) -> dict:
+    """
+    Carry one task to its end.
+
+    @return: the task's JSON result. Its status is "done" (the model answered without a
+    command), "declined" (the policy did not allow the next command, which is in the last
+    step), "max_turns" or "error".
+    """
+    started = time.perf_counter()
+    log = InteractionLog(log_dir, fsync=log_fsync, store=history_store, tag=log_tag(task.id), blobs=blobs)
+    history = ConversationHistory(blobs)
+    result = {"id": task.id, "model": MODELS.get(model, model), "status": "max_turns", "reply": "",
+              "steps": [], "usage": [], "log": str(log.current_file)}
+    await log.record_system_message(f"ChatSH batch task {task.id} with model: {MODELS.get(model, model)}")
+    await log.record_system_message(system_prompt, metadata={SYSTEM_PROMPT_KEY: True})
+    message = task.prompt
+    try:
+        for _ in range(max_turns):
+            user_id = await log.record_user_message(message)
+            history.add_entry('user', message)
+            try:
+                reply, usage = await ask(chat_instance, history.construct_turn_message(), system_prompt, model)
+            except Exception as error:
+                history.pop_unanswered()
+                await log.record_error(str(error), user_id)
+                result.update(status="error", error=str(error))
+                break
+            reply_id = await log.record_llm_response(reply, user_id, metadata={"usage": usage} if usage else {})
+            history.add_entry('assistant', reply)
+            result["reply"] = reply
+            if usage:
+                result["usage"].append(usage)
+
+            codes = history.entries[-1].get_codeblocks()
+            if not codes:
+                result["status"] = "done"
+                break
+            code = "\n".join(codes)
+            preview = await preview_code(code)
+            prompt_id = await log.record_code_execution_prompt(code, reply_id, metadata=preview.metadata())
+            step = {"code": code, "risk": preview.risk, "syntax_ok": preview.syntax_ok, "executed": False}
+            result["steps"].append(step)
+            execute = may_run(policy, preview)
+            await log.record_code_execution_decision(execute, prompt_id)
+            if not execute:
+                result["status"] = "declined"
+                break
+
+            command_started = time.perf_counter()
+            execution = await execute_code(code, timeout=timeout)
+            output = execution.for_model()
+            metadata = execution.metadata()
+            metadata["wall_seconds"] = round(time.perf_counter() - command_started, 4)
+            if reducer is not None:
+                output, metadata["reduction"] = reduce_output(output, reducer)
+            await log.record_code_output(output, prompt_id, metadata=metadata)
+            history.entries[-1].execution_output = output
+            step.update(executed=True, exit_code=execution.exit_code, timed_out=execution.timed_out,
+                        output=output, wall_seconds=metadata["wall_seconds"])
+            message = CONTINUE_MESSAGE
+    finally:
+        await log.close()
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+async def run_batch(tasks: List[Task], make_chat: Callable[[str], Chat], system_prompt: str, model: str,
+                    out, jobs: int = DEFAULT_JOBS, **options) -> List[dict]:
+    """
+    Run tasks on at most jobs workers, writing each result to out as a JSON line when
+    it is ready (so in completion order, not task order).
+
+    @return: the results, in task order.
+    """
+    if "blobs" not in options:
+        # one store for every task, so the system prompt they all log is kept once
+        log_dir = options.get("log_dir")
+        options["blobs"] = BlobStore(log_dir / "blobs" if log_dir is not None else None)
+    queue: asyncio.Queue = asyncio.Queue()
+    for index, task in enumerate(tasks):
+        queue.put_nowait((index, task))
+    results: List[Optional[dict]] = [None] * len(tasks)
+
+    async def worker():
+        while not queue.empty():
+            index, task = queue.get_nowait()
+            task_model = task.model or model
+            try:
+                result = await run_task(task, make_chat(task_model), system_prompt, task_model, **options)
+            except Exception as error:
+                # the log itself failed, or the backend could not be created
+                result = {"id": task.id, "model": task_model, "status": "error", "error": str(error)}
+            results[index] = result
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(jobs, len(tasks)))))
+    finally:
+        remove_spills()
+    return results
+
+
+def read_tasks(prompt: Optional[str], tasks_file: Optional[str], stdin=None) -> List[Task]:
+    """Tasks from -p TEXT, -p - (stdin is one task), --tasks FILE or --tasks - (JSONL on stdin)."""
+    stdin = stdin or sys.stdin
+    if tasks_file is not None:
+        if tasks_file == "-":
+            return parse_tasks(stdin)
+        with open(tasks_file) as f:
+            return parse_tasks(f)
+    text = stdin.read() if prompt in (None, "-") else prompt
+    return [Task(text.strip(), "1")] if text.strip() else []
+
+
+def main(args, make_chat: Callable[[str], Chat], system_prompt: str) -> int:
+    """Headless entry point, called by chatsh.main with its parsed arguments; returns the exit code."""
+    from chatsh.system_info import generate_system_description
+    try:
+        tasks = read_tasks(args.prompt, args.tasks)
+    except (OSError, ValueError) as error:
+        print(f"chatsh: cannot read tasks: {error}", file=sys.stderr)
+        return 2
+    reducer = None if args.no_reduce else ReducerConfig(max_tokens=args.output_budget)
+    history_store = None
+    if args.history_db:
+        from chatsh.history_store import HistoryStore
+        history_store = HistoryStore()
+
+    async def run():
+        description = await generate_system_description(refresh=args.refresh_system_info)
+        return await run_batch(tasks, make_chat, system_prompt + description, args.model, out,
+                               jobs=args.jobs, policy=AutoExecute(args.auto_execute),
+                               max_turns=args.max_turns, timeout=args.timeout, reducer=reducer,
+                               log_fsync=FsyncPolicy(args.log_fsync), history_store=history_store)
+
+    out = sys.stdout
+    # stdout carries only the JSON results; backends report errors with print()
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(run())
+    return 1 if any(result["status"] == "error" for result in results) else 0
@@ -0,0 +1,233 @@
+"""
+Content-addressed storage for the large text bodies held by long sessions.
+
+The interaction log and the conversation history keep a body longer than INLINE_LIMIT
+(a command output, the system prompt, a long reply) as a BlobRef: the SHA-256 of its
+UTF-8 bytes and its length. The bytes live in a file named after the digest and are read
+back only when the body is read, so between reads they sit in the page cache rather than
+in the process. Identical bodies share one file, whether they come from the same session
+(an output seen twice) or from every launch (the system prompt).
+
+Blobs are written by the event loop's thread pool, not the loop itself; until a blob is
+on disk its bytes are served from memory.
+
+The JSONL logs still hold every body in full, so the blobs are a cache of them that only
+running sessions use. Each process names the blobs it uses in a lease file
+(leases/<pid>). The first write of a process deletes the blobs that no live process
+leases, so the store holds about what the running sessions refer to.
+"""
+import asyncio
+import fcntl
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Set, Union
+
+# Bodies up to this many characters stay in the record
+INLINE_LIMIT = 1024
+# Bodies up to this many characters are interned, so repeats ("executed", "yes", "ls")
+# share one string
+INTERN_LIMIT = 20
+
+
+class BlobRef:
+    """A body stored in a BlobStore: the raw SHA-256 digest of its bytes, and its length in characters."""
+    __slots__ = ("digest", "length")
+
+    def __init__(self, digest: bytes, length: int):
+        self.digest = digest
+        self.length = length
+
+    def __eq__(self, other):
+        if not isinstance(other, BlobRef):
+            return NotImplemented
+        return self.digest == other.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return f"BlobRef({self.digest.hex()[:12]}, {self.length})"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # another user's process
+    return True
+
+
+class BlobStore:
+    def __init__(self, directory: Optional[Path] = None):
+        if directory is None:
+            from chatsh.interaction_log import default_log_dir
+            directory = default_log_dir() / "blobs"
+        self.directory = Path(directory)
+        # digests put so far, mapped to themselves so every ref shares one object
+        self._digests: Dict[bytes, bytes] = {}
+        # digest -> bytes of the blobs not on disk yet
+        self._pending: Dict[bytes, bytes] = {}
+        self._writes: Set[asyncio.Future] = set()
+        self._write_error: Optional[str] = None
+        self._swept = False
+        self._sweep_lock = threading.Lock()
+
+    def _path(self, digest: bytes) -> str:
+        # a plain string: pathlib would intern every digest it splits out of a path
+        name = digest.hex()
+        return os.path.join(self.directory, name[:2], name[2:])
+
+    def put(self, text: str) -> BlobRef:
+        data = text.encode("utf-8", "surrogatepass")
+        digest = hashlib.sha256(data).digest()
+        known = self._digests.get(digest)
+        if known is None:
+            known = self._digests[digest] = digest
+            self._pending[digest] = data
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._save(digest, data)  # not in a session: nothing to keep waiting
+                del self._pending[digest]
+            else:
+                write = loop.run_in_executor(None, self._save, digest, data)
+                self._writes.add(write)
+                write.add_done_callback(lambda write: self._saved(digest, write))
+        return BlobRef(known, len(text))
+
+    def _saved(self, digest: bytes, write: asyncio.Future) -> None:
+        self._writes.discard(write)
+        error = write.exception()
+        if error is None:
+            del self._pending[digest]
+        elif str(error) != self._write_error:
+            # the bytes stay in memory, so nothing is lost
+            print(f"chatsh: could not write to {self.directory}: {error}", file=sys.stderr)
+            self._write_error = str(error)
+
+    async def flush(self) -> None:
+        """Wait for the blobs being written."""
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    @contextmanager
+    def _locked(self, operation: int):
+        """Writers share the store's lock; a sweep takes it for itself."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    def _save(self, digest: bytes, data: bytes) -> None:
+        with self._sweep_lock:
+            if not self._swept:
+                self._swept = True
+                self.sweep()
+        path = self._path(digest)
+        with self._locked(fcntl.LOCK_SH):
+            # leased first, so no sweep can take the blob once it is there
+            os.makedirs(os.path.join(self.directory, "leases"), exist_ok=True)
+            with open(os.path.join(self.directory, "leases", str(os.getpid())), "a") as lease:
+                lease.write(digest.hex() + "\n")
+            if os.path.exists(path):
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written aside and renamed, so a reader never sees half a blob
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    def sweep(self) -> int:
+        """Delete the blobs that no live process leases, and the leases of dead ones; returns how many blobs went."""
+        leases = os.path.join(self.directory, "leases")
+        removed = 0
+        with self._locked(fcntl.LOCK_EX):
+            leased = set()
+            for name in os.listdir(leases) if os.path.isdir(leases) else []:
+                path = os.path.join(leases, name)
+                if not (name.isdigit() and _alive(int(name))):
+                    os.unlink(path)
+                    continue
+                with open(path) as lease:
+                    leased.update(line.strip() for line in lease)
+            for prefix in os.listdir(self.directory):
+                folder = os.path.join(self.directory, prefix)
+                if len(prefix) != 2 or not os.path.isdir(folder):
+                    continue
+                for name in os.listdir(folder):
+                    # half-written ones too: writers hold the lock, so none is being written
+                    if prefix + name not in leased:
+                        os.unlink(os.path.join(folder, name))
+                        removed += 1
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    pass  # not empty
+        return removed
+
+    def get(self, ref: BlobRef) -> str:
+        data = self._pending.get(ref.digest)
+        if data is None:
+            with open(self._path(ref.digest), "rb") as f:
+                data = f.read()
+        return data.decode("utf-8", "surrogatepass")
+
+    def store(self, text: Optional[str]) -> Union[str, BlobRef, None]:
+        """text itself if it is short enough to keep inline, else its BlobRef."""
+        if text is not None and len(text) > INLINE_LIMIT:
+            return self.put(text)
+        return text
+
+
+class BlobText:
+    """
+    A text attribute of a slotted record that may be kept in a BlobStore. The record
+    needs a slot named after the attribute with a leading underscore, and a `_blobs` slot
+    holding the store (or None to keep everything inline). Short values are interned.
+    """
+
+    def __set_name__(self, owner, name):
+        self.slot = "_" + name
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        value = getattr(record, self.slot)
+        if isinstance(value, BlobRef):
+            return record._blobs.get(value)
+        return value
+
+    def __set__(self, record, value):
+        if type(value) is str and len(value) <= INTERN_LIMIT:
+            value = sys.intern(value)
+        elif record._blobs is not None:
+            value = record._blobs.store(value)
+        setattr(record, self.slot, value)
+
+
+def text_length(record, name: str) -> int:
+    """The length of a BlobText attribute, without reading it back from the store."""
+    value = getattr(record, "_" + name)
+    if isinstance(value, BlobRef):
+        return value.length
+    return len(value) if value is not None else 0
+
+
+def use_blobs(record, blobs: Optional[BlobStore], *names: str) -> None:
+    """Move the record's BlobText attributes into blobs (after reading them back from any earlier store)."""
+    values = [getattr(record, name) for name in names]
+    record._blobs = blobs
+    for name, value in zip(names, values):
+        setattr(record, name, value)
@@ -1,7 +1,11 @@
 import os
+import time
+import asyncio
+import inspect
 import aiofiles
-from anthropic import AsyncAnthropic
+from functools import lru_cache
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 
 # Map of model shortcodes to full model names
 MODELS = {
@@ -16,6 +20,9 @@ MODELS = {
     'I': 'gemini-1.5-pro-exp-0801'
 }
 
+# Anthropic accepts at most this many cache_control blocks per request
+MAX_CACHE_BREAKPOINTS = 4
+
 def get_vendor_from_model(model):
     model = MODELS.get(model, model).lower()
     if model.startswith('gpt') or model.startswith('chatgpt'):
@@ -29,12 +36,33 @@ def get_vendor_from_model(model):
     else:
         raise ValueError(f"Unsupported model: {model}")
 
+@dataclass
+class UsageEvent:
+    """
+    Yielded by Chat.ask after the last text delta: token counts in the usage_to_dict
+    shape plus timing (time_to_first_token, warm_client).
+    """
+    usage: dict
+
+
 class Chat(ABC):
+    """
+    A conversation with one vendor. ask() is an async generator that yields the reply as
+    text deltas, then one UsageEvent; by then the turn has been added to messages, which
+    always holds plain {"role": "user"|"assistant", "content": str} dicts.
+    """
+    # Whether ask() takes prefill=, text the reply must continue from (see scheduler.py)
+    supports_prefill = False
+    # Headers of the latest response, for rate-limit pacing; None if the vendor gives none
+    response_headers = None
+
     def __init__(self):
         self.messages = []
+        # One usage dict per request, e.g. {"input_tokens": ..., "output_tokens": ...}
+        self.usage = []
 
     @abstractmethod
-    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False):
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False, history_cacheable=False):
         pass
 
     def back(self, steps):
@@ -42,44 +70,108 @@ class Chat(ABC):
         del self.messages[-steps:]
         return removed_messages
 
+    def _finish_turn(self, user_message, assistant_message, usage: dict) -> UsageEvent:
+        """Add a completed turn to the history and usage, and return its UsageEvent."""
+        self.usage.append(usage)
+        self.messages.extend([
+            {"role": "user", "content": user_message},
+            {"role": 'assistant', "content": assistant_message}
+        ])
+        return UsageEvent(usage)
+
 class AnthropicChat(Chat):
-    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False):
+    supports_prefill = True
+
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False, history_cacheable=False, prefill=""):
+        """With prefill, the reply continues that text; only the continuation is yielded and recorded."""
         model = MODELS.get(model, model)
-        client = AsyncAnthropic(
-            api_key=await get_token('anthropic'),
-            default_headers={
-                "anthropic-beta": "prompt-caching-2024-07-31"  # Enable prompt caching
-            }
-        )
+        started = time.perf_counter()
+        client, warm = get_client('anthropic', await get_token('anthropic'))
 
         cached_system = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
         prompt_system = cached_system if system_cacheable else system
-        params = {"system": prompt_system, "model": model, "temperature": temperature, "max_tokens": max_tokens}
+        params = {"system": prompt_system, "model": model, "max_tokens": max_tokens}
+        if accepts_parameter(type(client.messages).stream, "temperature"):
+            params["temperature"] = temperature
+
+        messages = self.messages + [{"role": "user", "content": user_message}]
+        if history_cacheable:
+            breakpoints = MAX_CACHE_BREAKPOINTS - (1 if system_cacheable else 0)
+            messages = plan_cache_breakpoints(messages, breakpoints)
+        if prefill.rstrip():
+            # the API rejects a final assistant turn that ends in whitespace
+            messages = messages + [{"role": "assistant", "content": prefill.rstrip()}]
+
+        assistant_message = ""
+        first_token_at = None
+        if stream:
+            async with client.messages.stream(**params, messages=messages) as stream:
+                self.response_headers = getattr(getattr(stream, "response", None), "headers", None)
+                async for text in stream.text_stream:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    assistant_message += text
+                    yield text
+                usage = (await stream.get_final_message()).usage
+        else:
+            response = await client.messages.create(**params, messages=messages)
+            first_token_at = time.perf_counter()
+            assistant_message = "".join(block.text for block in response.content if block.type == "text")
+            usage = response.usage
+            yield assistant_message
+
+        yield self._finish_turn(user_message, assistant_message, {
+            **usage_to_dict(usage),
+            "time_to_first_token": round((first_token_at or time.perf_counter()) - started, 3),
+            "warm_client": warm,
+        })
+
+
+
+@lru_cache(maxsize=None)
+def accepts_parameter(method, name) -> bool:
+    """Whether an SDK method takes parameter name; recent anthropic SDKs no longer take temperature."""
+    return name in inspect.signature(method).parameters
+
+
+def plan_cache_breakpoints(messages, max_breakpoints):
+    """
+    Return a copy of messages with ephemeral cache breakpoints on the newest user turns.
+
+    Every earlier turn is a stable prefix, so marking the latest user message writes the
+    cache for the whole conversation and the next request reads it back. The older
+    breakpoints keep a hit available after a `back` command trims the newest turns.
+    Breakpoints are recomputed on every request, so they move forward as the
+    conversation grows and never exceed max_breakpoints.
+    """
+    planned = list(messages)
+    if max_breakpoints <= 0:
+        return planned
+
+    user_indices = [i for i, message in enumerate(planned) if message["role"] == "user"]
+    for i in user_indices[-max_breakpoints:]:
+        content = planned[i]["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        content = [dict(block) for block in content]
+        content[-1]["cache_control"] = {"type": "ephemeral"}
+        planned[i] = {**planned[i], "content": content}
+    return planned
 
-        try:
-            assistant_message = ""
-            if stream:
-                async with client.messages.stream(**params, messages=self.messages + [{"role": "user", "content": user_message}]) as stream:
-                    async for text in stream.text_stream:
-                        assistant_message += text
-                        yield text
-            else:
-                response = await client.messages.create(**params, messages=self.messages + [{"role": "user", "content": user_message}])
-                assistant_message = response.content
-                yield response.content
-
-            self.messages.extend([
-                {"role": "user", "content": user_message},
-                {"role": 'assistant', "content": assistant_message}
-            ])
-        except Exception as e:
-            print(f"\nError occurred: {str(e)}")
-            print("The last message was not added to the conversation history.")
-            raise
 
+def cache_status(usage: dict) -> str:
+    """Summarise a usage dict as a prompt-cache 'hit' or 'miss'."""
+    return "hit" if usage.get("cache_read_input_tokens") else "miss"
+
+
+def usage_to_dict(usage) -> dict:
+    """Flatten a vendor usage object into plain token counts."""
+    fields = ["input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"]
+    return {name: getattr(usage, name, None) or 0 for name in fields}
 
 
 def chat(model) -> Chat:
+    from chatsh.chat_vendors import GeminiChat, OpenAIChat
     vendor = get_vendor_from_model(model)
     if vendor == 'openai':
         return OpenAIChat()
@@ -90,13 +182,95 @@ def chat(model) -> Chat:
     else:
         raise ValueError(f"Unsupported vendor: {vendor}")
 
+# (vendor, api_key) -> (event loop, client); one pooled client per key for the whole process
+_clients = {}
+# token path -> (mtime, token)
+_tokens = {}
+
+def get_client(vendor, api_key):
+    """
+    Return a long-lived client for vendor/api_key and whether it was already warm.
+
+    Reusing the client keeps its HTTP connection pool, so later turns skip the TCP and
+    TLS handshakes. Clients are bound to the event loop that created them; one made by
+    prepare_client is taken over by the first loop that asks for it.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _clients.get((vendor, api_key))
+    if entry is not None and entry[0] is loop:
+        return entry[1], True
+    if entry is not None and entry[0] is None:
+        _clients[(vendor, api_key)] = (loop, entry[1])
+        return entry[1], False
+
+    client = make_client(vendor, api_key)
+    _clients[(vendor, api_key)] = (loop, client)
+    return client, False
+
+def make_client(vendor, api_key):
+    # Vendor SDKs are imported on first use; anthropic alone takes longer to import than
+    # the rest of chatsh takes to start.
+    if vendor == 'anthropic':
+        from anthropic import AsyncAnthropic
+        return AsyncAnthropic(
+            api_key=api_key,
+            default_headers={
+                "anthropic-beta": "prompt-caching-2024-07-31"  # Enable prompt caching
+            }
+        )
+    elif vendor == 'openai':
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=api_key)
+    else:
+        raise ValueError(f"Unsupported vendor: {vendor}")
+
+def prepare_client(vendor, api_key):
+    """
+    Make the client for vendor/api_key before any event loop runs, as a session forked by
+    the daemon does while main() starts; warm_clients then connects it.
+    """
+    if (vendor, api_key) not in _clients:
+        _clients[(vendor, api_key)] = (None, make_client(vendor, api_key))
+
+async def warm_clients():
+    """
+    Open a connection for every client prepare_client made, so the first request skips the
+    TCP and TLS handshakes. Listing the models is free; a failure is left to that request.
+    """
+    async def warm(vendor, api_key):
+        client, _ = get_client(vendor, api_key)
+        try:
+            await client.models.list()
+        except Exception:
+            pass
+    prepared = [key for key, (owner, _) in _clients.items() if owner is None]
+    await asyncio.gather(*(warm(vendor, api_key) for vendor, api_key in prepared))
+
+def token_path(vendor):
+    return os.path.join(os.path.expanduser('~'), '.config', f'{vendor}.token')
+
+def has_token(vendor):
+    """Whether the user has a token of their own for vendor, rather than the loaner."""
+    return os.path.isfile(token_path(vendor))
+
 async def get_token(vendor):
-    token_path = os.path.join(os.path.expanduser('~'), '.config', f'{vendor}.token')
+    path = token_path(vendor)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    cached = _tokens.get(path)
+    if mtime is not None and cached is not None and cached[0] == mtime:
+        return cached[1]
+
     try:
-        async with aiofiles.open(token_path, 'r') as f:
-            return (await f.read()).strip()
+        async with aiofiles.open(path, 'r') as f:
+            token = (await f.read()).strip()
+        if mtime is not None:
+            _tokens[path] = (mtime, token)
+        return token
     except Exception as err:
-        print(f"Error reading token from {token_path}: {err}")
+        print(f"Error reading token from {path}: {err}")
         if vendor == 'anthropic':
             print("As a courtesy, xida@renresear.ch has provided a temporary token for you to use. Please use it for no more than 3 chats or he will be very sad and disappointed at you.")
             # hopefully base64 protects us against some scrapers
@@ -1,41 +1,125 @@
+"""
+OpenAI and Gemini backends, behind the same streaming contract as AnthropicChat.
 
-class OpenAIChat(Chat):
-    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False):
-        from openai import AsyncOpenAI
-        model = MODELS.get(model, model)
-        client = AsyncOpenAI(api_key=await get_token('openai'))
+Both keep Chat.messages in the shared {"role", "content"} shape and convert it to the
+vendor's format per request, so back, resume and the response cache work the same for
+every vendor.
+"""
+import asyncio
+import threading
+import time
 
-        if not self.messages:
-            self.messages.append({"role": "system", "content": system})
+from chatsh.chat import MODELS, Chat, get_client, get_token, usage_to_dict
 
-        self.messages.append({"role": "user", "content": user_message})
+# Queue item kinds passed from a vendor thread to the event loop
+_TEXT, _USAGE, _ERROR, _DONE = range(4)
 
-        params = {"messages": self.messages, "model": model, "temperature": temperature, "max_tokens": max_tokens, "stream": stream}
 
-        result = ""
+async def stream_in_thread(produce):
+    """
+    Run a blocking producer in a worker thread and yield what it emits, so a synchronous
+    SDK neither blocks the event loop nor delays Ctrl-C.
+
+    produce(emit, stopped) calls emit(kind, value) for every item and should return once
+    stopped.is_set(); that is set when the consumer stops early (e.g. on Ctrl-C).
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+
+    def emit(kind, value=None):
+        loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+
+    def run():
         try:
-            async for chunk in await client.chat.completions.create(**params):
+            produce(emit, stopped)
+        except BaseException as error:
+            emit(_ERROR, error)
+        finally:
+            emit(_DONE)
+
+    worker = loop.run_in_executor(None, run)
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == _DONE:
+                break
+            if kind == _ERROR:
+                raise value
+            yield kind, value
+    finally:
+        stopped.set()
+        if worker.done():
+            await worker
+
+
+class OpenAIChat(Chat):
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False, history_cacheable=False):
+        # OpenAI caches long prompt prefixes automatically; the cacheable flags have nothing to mark
+        model = MODELS.get(model, model)
+        started = time.perf_counter()
+        client, warm = get_client('openai', await get_token('openai'))
+
+        messages = [{"role": "system", "content": system}] + self.messages + [{"role": "user", "content": user_message}]
+        params = {"messages": messages, "model": model, "temperature": temperature, "max_tokens": max_tokens}
+
+        result = ""
+        first_token_at = None
+        usage = None
+        if stream:
+            response = await client.chat.completions.create(
+                **params, stream=True, stream_options={"include_usage": True})
+            self.response_headers = getattr(getattr(response, "response", None), "headers", None)
+            async for chunk in response:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
                 text = chunk.choices[0].delta.content or ""
-                print(text, end='', flush=True)
-                result += text
+                if text:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    result += text
+                    yield text
+        else:
+            response = await client.chat.completions.create(**params)
+            first_token_at = time.perf_counter()
+            result = response.choices[0].message.content or ""
+            usage = response.usage
+            yield result
+
+        yield self._finish_turn(user_message, result, {
+            **openai_usage_to_dict(usage),
+            "time_to_first_token": round((first_token_at or time.perf_counter()) - started, 3),
+            "warm_client": warm,
+        })
+
 
-            self.messages.append({"role": 'assistant', "content": result})
-        except Exception as e:
-            print(f"\nError occurred: {str(e)}")
-            print("The last message was not added to the conversation history.")
-            self.messages.pop()  # Remove the last user message
-            raise
+def openai_usage_to_dict(usage) -> dict:
+    """OpenAI counts cached tokens inside prompt_tokens; split them out like Anthropic does."""
+    if usage is None:
+        return usage_to_dict(None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+    return {
+        "input_tokens": (usage.prompt_tokens or 0) - cached,
+        "output_tokens": usage.completion_tokens or 0,
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": cached,
+    }
 
-        return result
 
 class GeminiChat(Chat):
-    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False):
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False, history_cacheable=False):
         import google.generativeai as genai
         model = MODELS.get(model, model)
+        started = time.perf_counter()
         genai.configure(api_key=await get_token('google'))
 
-        model = genai.GenerativeModel(model)
-        chat = model.start_chat(history=self.messages)
+        generative_model = genai.GenerativeModel(model, system_instruction=system)
+        history = [{"role": "model" if message["role"] == "assistant" else "user", "parts": [message["content"]]}
+                   for message in self.messages]
+        chat = generative_model.start_chat(history=history)
 
         generation_config = genai.types.GenerationConfig(
             max_output_tokens=max_tokens,
@@ -49,25 +133,42 @@ class GeminiChat(Chat):
             {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
         ]
 
+        def produce(emit, stopped):
+            # the SDK is synchronous, so the request and its iteration run in a worker thread
+            response = chat.send_message(user_message, generation_config=generation_config,
+                                         safety_settings=safety_settings, stream=stream)
+            for chunk in (response if stream else [response]):
+                if stopped.is_set():
+                    return
+                emit(_TEXT, chunk.text)
+            emit(_USAGE, getattr(response, "usage_metadata", None))
+
         result = ""
-        try:
-            response = chat.send_message(user_message, generation_config=generation_config, safety_settings=safety_settings, stream=stream)
+        first_token_at = None
+        usage = None
+        async for kind, value in stream_in_thread(produce):
+            if kind == _USAGE:
+                usage = value
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            result += value
+            yield value
 
-            if stream:
-                for chunk in response:
-                    text = chunk.text
-                    print(text, end='', flush=True)
-                    result += text
-            else:
-                result = response.text
-
-            self.messages.extend([
-                {"role": "user", "parts": [{"text": user_message}]},
-                {"role": 'model', "parts": [{"text": result}]}
-            ])
-        except Exception as e:
-            print(f"\nError occurred: {str(e)}")
-            print("The last message was not added to the conversation history.")
-            raise
-
-        return result
\ No newline at end of file
+        yield self._finish_turn(user_message, result, {
+            **gemini_usage_to_dict(usage),
+            "time_to_first_token": round((first_token_at or time.perf_counter()) - started, 3),
+            "warm_client": False,
+        })
+
+
+def gemini_usage_to_dict(usage) -> dict:
+    if usage is None:
+        return usage_to_dict(None)
+    cached = getattr(usage, "cached_content_token_count", 0) or 0
+    return {
+        "input_tokens": (getattr(usage, "prompt_token_count", 0) or 0) - cached,
+        "output_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": cached,
+    }
@@ -1,42 +1,119 @@
 #!/usr/bin/env python3
 
 import readline
+import argparse
 import subprocess
 import asyncio
-import os
 import sys
 from datetime import datetime
 import re
-from chatsh.chat import chat, MODELS
+from chatsh.chat import Chat, chat, cache_status, warm_clients, MODELS, UsageEvent
 from pathlib import Path
-import shutil
+import inspect
+import time
 from rich.console import Console
-from rich.markdown import Markdown
-from rich.syntax import Syntax
-from rich.panel import Panel
-from rich.live import Live
 from rich.prompt import Prompt, Confirm
 from prompt_toolkit import PromptSession
 from prompt_toolkit.formatted_text import HTML
 from prompt_toolkit.styles import Style
-from typing import Tuple, List, Optional
-from chatsh.interaction_log import InteractionLog, InteractionType
+from typing import Callable, Tuple, List, Optional
+from chatsh.interaction_log import FsyncPolicy, InteractionLog, InteractionType
+# rich.markdown, rich.syntax and chatsh.render (markdown-it, pygments) are imported where
+# they are used and warmed up in the background, so the first prompt appears quickly.
+from chatsh.batch import DEFAULT_JOBS, DEFAULT_MAX_TURNS, AutoExecute
+from chatsh.blob_store import BlobStore
+from chatsh.code_preview import CodePreview, SpeculativePreview
+from chatsh.execution import ExecutionResult, execute_code, remove_spills
+from chatsh.fanout import FanOutChat, Reply, model_label, parse_models
+from chatsh.parallel import DEFAULT_JOBS as PARALLEL_JOBS, BlockPlan, format_block_outputs, plan_blocks, run_blocks
+from chatsh.reducer import ReducerConfig, reduce_output
+from chatsh.scheduler import MAX_RETRIES, RateLimiter, ScheduledChat
+from chatsh.shell_session import ShellSession
+from chatsh.system_info import generate_system_description
+from chatsh.telemetry import format_turn_metrics, turn_metrics
 
 
 console = Console()
 DEFAULT_MODEL = "s"
-COMMAND_DESCRIPTIONS = {
-    "rg": "faster replacement for grep",
-    "fd": "faster alternative to find",
-    "jq": "command-line JSON processor",
-    "tldr": "simplified man pages",
-    "ag": "code-searching tool similar to ack",
-    "tmux": "terminal multiplexer",
-}
-
-def setup_environment():
-    MODEL = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MODEL
-    print(f"Welcome to ChatSH. Model: {MODELS.get(MODEL, MODEL)}\n")
+
+def positive_int(text: str) -> int:
+    """argparse type for a count of workers: zero or fewer would run nothing."""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return value
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="chatsh", description="Syntax-highlighted LLM-controlled shell.")
+    parser.add_argument("model", nargs="?", default=DEFAULT_MODEL,
+                        help=f"model shortcode ({', '.join(MODELS)}) or full model name; "
+                             "several separated by commas (e.g. s,g,i) ask them all in parallel")
+    parser.add_argument("--flat", action="store_true",
+                        help="resend the whole transcript as one message each turn (legacy mode)")
+    parser.add_argument("--usage", action="store_true",
+                        help="print token usage after every turn")
+    parser.add_argument("--timeout", type=float, default=None, metavar="SECONDS",
+                        help="kill commands that run longer than this (Ctrl-C always works)")
+    parser.add_argument("--output-budget", type=int, default=ReducerConfig.max_tokens, metavar="TOKENS",
+                        help="token budget for each command output sent to the model")
+    parser.add_argument("--keep-outputs", type=int, default=None, metavar="TURNS",
+                        help="with --flat, elide command outputs older than this many turns")
+    parser.add_argument("--no-reduce", action="store_true",
+                        help="send command output without deduplication or truncation")
+    parser.add_argument("--fresh-shell", action="store_true",
+                        help="run every command in a new shell instead of one persistent session")
+    parser.add_argument("--refresh-system-info", action="store_true",
+                        help="recompute the cached system description")
+    parser.add_argument("--log-fsync", choices=[policy.value for policy in FsyncPolicy],
+                        default=FsyncPolicy.BATCH.value,
+                        help="when the interaction log is fsynced: never, after each batch, or every record")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None, metavar="FILE",
+                        help="continue the session in an interaction log (default: the latest)")
+    parser.add_argument("--failover", default="", metavar="MODELS",
+                        help="models to switch to, in order, when a request keeps failing (e.g. h,g)")
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES, metavar="N",
+                        help="retries of a rate-limited, overloaded or dropped request before failing over")
+    parser.add_argument("--cache", action="store_true",
+                        help="answer repeated deterministic requests from the on-disk response cache")
+    parser.add_argument("--replay", action="store_true",
+                        help="serve replies only from the response cache; a miss is an error (no network)")
+    parser.add_argument("--parallel", type=positive_int, nargs="?", const=PARALLEL_JOBS, default=None, metavar="JOBS",
+                        help="run every sh block of a reply, independent ones at the same time (default 4 at once)")
+    parser.add_argument("--context-budget", type=int, default=DEFAULT_BUDGET, metavar="TOKENS",
+                        help="summarize older turns as the conversation nears this size (0 disables)")
+    parser.add_argument("--summary-model", metavar="MODEL",
+                        help="model that writes those summaries (default: a cheap one of the session's vendor)")
+    parser.add_argument("--history-db", action="store_true",
+                        help="also index this session in the searchable history database as it runs")
+    daemon = parser.add_argument_group("daemon", "a warm background server that later chatsh commands attach to")
+    daemon.add_argument("--daemon", action="store_true",
+                        help="start the daemon; chatsh in a terminal then runs its sessions in it")
+    daemon.add_argument("--stop-daemon", action="store_true",
+                        help="stop the daemon (sessions already running carry on)")
+    daemon.add_argument("--no-daemon", action="store_true",
+                        help="run in this process even when a daemon is listening")
+    headless = parser.add_argument_group("headless mode", "run tasks without a terminal; results go to stdout as JSON lines")
+    headless.add_argument("-p", "--prompt", metavar="TASK",
+                          help="run one task and exit (- reads it from stdin, as does piping into chatsh)")
+    headless.add_argument("--tasks", metavar="FILE",
+                          help="run every task in a JSONL file (- for stdin)")
+    headless.add_argument("--jobs", type=positive_int, default=DEFAULT_JOBS, metavar="N",
+                          help="tasks run at the same time")
+    headless.add_argument("--auto-execute", choices=[policy.value for policy in AutoExecute],
+                          default=AutoExecute.NEVER.value,
+                          help="which commands run without confirmation: none, those without risk patterns, or all")
+    headless.add_argument("--max-turns", type=int, default=DEFAULT_MAX_TURNS, metavar="N",
+                          help="requests per task before giving up")
+    args = parser.parse_args(argv)
+    if args.prompt is not None or args.tasks is not None:
+        for flag, value in (("--parallel", args.parallel), ("--resume", args.resume)):
+            if value is not None:
+                parser.error(f"{flag} does not apply to headless tasks (-p/--tasks)")
+    return args
+
+def setup_environment(args):
+    MODEL = args.model
+    print(f"Welcome to ChatSH. Model: {', '.join(MODELS.get(m, m) for m in parse_models(MODEL))}\n")
     return MODEL
 
 def load_system_prompt():
@@ -44,70 +121,234 @@ def load_system_prompt():
     with open(SYSTEM_PROMPT_FILE, "r") as f:
         return f.read()
 
-async def get_shell_info():
-    proc = await asyncio.create_subprocess_shell(
-        'uname -v && $SHELL --version | head -n 1',
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    stdout, _ = await proc.communicate()
-    return stdout.decode().strip()
+def preload_ui_modules():
+    import rich.markdown, rich.panel, rich.syntax, chatsh.render  # noqa: F401
 
-def get_available_commands():
-    return [f"{cmd}: {desc}" for cmd, desc in COMMAND_DESCRIPTIONS.items() if shutil.which(cmd)]
+async def build_system_prompt(refresh: bool = False) -> str:
+    """Compute the system prompt and warm up the rendering modules, off the startup path."""
+    loop = asyncio.get_running_loop()
+    description, _ = await asyncio.gather(
+        generate_system_description(refresh=refresh),
+        loop.run_in_executor(None, preload_ui_modules)
+    )
+    return load_system_prompt() + description
 
-def generate_system_description():
-    shell_info = asyncio.run(get_shell_info())
-    available_commands = get_available_commands()
-    return f"""
-- system information:
-{shell_info}
+def format_usage_report(usage: List[dict], last_only: bool = False) -> str:
+    """One line per request: input tokens (with growth since the previous turn) and output tokens."""
+    lines = []
+    previous_input = None
+    for turn, entry in enumerate(usage, 1):
+        total_input = entry["input_tokens"] + entry["cache_creation_input_tokens"] + entry["cache_read_input_tokens"]
+        delta = "" if previous_input is None else f" ({total_input - previous_input:+d})"
+        model = f" ({entry['model']})" if "model" in entry else ""
+        line = (f"turn {turn}{model}: input {total_input}{delta}, output {entry['output_tokens']}, "
+                f"cached {entry['cache_read_input_tokens']} ({cache_status(entry)})")
+        if entry.get("retries"):
+            line += f", {entry['retries']} retries" + (" (resumed mid-reply)" if entry.get("resumed") else "")
+        if entry.get("replayed"):
+            line += ", replayed from the response cache"
+        elif "time_to_first_token" in entry:
+            client = "warm" if entry.get("warm_client") else "cold"
+            line += f", first token {entry['time_to_first_token']:.2f}s ({client} client)"
+        lines.append(line)
+        previous_input = total_input
+    if last_only:
+        return lines[-1] if lines else ""
+    return "\n".join(lines)
 
-Available commands:
-{os.linesep.join(available_commands)}
-"""
+async def process_assistant_response(chat_instance, full_message: str, system_prompt: str,
+                                     model: str, preview: Optional[SpeculativePreview] = None
+                                     ) -> Tuple[str, Optional[dict], dict]:
+    """
+    Stream a reply from any backend into the terminal, feeding preview as it arrives.
 
-async def execute_code(code):
-    try:
-        proc = await asyncio.create_subprocess_shell(
-            code,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await proc.communicate()
-        return f"{stdout.decode().strip()}{stderr.decode().strip()}"
-    except Exception as error:
-        return str(error)
-
-async def process_assistant_response(chat_instance, full_message: str, system_prompt: str, model: str) -> str:
-    assistant_message = ""
-    with Live(console=console, refresh_per_second=4) as live:
-        async for chunk in chat_instance.ask(full_message, system=system_prompt, model=model, max_tokens=8192, system_cacheable=True, stream=True):
-            assistant_message += chunk
-            live.update(Markdown(assistant_message))
+    @return: the reply text, its usage dict (None if the backend reported none) and the
+    turn's telemetry.turn_metrics.
+    """
+    from chatsh.render import StreamingMarkdown
+    chunks = []
+    usage = None
+    started = time.perf_counter()
+    first_token_at = finished = None
+    render_seconds = 0.0
+    renderer = StreamingMarkdown(console)
+    with renderer:
+        async for chunk in chat_instance.ask(full_message, system=system_prompt, model=model, max_tokens=8192, system_cacheable=True, history_cacheable=True, stream=True):
+            if isinstance(chunk, UsageEvent):
+                usage = chunk.usage
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunks.append(chunk)
+            render_started = time.perf_counter()
+            renderer.feed(chunk)
+            render_seconds += time.perf_counter() - render_started
+            if preview is not None:
+                preview.feed(chunk)
+        finished = time.perf_counter()
+    render_seconds += time.perf_counter() - finished  # rendering the tail on exit
     console.print()
-    return assistant_message
+    answered_by = (usage or {}).get("model", model)  # fan-out names the model that answered
+    metrics = turn_metrics(usage, MODELS.get(answered_by, answered_by),
+                           started, first_token_at, finished, render_seconds)
+    return "".join(chunks), usage, metrics
     
-async def handle_code_execution(codes: List[str], interaction_log: InteractionLog, parent_id: int) -> str:
+def print_command_output(stream: str, text: str):
+    console.print(text, end="", style="red" if stream == "stderr" else None,
+                  markup=False, highlight=False, soft_wrap=True)
+
+def format_execution_summary(result: ExecutionResult) -> str:
+    if result.timed_out:
+        status = "timed out"
+    elif result.cancelled:
+        status = "cancelled"
+    else:
+        status = f"exit {result.exit_code}"
+    summary = f"{status}, stdout {result.stdout.total_bytes} bytes, stderr {result.stderr.total_bytes} bytes"
+    for window in (result.stdout, result.stderr):
+        if window.spill_path:
+            summary += f"\nfull {window.name}: {window.spill_path}"
+    return summary
+
+async def handle_code_execution(codes: List[str], interaction_log: InteractionLog, parent_id: int,
+                                timeout: Optional[float] = None, reducer: Optional[ReducerConfig] = None,
+                                shell: Optional[ShellSession] = None,
+                                preview: Optional[CodePreview] = None) -> str:
+    from rich.markdown import Markdown
+    from rich.panel import Panel
+    from rich.syntax import Syntax
     if codes:
         combined_code = '\n'.join(codes)
         console.print(Panel(Syntax(combined_code, "sh", theme="monokai", line_numbers=True)))
         
-        prompt_id = await interaction_log.record_code_execution_prompt(combined_code, parent_id)
+        prompt_id = await interaction_log.record_code_execution_prompt(
+            combined_code, parent_id, metadata=preview.metadata() if preview is not None else None)
+        if preview is not None:
+            print_code_preview(preview)
         
-        if Confirm.ask("Execute the code?", default=True):
+        careful = preview is not None and preview.should_confirm_carefully
+        if Confirm.ask("Execute the code?", default=not careful):
             await interaction_log.record_code_execution_decision(True, prompt_id)
-            output = await execute_code(combined_code)
+            run = shell.run if shell is not None else execute_code
+            started = time.perf_counter()
+            result = await run(combined_code, on_output=print_command_output, timeout=timeout)
+            wall_seconds = time.perf_counter() - started
             console.print()
-            console.print(Panel(Syntax(output, "sh", theme="monokai")))
-            await interaction_log.record_code_output(output, prompt_id)
+            console.print(f"[dim]{format_execution_summary(result)}[/dim]", highlight=False)
+            if shell is not None and not shell.alive:
+                console.print("[dim]The shell exited; the next command starts a fresh one.[/dim]")
+            output = result.for_model()
+            metadata = result.metadata()
+            metadata["wall_seconds"] = round(wall_seconds, 4)
+            if reducer is not None:
+                output, metadata["reduction"] = reduce_output(output, reducer)
+            await interaction_log.record_code_output(output, prompt_id, metadata=metadata)
             return output
         else:
             await interaction_log.record_code_execution_decision(False, prompt_id)
             console.print(Markdown('Execution skipped.'))
-            return "Command skipped.\n"
+            return SKIPPED_OUTPUT
     return ""
 
+async def handle_parallel_execution(codes: List[str], interaction_log: InteractionLog, parent_id: int,
+                                    jobs: int = PARALLEL_JOBS, timeout: Optional[float] = None,
+                                    reducer: Optional[ReducerConfig] = None, shell: Optional[ShellSession] = None,
+                                    previews: Optional[List[CodePreview]] = None) -> str:
+    """Like handle_code_execution, for every block of the reply, with a panel and a log record per block."""
+    from rich.markdown import Markdown
+    from rich.panel import Panel
+    from rich.syntax import Syntax
+    from rich.text import Text
+    plans = plan_blocks(codes)
+    previews = previews or [None] * len(plans)
+    prompt_ids = []
+    for plan, preview in zip(plans, previews):
+        console.print(Panel(Syntax(plan.code, "sh", theme="monokai", line_numbers=True),
+                            title=f"block {plan.index + 1}", title_align="left",
+                            subtitle=plan.describe(), subtitle_align="left"))
+        if preview is not None:
+            print_code_preview(preview)
+        metadata = {"block": plan.index, "depends_on": plan.depends_on, "barrier": plan.barrier}
+        if preview is not None:
+            metadata.update(preview.metadata())
+        prompt_ids.append(await interaction_log.record_code_execution_prompt(plan.code, parent_id, metadata=metadata))
+
+    careful = any(preview is not None and preview.should_confirm_carefully for preview in previews)
+    execute = Confirm.ask(f"Execute the {len(plans)} blocks?", default=not careful)
+    for prompt_id in prompt_ids:
+        await interaction_log.record_code_execution_decision(execute, prompt_id)
+    if not execute:
+        console.print(Markdown('Execution skipped.'))
+        return SKIPPED_OUTPUT
+
+    outputs = {}
+
+    async def on_finish(plan: BlockPlan, result: ExecutionResult, wall_seconds: float):
+        output = result.for_model()
+        metadata = result.metadata()
+        metadata.update(block=plan.index, wall_seconds=round(wall_seconds, 4))
+        if reducer is not None:
+            output, metadata["reduction"] = reduce_output(output, reducer)
+        outputs[plan.index] = output
+        await interaction_log.record_code_output(output, prompt_ids[plan.index], metadata=metadata)
+        summary, _, spills = format_execution_summary(result).partition("\n")
+        console.print(Panel(Text(output.strip() or "(no output)"), title=f"block {plan.index + 1}: {summary}",
+                            title_align="left", border_style="red" if result.exit_code else "dim"))
+        if spills:
+            console.print(f"[dim]{spills}[/dim]", highlight=False)
+
+    # blocks that change shell state need a shell to change, even with --fresh-shell
+    session = shell if shell is not None else ShellSession()
+    try:
+        await run_blocks(plans, session, jobs=jobs, timeout=timeout, on_finish=on_finish)
+    finally:
+        if shell is None:
+            await session.close()
+    return format_block_outputs(outputs)
+
+async def choose_fanout_reply(fanout: FanOutChat) -> str:
+    """Show the other models' answers once they finish and ask which one continues."""
+    from rich.markdown import Markdown
+    from rich.panel import Panel
+    waiting = [name for name, reply in fanout.replies.items() if not reply.done]
+    if waiting:
+        console.print(f"[dim]Waiting for {', '.join(waiting)} (Ctrl-C to skip)...[/dim]")
+    if fanout.failed_lead is not None:
+        console.print(f"[dim]{fanout.failed_lead} failed mid-reply; the answer after the rule "
+                      f"is from {fanout.lead}[/dim]")
+    await fanout.wait_for_others()
+    alternatives = fanout.alternatives()
+    for reply in alternatives:
+        console.print(Panel(Markdown(reply.text), title=model_label(reply.model), title_align="left"))
+    for reply in fanout.replies.values():
+        if reply.error is not None:
+            console.print(f"[dim]{reply.model} failed: {reply.error}[/dim]")
+    if not alternatives:
+        return fanout.lead
+    choices = [fanout.lead] + [reply.model for reply in alternatives]
+    return Prompt.ask("Continue with the answer from", choices=choices, default=fanout.lead)
+
+def reply_metadata(reply: Reply) -> dict:
+    metadata = {"model": reply.model, "chosen": False}
+    if reply.usage:
+        metadata["usage"] = reply.usage
+    if reply.error is not None:
+        metadata["error"] = str(reply.error)
+    elif not reply.done:
+        metadata["incomplete"] = True
+    return metadata
+
+def print_retry_notice(notice: str):
+    console.print(notice, style="dim", markup=False, highlight=False)
+
+def print_code_preview(preview: CodePreview):
+    if preview.syntax_ok is False:
+        console.print(f"[bold red]Syntax check failed:[/bold red] {preview.syntax_error}", highlight=False)
+    if preview.risk != "low":
+        color = "red" if preview.risk == "high" else "yellow"
+        console.print(f"[bold {color}]{preview.risk.capitalize()} risk:[/bold {color}] {', '.join(preview.reasons)}",
+                      highlight=False)
+
 class UndeletablePrompt:
     def __init__(self):
         self.prompt_style = Style.from_dict({
@@ -124,6 +365,7 @@ class UndeletablePrompt:
         return await self.prompt_session.prompt_async()
 
 async def handle_exit(user_message: str, interaction_log: InteractionLog):
+    from rich.markdown import Markdown
     if user_message.lower().startswith("good bot"):
         message = "Thank you for the compliment! See you next time."
         console.print(Markdown(message))
@@ -137,20 +379,72 @@ async def handle_exit(user_message: str, interaction_log: InteractionLog):
         console.print(Markdown(message))
         await interaction_log.record_exit(f"conversation ended: {message}")
     
+    # the transcript is uploaded below, so it must be complete on disk
+    await interaction_log.flush()
     log_file = interaction_log.current_file
     console.print(f"Conversation transcript saved to: {log_file}")
     subprocess.run(["gh", "gist", "edit", "d0976d9e693afaaca5befd6a0b52b698", "-a", str(log_file)])
 
-from chatsh.conversation import ConversationHistory, ConversationEntry
+from chatsh.conversation import SKIPPED_OUTPUT, ConversationHistory, ConversationEntry
+from chatsh.resume import PINNED_KEY, SYSTEM_PROMPT_KEY, find_log, replay
+from chatsh.context import DEFAULT_BUDGET, ContextManager, make_summarizer, pick_summary_model
+
+async def main_loop(chat_instance, system_prompt, model: str, flat: bool = False, show_usage: bool = False,
+                    timeout: Optional[float] = None, reducer: Optional[ReducerConfig] = None,
+                    persistent_shell: bool = True, log_fsync: FsyncPolicy = FsyncPolicy.BATCH,
+                    history_store=None, resume_from: Optional[Path] = None,
+                    context_budget: Optional[int] = DEFAULT_BUDGET, summary_model: Optional[str] = None,
+                    parallel_jobs: Optional[int] = None, blobs: Optional[BlobStore] = None):
+    """
+    Run the REPL. system_prompt may be a string or an awaitable producing one, which is
+    then computed while the user types the first message.
+
+    With resume_from, the session in that log is rebuilt without any requests and
+    continues in the same file, keeping the system prompt it was started with.
 
-async def main_loop(chat_instance, system_prompt: str, model: str):
-    history = ConversationHistory()
-    interaction_log = InteractionLog()
+    With a context_budget (in tokens), older turns are summarized once the history nears
+    it, by summary_model or a cheap model of the session's vendor.
+
+    With parallel_jobs, every sh block of a reply runs, independent ones concurrently.
+
+    Long message bodies are kept in blobs (a BlobStore in the log directory by default).
+    """
+    if blobs is None:
+        blobs = BlobStore()
+    history = ConversationHistory(blobs)
+    shell = ShellSession() if persistent_shell else None
     prompt = UndeletablePrompt()
+    logged_system_prompt = None
+    if resume_from is not None:
+        interaction_log = await InteractionLog.load_from_file(resume_from, fsync=log_fsync, store=history_store,
+                                                              blobs=blobs)
+        history, logged_system_prompt = replay(interaction_log.interactions, blobs)
+        chat_instance.messages = history.get_chat_messages()
+        if logged_system_prompt is not None:
+            # the exact prompt the session was cached with, not a freshly built one
+            if inspect.iscoroutine(system_prompt):
+                system_prompt.close()
+            system_prompt = logged_system_prompt
+        console.print(f"Resumed {resume_from} ({len(history.entries) // 2} turns)")
+    else:
+        interaction_log = InteractionLog(fsync=log_fsync, store=history_store, blobs=blobs)
+    pending_system_prompt = asyncio.ensure_future(system_prompt) if inspect.isawaitable(system_prompt) else None
+    # connects the clients a daemon session made ahead, while the user types
+    warming = asyncio.ensure_future(warm_clients())
+    context = None
+    if context_budget:
+        summarizer_model = pick_summary_model(model, summary_model)
+        if summarizer_model is None:
+            console.print("[dim]Older turns will not be summarized: no token of your own for the summary model "
+                          "(see --summary-model).[/dim]")
+        else:
+            context = ContextManager(history, chat_instance, context_budget, make_summarizer(summarizer_model))
     
     # Record initial system setup
-    await interaction_log.record_system_message(f"ChatSH Started with model: {MODELS.get(model, model)}")
-    await interaction_log.record_system_message(system_prompt)
+    started = "resumed" if resume_from is not None else "Started"
+    await interaction_log.record_system_message(f"ChatSH {started} with model: {MODELS.get(model, model)}")
+    if pending_system_prompt is None and logged_system_prompt is None:
+        await interaction_log.record_system_message(system_prompt, metadata={SYSTEM_PROMPT_KEY: True})
 
     while True:
         try:
@@ -159,6 +453,15 @@ async def main_loop(chat_instance, system_prompt: str, model: str):
             await handle_exit("EOF", interaction_log)
             break
 
+        if pending_system_prompt is not None:
+            system_prompt = await pending_system_prompt
+            pending_system_prompt = None
+            await interaction_log.record_system_message(system_prompt, metadata={SYSTEM_PROMPT_KEY: True})
+
+        from rich.markdown import Markdown
+        from rich.panel import Panel
+        from rich.syntax import Syntax
+
         if user_message.lower().startswith(("good bot", "bad bot")):
             await handle_exit(user_message, interaction_log)
             break
@@ -166,6 +469,7 @@ async def main_loop(chat_instance, system_prompt: str, model: str):
         removed_entries = history.handle_back_command(user_message)
         back_pairs = len(removed_entries) // 2
         if removed_entries:
+            chat_instance.back(len(removed_entries))
             message = f"> Removed {back_pairs} most recent message pairs"
             console.print(Markdown(message))
             await interaction_log.record_back_command(back_pairs)
@@ -176,35 +480,166 @@ async def main_loop(chat_instance, system_prompt: str, model: str):
                 console.print(Panel(Syntax(last_entry.content, "markdown", theme="monokai")))
             continue
 
+        if user_message.strip().lower() == "pin":
+            if history.pin_last_turn():
+                console.print("[dim]Pinned the last exchange; it will be kept when older turns are summarized.[/dim]")
+                await interaction_log.record_system_message("Pinned the last exchange", metadata={PINNED_KEY: True})
+            continue
+
+        if context is not None:
+            compaction = await context.apply()
+            if compaction is not None and "error" in compaction:
+                console.print(f"[dim]Could not summarize older turns: {compaction['error']}[/dim]")
+            elif compaction is not None:
+                console.print(f"[dim]Summarized {compaction['compacted_turns']} older turns "
+                              f"({compaction['tokens_before']} -> {compaction['tokens_after']} tokens).[/dim]")
+                await interaction_log.record_system_message(
+                    f"Compacted {compaction['compacted_turns']} turns into a summary", metadata=compaction)
+
         # Record user message
+        log_seconds_before = interaction_log.record_seconds
         user_msg_id = await interaction_log.record_user_message(user_message)
         history.add_entry('user', user_message)
 
         try:
-            full_message = history.construct_full_message(system_prompt)
-            assistant_message = await process_assistant_response(chat_instance, full_message, system_prompt, model)
-            
+            if flat:
+                full_message = history.construct_full_message(
+                    system_prompt, keep_last_turns=reducer.keep_last_turns if reducer else None)
+            else:
+                # The backend already holds the earlier turns; send only what is new.
+                full_message = history.construct_turn_message()
+            # the code block is found and checked while the reply is still streaming
+            preview = SpeculativePreview()
+            try:
+                assistant_message, usage, metrics = await process_assistant_response(
+                    chat_instance, full_message, system_prompt, model, preview=preview)
+            except BaseException:
+                preview.cancel()
+                raise
+
+            response_metadata = {"usage": usage, "cache": cache_status(usage)} if usage else {}
+            if isinstance(chat_instance, FanOutChat):
+                chosen = await choose_fanout_reply(chat_instance)
+                if chosen != chat_instance.lead:
+                    chat_instance.choose(chosen)
+                    usage = chat_instance.usage[-1]
+                    response_metadata = {"usage": usage, "cache": cache_status(usage)}
+                if chat_instance.replies[chosen].text != assistant_message:
+                    # a picked answer, or one that took over from a lead that failed mid-reply
+                    preview.cancel()
+                    preview = SpeculativePreview()
+                    preview.feed(chat_instance.replies[chosen].text)
+                assistant_message = chat_instance.replies[chosen].text
+                response_metadata.update(model=chosen, chosen=True)
+                metrics["model"] = MODELS.get(chosen, chosen)
+                # the answers not taken become sibling branches of the chosen one
+                for reply in chat_instance.replies.values():
+                    if reply.model != chosen:
+                        await interaction_log.record_llm_response(
+                            reply.text, user_msg_id, metadata=reply_metadata(reply))
+
             # Record assistant response
-            assistant_msg_id = await interaction_log.record_llm_response(assistant_message, user_msg_id)
+            metrics["log_write_seconds"] = round(interaction_log.record_seconds - log_seconds_before, 4)
+            response_metadata["telemetry"] = metrics
+            assistant_msg_id = await interaction_log.record_llm_response(
+                assistant_message, user_msg_id, metadata=response_metadata)
             history.add_entry('assistant', assistant_message)
+            if show_usage and chat_instance.usage:
+                console.print(f"[dim]{format_usage_report(chat_instance.usage, last_only=True)}[/dim]")
+            if show_usage:
+                console.print(f"[dim]{format_turn_metrics(metrics)}[/dim]", highlight=False)
             
-            codes = history.entries[-1].get_codeblocks(last_only=True)
-            if codes:
-                execution_output = await handle_code_execution(codes, interaction_log, assistant_msg_id)
+            codes = preview.codes(last_only=not parallel_jobs)
+            if len(codes) > 1:
+                execution_output = await handle_parallel_execution(
+                    codes, interaction_log, assistant_msg_id, jobs=parallel_jobs, timeout=timeout,
+                    reducer=reducer, shell=shell, previews=await preview.all_previews())
+                history.entries[-1].execution_output = execution_output
+            elif codes:
+                execution_output = await handle_code_execution(codes, interaction_log, assistant_msg_id,
+                                                               timeout=timeout, reducer=reducer, shell=shell,
+                                                               preview=await preview.last_preview())
                 history.entries[-1].execution_output = execution_output
 
+            if context is not None:
+                context.maybe_start()
+
         except Exception as error:
+            # The backend drops a failed turn, so the history has to as well.
+            history.pop_unanswered()
             error_str = str(error)
             console.print(f"[bold red]Error:[/bold red] {error_str}")
             await interaction_log.record_error(error_str, user_msg_id)
 
+    if shell is not None:
+        await shell.close()
+    if context is not None:
+        context.cancel()
+    warming.cancel()
+    await interaction_log.close()
+    remove_spills()
+
+
+def main(make_backend: Callable[[str], Chat] = chat):
+    """make_backend makes the chat backend for a model; the daemon's tests give it a fake vendor."""
+    if sys.argv[1:2] == ["history"]:
+        from chatsh.history_store import main as history_main
+        return history_main(sys.argv[2:])
+    if sys.argv[1:2] == ["stats"]:
+        from chatsh.telemetry import main as stats_main
+        return stats_main(sys.argv[2:])
+    args = parse_args()
+    if args.daemon:
+        from chatsh.daemon import start
+        sys.exit(start())
+    if args.stop_daemon:
+        from chatsh.client import stop
+        pid = stop()
+        print(f"Stopped the chatsh daemon (pid {pid})" if pid else "No chatsh daemon is running")
+        return
+    # one limiter for every backend, so parallel requests share the vendor's rate limits
+    limiter = RateLimiter()
+    def make_chat(model):
+        backend = ScheduledChat(fallbacks=parse_models(args.failover), limiter=limiter, make_backend=make_backend,
+                                max_retries=args.max_retries, on_retry=print_retry_notice)
+        if args.cache or args.replay:
+            from chatsh.response_cache import CachedChat
+            return CachedChat(backend, replay_only=args.replay)
+        return backend
 
-def main():
-    model = setup_environment()
-    system_prompt = load_system_prompt() + generate_system_description()
-    chat_instance = chat(model)
+    if args.prompt is not None or args.tasks is not None or not sys.stdin.isatty():
+        if len(parse_models(args.model)) > 1:
+            sys.exit("chatsh: headless mode takes a single model")
+        if args.parallel is not None or args.resume is not None:
+            sys.exit("chatsh: --parallel and --resume do not apply in headless mode")
+        from chatsh.batch import main as batch_main
+        sys.exit(batch_main(args, make_chat, load_system_prompt()))
+
+    model = setup_environment(args)
+
+    models = parse_models(model)
+    chat_instance = make_chat(model) if len(models) == 1 else FanOutChat(models, make_chat)
+    reducer = None if args.no_reduce else ReducerConfig(max_tokens=args.output_budget,
+                                                        keep_last_turns=args.keep_outputs)
     
-    asyncio.run(main_loop(chat_instance, system_prompt, model))
+    resume_from = None
+    if args.resume is not None:
+        try:
+            resume_from = find_log(args.resume)
+        except FileNotFoundError as error:
+            console.print(f"[bold red]Error:[/bold red] {error}")
+            sys.exit(1)
+
+    history_store = None
+    if args.history_db:
+        from chatsh.history_store import HistoryStore
+        history_store = HistoryStore()
+
+    asyncio.run(main_loop(chat_instance, build_system_prompt(refresh=args.refresh_system_info), model, flat=args.flat, show_usage=args.usage,
+                          timeout=args.timeout, reducer=reducer, persistent_shell=not args.fresh_shell,
+                          log_fsync=FsyncPolicy(args.log_fsync), history_store=history_store,
+                          resume_from=resume_from, context_budget=args.context_budget,
+                          summary_model=args.summary_model, parallel_jobs=args.parallel))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
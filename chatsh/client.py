@@ -0,0 +1,164 @@
+"""
+Thin client for `chatsh --daemon`.
+
+A running daemon has already imported rich, prompt_toolkit and the vendor SDKs and
+computed the system description. attach() hands it this process's terminal (the file
+descriptors of stdin, stdout and stderr, passed over a Unix socket), working directory,
+arguments and the part of the environment a session needs (SESSION_ENV). The daemon forks
+a session that takes them over and runs chatsh as usual; this process only forwards
+signals to it and waits for its exit status. Nothing beyond the standard library is
+imported here, so a session starts in tens of milliseconds.
+
+The session needs the terminal as its controlling terminal, or commands that open /dev/tty
+(sudo, ssh, git prompts) fail. A terminal can only control one session, so this works
+when the terminal controls none yet; a terminal that belongs to the shell chatsh was
+started from stays with it, and chatsh runs in this process as if no daemon were there.
+
+The socket is only used if it, and the directory it is in, belong to this user and
+nobody else can enter that directory; otherwise another user could listen there first
+and receive the terminal.
+"""
+import array
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+from typing import Dict, List, Optional
+
+# Signals the terminal sends to this process that are meant for the session
+FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT, signal.SIGWINCH)
+# Flags that never attach: they start, stop or bypass the daemon
+LOCAL_FLAGS = ("--daemon", "--stop-daemon", "--no-daemon")
+# Environment variables a session takes over from the client: what chatsh, the terminal and
+# everyday commands need. Anything else, such as API keys, stays in the client.
+SESSION_ENV = ("HOME", "USER", "LOGNAME", "SHELL", "PATH", "PWD", "TERM", "COLORTERM", "COLUMNS", "LINES",
+               "LANG", "LANGUAGE", "TZ", "TMPDIR", "EDITOR", "VISUAL", "PAGER", "NO_COLOR", "DISPLAY",
+               "WAYLAND_DISPLAY", "SSH_AUTH_SOCK", "VIRTUAL_ENV", "PYTHONPATH", "ANTHROPIC_BASE_URL",
+               "OPENAI_BASE_URL", "HTTP_PROXY", "HTTPS_PROXY", "NO_PROXY", "ALL_PROXY", "http_proxy",
+               "https_proxy", "no_proxy", "all_proxy")
+# ... and the variables starting with one of these
+SESSION_ENV_PREFIXES = ("LC_", "XDG_", "CHATSH_", "CONDA_")
+
+
+def socket_path() -> str:
+    """$CHATSH_SOCKET, else a socket in a directory only this user can enter."""
+    if os.environ.get("CHATSH_SOCKET"):
+        return os.environ["CHATSH_SOCKET"]
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    directory = os.path.join(runtime, "chatsh") if runtime else f"/tmp/chatsh-{os.getuid()}"
+    return os.path.join(directory, "daemon.sock")
+
+
+def session_env() -> Dict[str, str]:
+    return {name: value for name, value in os.environ.items()
+            if name in SESSION_ENV or name.startswith(SESSION_ENV_PREFIXES)}
+
+
+def private_directory(directory: str) -> bool:
+    """Whether directory is a real directory (not a symlink) of this user, with mode 0700."""
+    try:
+        info = os.lstat(directory)
+    except OSError:
+        return False
+    return stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and stat.S_IMODE(info.st_mode) == 0o700
+
+
+def peer_uid(connection: socket.socket) -> Optional[int]:
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None  # not Linux; the socket's directory is private to its user anyway
+    _, uid, _ = struct.unpack("3i", connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                          struct.calcsize("3i")))
+    return uid
+
+
+def code_stamp() -> str:
+    """Changes whenever chatsh's code does, so a daemon started before an upgrade is not used."""
+    package = os.path.dirname(os.path.abspath(__file__))
+    return str(max(entry.stat().st_mtime_ns for entry in os.scandir(package)
+                   if entry.name.endswith((".py", ".prompt"))))
+
+
+def connect(path: Optional[str] = None) -> Optional[socket.socket]:
+    """A connection to the daemon, or None if none of this user's is listening on path."""
+    path = path or socket_path()
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return None
+    if not (stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+            and private_directory(os.path.dirname(os.path.abspath(path)))):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+        uid = peer_uid(connection)
+    except OSError:
+        connection.close()
+        return None
+    if uid is not None and uid != os.getuid():
+        connection.close()
+        return None
+    return connection
+
+
+def send_request(connection: socket.socket, request: dict, fds: List[int] = ()) -> None:
+    """One JSON line, with fds attached to its first byte."""
+    data = json.dumps(request).encode() + b"\n"
+    ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))] if fds else []
+    sent = connection.sendmsg([data], ancillary)
+    connection.sendall(data[sent:])
+
+
+def attach(argv: List[str], path: Optional[str] = None) -> Optional[int]:
+    """
+    Run the session in a daemon, if one is listening and this is an interactive terminal.
+
+    @return: the session's exit status, or None to run chatsh in this process instead.
+    """
+    if any(flag in argv for flag in LOCAL_FLAGS) or not (os.isatty(0) and os.isatty(1)):
+        return None  # piped input is a headless task, read by this process
+    try:
+        cwd = os.getcwd()
+    except OSError:
+        return None
+    connection = connect(path)
+    if connection is None:
+        return None
+    with connection:
+        request = {"argv": argv, "cwd": cwd, "env": session_env(), "stamp": code_stamp()}
+        try:
+            send_request(connection, request, [0, 1, 2])
+            replies = connection.makefile("r")
+            reply = json.loads(replies.readline() or "{}")
+        except (OSError, ValueError):
+            return None
+        if "pid" not in reply:
+            # the daemon is out of date, refused us, or cannot give the session our terminal
+            return None
+
+        def forward(signum, frame):
+            try:
+                os.kill(reply["pid"], signum)
+            except ProcessLookupError:
+                pass
+
+        for signum in FORWARDED_SIGNALS:
+            signal.signal(signum, forward)
+        try:
+            line = replies.readline()  # sent as the session ends
+        except OSError:
+            line = ""
+    return json.loads(line).get("exit", 1) if line else 1
+
+
+def stop(path: Optional[str] = None) -> Optional[int]:
+    """Ask the daemon to stop accepting sessions; running ones carry on. Returns its pid, or None."""
+    connection = connect(path)
+    if connection is None:
+        return None
+    with connection:
+        send_request(connection, {"stop": True})
+        reply = json.loads(connection.makefile("r").readline() or "{}")
+    return reply.get("stopped")
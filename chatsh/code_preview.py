@@ -0,0 +1,169 @@
+"""
+Find the code block to run while the reply is still streaming, and check it early.
+
+FenceParser follows the stream and reports each ```sh block the moment its closing fence
+arrives, with the same matching rules as ConversationEntry.get_codeblocks. Every closed
+block is syntax-checked with `bash -n` and classified for risk in the background, so by
+the time the stream ends the execute prompt has its warnings ready instead of starting
+the checks then.
+"""
+import asyncio
+import re
+import shutil
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+OPEN_FENCE = "```sh"
+CLOSE_FENCE = "```"
+# Seconds to wait for `bash -n`; a check that takes longer is skipped rather than waited for
+SYNTAX_CHECK_TIMEOUT = 2.0
+
+# (level, pattern, reason); the highest level that matches wins
+RISK_PATTERNS = [
+    ("high", r"\brm\s+(-[a-zA-Z]*[rf][a-zA-Z]*\s+)+(/|~|\$HOME|\*)(\s|$)", "recursive delete of a top-level path"),
+    ("high", r"\b(mkfs(\.\w+)?|fdisk|parted|wipefs)\b", "disk formatting"),
+    ("high", r"\bdd\b[^|\n]*\bof=/dev/", "raw write to a device"),
+    ("high", r">\s*/dev/(sd|nvme|hd|disk)", "redirect onto a device"),
+    ("high", r":\(\)\s*\{\s*:\|:&\s*\};:", "fork bomb"),
+    ("high", r"\b(curl|wget)\b[^|\n]*\|\s*(sudo\s+)?(ba|z)?sh\b", "pipes a download into a shell"),
+    ("high", r"\b(shutdown|reboot|halt|poweroff)\b", "stops the machine"),
+    ("medium", r"\bsudo\b", "runs as root"),
+    ("medium", r"\brm\s+-[a-zA-Z]*[rf]", "forced or recursive delete"),
+    ("medium", r"\bgit\s+(push\s+.*(--force|-f)\b|reset\s+--hard|clean\s+-[a-zA-Z]*f)", "discards git history or changes"),
+    ("medium", r"\bchmod\s+-R\b|\bchown\s+-R\b", "recursive permission change"),
+    ("medium", r"\bkill(all)?\s+-9\b|\bpkill\b", "kills processes"),
+    ("medium", r"\b(truncate|shred)\b", "destroys file contents"),
+    ("medium", r"(^|[^>])>\s*~?/?\.\w+rc\b", "overwrites a shell rc file"),
+]
+_RISK_ORDER = {"low": 0, "medium": 1, "high": 2}
+_COMPILED_RISKS = [(level, re.compile(pattern, re.MULTILINE), reason) for level, pattern, reason in RISK_PATTERNS]
+
+
+@dataclass
+class CodePreview:
+    code: str
+    syntax_ok: Optional[bool] = None  # None when no checker is available
+    syntax_error: str = ""
+    risk: str = "low"
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def should_confirm_carefully(self) -> bool:
+        return self.syntax_ok is False or self.risk == "high"
+
+    def metadata(self) -> dict:
+        return {"syntax_ok": self.syntax_ok, "syntax_error": self.syntax_error or None,
+                "risk": self.risk, "risk_reasons": self.reasons}
+
+
+class FenceParser:
+    """
+    Incremental equivalent of re.findall(r"```sh([\\s\\S]*?)```", text): feed() returns
+    the blocks closed by each new chunk, and the text is scanned once in total.
+
+    Only what is still needed is kept: outside a block, the last few characters (a fence
+    may be split across chunks); inside one, the code so far as a list of pieces.
+    """
+
+    def __init__(self):
+        self.blocks: List[str] = []
+        self._tail = ""  # unmatched end of the last chunk, shorter than a fence
+        self._code: Optional[List[str]] = None  # inside a block, its code so far
+
+    def feed(self, chunk: str) -> List[str]:
+        text = self._tail + chunk
+        closed = []
+        scan = 0
+        while True:
+            if self._code is None:
+                index = text.find(OPEN_FENCE, scan)
+                if index == -1:
+                    self._tail = text[max(scan, len(text) - len(OPEN_FENCE) + 1):]
+                    break
+                self._code = []
+                scan = index + len(OPEN_FENCE)
+            else:
+                index = text.find(CLOSE_FENCE, scan)
+                if index == -1:
+                    keep = max(scan, len(text) - len(CLOSE_FENCE) + 1)
+                    self._code.append(text[scan:keep])
+                    self._tail = text[keep:]
+                    break
+                self._code.append(text[scan:index])
+                closed.append("".join(self._code).strip())
+                self._code = None
+                scan = index + len(CLOSE_FENCE)
+        self.blocks.extend(closed)
+        return closed
+
+
+def classify_risk(code: str) -> tuple:
+    """@return: (level, reasons), level being "low", "medium" or "high"."""
+    level, reasons = "low", []
+    for pattern_level, pattern, reason in _COMPILED_RISKS:
+        if pattern.search(code):
+            reasons.append(reason)
+            if _RISK_ORDER[pattern_level] > _RISK_ORDER[level]:
+                level = pattern_level
+    return level, reasons
+
+
+async def check_syntax(code: str) -> tuple:
+    """@return: (ok, error message) from `bash -n`; ok is None if bash is unavailable."""
+    bash = shutil.which("bash")
+    if bash is None:
+        return None, ""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            bash, "-n",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except OSError:
+        return None, ""
+    try:
+        _, stderr = await asyncio.wait_for(proc.communicate(code.encode()), SYNTAX_CHECK_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return None, ""
+    return proc.returncode == 0, stderr.decode(errors="replace").strip()
+
+
+async def preview_code(code: str) -> CodePreview:
+    risk, reasons = classify_risk(code)
+    syntax_ok, syntax_error = await check_syntax(code)
+    return CodePreview(code, syntax_ok, syntax_error, risk, reasons)
+
+
+class SpeculativePreview:
+    """Feed it the streamed reply; each closed block is previewed while the stream goes on."""
+
+    def __init__(self):
+        self.parser = FenceParser()
+        self._previews: List[asyncio.Task] = []
+
+    def feed(self, chunk: str) -> None:
+        for code in self.parser.feed(chunk):
+            self._previews.append(asyncio.ensure_future(preview_code(code)))
+
+    def codes(self, last_only: bool = True) -> List[str]:
+        """The blocks found, as ConversationEntry.get_codeblocks would return them."""
+        return self.parser.blocks[-1:] if last_only else list(self.parser.blocks)
+
+    async def last_preview(self) -> Optional[CodePreview]:
+        """The preview of the last block; earlier ones are dropped."""
+        if not self._previews:
+            return None
+        for task in self._previews[:-1]:
+            task.cancel()
+        return await self._previews[-1]
+
+    async def all_previews(self) -> List[CodePreview]:
+        """The previews of every block, in order."""
+        return list(await asyncio.gather(*self._previews))
+
+    def cancel(self) -> None:
+        for task in self._previews:
+            task.cancel()
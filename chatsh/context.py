@@ -0,0 +1,153 @@
+"""
+Keep the conversation within a token budget by summarizing its oldest turns.
+
+Token counts are estimated per entry and cached, so each turn only counts what is new.
+Once the history passes COMPACT_AT of the budget, the turns before the most recent
+KEEP_RECENT_TURNS are summarized by a cheap model in the background, while the user reads
+and types. The summary replaces them at the next turn boundary; pinned turns stay
+verbatim. The user only waits for it if the history has reached the full budget.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from chatsh.chat import Chat, UsageEvent, chat, get_vendor_from_model, has_token
+from chatsh.conversation import ConversationEntry, ConversationHistory
+from chatsh.reducer import estimate_tokens
+
+DEFAULT_BUDGET = 100_000
+# Share of the budget at which a summary is started in the background
+COMPACT_AT = 0.75
+KEEP_RECENT_TURNS = 4
+# A cheap model of each vendor; a session's summaries go to its own vendor's
+SUMMARY_MODELS = {'anthropic': 'h', 'openai': 'gpt-4o-mini', 'google': 'i'}
+# The summarizer sees at most this much of each command output
+SUMMARY_OUTPUT_CHARS = 2000
+
+SUMMARY_SYSTEM_PROMPT = """You condense the beginning of a conversation between a user and an \
+assistant that runs shell commands for them. Write a summary the assistant can continue from: \
+the user's goals, decisions made, files, paths and settings involved, commands that were run \
+and what they showed, and anything still unresolved. Be concise; use terse bullet points."""
+
+Summarizer = Callable[[str], Awaitable[str]]
+
+
+def pick_summary_model(session_model: str, summary_model: Optional[str] = None) -> Optional[str]:
+    """
+    The model that summarizes a session run with session_model (a shortcode, a name or a
+    comma-separated list led by the main one): summary_model if given, otherwise the cheap
+    model of the session's own vendor, so the transcript goes to no vendor the user did not
+    choose. Summaries need the vendor's own token; the loaner token is never used for them.
+
+    @return: the model, or None if no summarizer can be used
+    """
+    if summary_model is None:
+        summary_model = SUMMARY_MODELS.get(get_vendor_from_model(session_model.split(",")[0].strip()))
+    if summary_model is None or not has_token(get_vendor_from_model(summary_model)):
+        return None
+    return summary_model
+
+
+def make_summarizer(model: str) -> Summarizer:
+    async def summarize(transcript: str) -> str:
+        # a fresh backend each time: the summary request carries no history of its own
+        chunks = []
+        async for chunk in chat(model).ask(transcript, system=SUMMARY_SYSTEM_PROMPT, model=model,
+                                           max_tokens=2048, stream=True):
+            if not isinstance(chunk, UsageEvent):
+                chunks.append(chunk)
+        return "".join(chunks)
+    return summarize
+
+
+def render_transcript(entries: List[ConversationEntry]) -> str:
+    parts = []
+    for entry in entries:
+        tag = "USER" if entry.role == 'user' else "ASSISTANT"
+        parts.append(f"<{tag}>\n{entry.content}\n</{tag}>")
+        if entry.execution_output:
+            output = entry.execution_output
+            if len(output) > SUMMARY_OUTPUT_CHARS:
+                output = output[:SUMMARY_OUTPUT_CHARS] + f"\n[... {len(output) - SUMMARY_OUTPUT_CHARS} characters cut]"
+            parts.append(f"<SYSTEM>\n{output.strip()}\n</SYSTEM>")
+    return "\n".join(parts)
+
+
+class ContextManager:
+    def __init__(self, history: ConversationHistory, chat_instance: Chat,
+                 budget_tokens: int, summarizer: Summarizer,
+                 keep_recent_turns: int = KEEP_RECENT_TURNS):
+        self.history = history
+        self.chat_instance = chat_instance
+        self.budget_tokens = budget_tokens
+        self.summarizer = summarizer
+        self.keep_recent_turns = keep_recent_turns
+        # id(entry) -> (entry, content length, output length, tokens); the entry is kept so
+        # its id cannot be reused while cached
+        self._counts: Dict[int, Tuple[ConversationEntry, int, int, int]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._snapshot: List[ConversationEntry] = []
+
+    def entry_tokens(self, entry: ConversationEntry) -> int:
+        content_length, output_length = entry.content_length, entry.output_length
+        cached = self._counts.get(id(entry))
+        if cached is not None and cached[0] is entry and cached[1] == content_length \
+                and cached[2] == output_length:
+            return cached[3]
+        tokens = estimate_tokens(entry.content) + estimate_tokens(entry.execution_output or "")
+        self._counts[id(entry)] = (entry, content_length, output_length, tokens)
+        return tokens
+
+    def total_tokens(self) -> int:
+        return sum(self.entry_tokens(entry) for entry in self.history.entries)
+
+    def _forget_removed(self) -> None:
+        live = {id(entry) for entry in self.history.entries}
+        for key in [key for key in self._counts if key not in live]:
+            del self._counts[key]
+
+    def maybe_start(self) -> bool:
+        """Start summarizing the older turns if the history is near the budget."""
+        if self._task is not None or self.total_tokens() < self.budget_tokens * COMPACT_AT:
+            return False
+        turns = len(self.history.entries) // 2 - self.keep_recent_turns
+        snapshot = self.history.entries[:2 * turns]
+        if turns < 1 or all(entry.pinned or entry.summary for entry in snapshot):
+            return False  # nothing that a summary would shrink
+        self._snapshot = snapshot
+        self._task = asyncio.ensure_future(
+            self.summarizer(render_transcript([entry for entry in snapshot if not entry.pinned])))
+        return True
+
+    async def apply(self) -> Optional[dict]:
+        """
+        At a turn boundary: put a finished summary in place of the turns it covers, and
+        resync the chat backend. Waits for the summary only if the history is over budget.
+
+        @return: what was compacted, for the interaction log, or None.
+        """
+        if self._task is None:
+            return None
+        if not self._task.done() and self.total_tokens() < self.budget_tokens:
+            return None
+        task, snapshot = self._task, self._snapshot
+        self._task, self._snapshot = None, []
+        try:
+            summary = await task
+        except Exception as error:
+            return {"error": str(error)}
+        # a back command may have removed some of the summarized turns meanwhile
+        current = self.history.entries[:len(snapshot)]
+        if len(current) != len(snapshot) or any(a is not b for a, b in zip(current, snapshot)):
+            return None
+        tokens_before = self.total_tokens()
+        turns = len(snapshot) // 2
+        self.history.compact(turns, summary)
+        self.chat_instance.messages = self.history.get_chat_messages()
+        self._forget_removed()
+        return {"compacted_turns": turns, "summary": summary,
+                "tokens_before": tokens_before, "tokens_after": self.total_tokens()}
+
+    def cancel(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
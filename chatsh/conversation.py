@@ -1,17 +1,56 @@
-from dataclasses import dataclass
 from typing import List, Optional, Tuple
 
 import re
-from rich.markdown import Markdown
-from rich.panel import Panel
-from rich.syntax import Syntax
+import sys
+
+from chatsh.blob_store import BlobStore, BlobText, text_length
+
+# Execution output recorded when the user declines to run a command
+SKIPPED_OUTPUT = "Command skipped.\n"
+# The exchange that stands in for compacted turns at the start of the history
+SUMMARY_TEMPLATE = "<SUMMARY>\nSummary of our conversation so far:\n{}\n</SUMMARY>"
+SUMMARY_ACK = "Understood. I will continue from that summary."
 
 
-@dataclass
 class ConversationEntry:
-    role: str
-    content: str
-    execution_output: Optional[str] = None
+    """
+    One message of the conversation. Slotted; with a BlobStore, a long content or
+    execution output is kept there and read back when accessed.
+    """
+    __slots__ = ("role", "_content", "_execution_output", "pinned", "summary", "_blobs")
+    content = BlobText()
+    execution_output = BlobText()
+
+    def __init__(self, role: str, content: str, execution_output: Optional[str] = None,
+                 pinned: bool = False, summary: bool = False, blobs: Optional[BlobStore] = None):
+        self._blobs = blobs
+        self.role = sys.intern(role)
+        self.content = content
+        self.execution_output = execution_output
+        self.pinned = pinned  # kept verbatim when older turns are compacted
+        self.summary = summary  # part of the summary exchange that replaced compacted turns
+
+    @property
+    def content_length(self) -> int:
+        return text_length(self, "content")
+
+    @property
+    def output_length(self) -> int:
+        return text_length(self, "execution_output")
+
+    def _fields(self) -> tuple:
+        return self.role, self.content, self.execution_output, self.pinned, self.summary
+
+    def __eq__(self, other):
+        if not isinstance(other, ConversationEntry):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (f"ConversationEntry(role={self.role!r}, content={self._content!r}, "
+                f"execution_output={self._execution_output!r}, pinned={self.pinned!r}, summary={self.summary!r})")
 
     def get_codeblocks(self, block_type: str = "sh", last_only: bool = True) -> List[str]:
         regex = rf"```{block_type}([\s\S]*?)```"
@@ -21,11 +60,13 @@ class ConversationEntry:
         return matches
 
 class ConversationHistory:
-    def __init__(self):
+    def __init__(self, blobs: Optional[BlobStore] = None):
+        """blobs: where the entries keep long contents and outputs."""
         self.entries: List[ConversationEntry] = []
+        self.blobs = blobs
 
     def add_entry(self, role: str, content: str, execution_output: Optional[str] = None):
-        self.entries.append(ConversationEntry(role, content, execution_output))
+        self.entries.append(ConversationEntry(role, content, execution_output, blobs=self.blobs))
 
 
     def handle_back_command(self, user_message: str) -> List[ConversationEntry]:
@@ -56,21 +97,92 @@ class ConversationHistory:
         self.entries = self.entries[:-messages]
         return removed
 
-    def get_chat_messages(self) -> List[dict]:
-        return [
-            {"role": entry.role, "content": entry.content}
-            for entry in self.entries
-            if entry.role in ['user', 'assistant']
-        ]
-    
-    def construct_full_message(self, system_prompt: str) -> str:
+    def pin_last_turn(self) -> bool:
+        """Pin the latest user/assistant exchange so compaction keeps it; False if there is none."""
+        if len(self.entries) < 2 or self.entries[-1].role != 'assistant':
+            return False
+        self.entries[-1].pinned = self.entries[-2].pinned = True
+        return True
+
+    def compact(self, turns: int, summary: str) -> None:
+        """
+        Replace the oldest turns (user/assistant pairs) with a summary exchange. Pinned
+        turns among them are kept, after the summary, in their original order.
+        """
+        old, rest = self.entries[:2 * turns], self.entries[2 * turns:]
+        self.entries = [
+            ConversationEntry('user', SUMMARY_TEMPLATE.format(summary.strip()), summary=True, blobs=self.blobs),
+            ConversationEntry('assistant', SUMMARY_ACK, summary=True, blobs=self.blobs),
+        ] + [entry for entry in old if entry.pinned] + rest
+
+    def pop_unanswered(self) -> Optional[ConversationEntry]:
+        """
+        Drop a trailing user entry that never got a reply (e.g. the request failed),
+        so the history stays in step with the chat backend's messages.
+        """
+        if self.entries and self.entries[-1].role == 'user':
+            return self.entries.pop()
+        return None
+
+    def _outputs(self, keep_last_turns: Optional[int]) -> List[Optional[str]]:
+        """Execution output per entry, with outputs older than keep_last_turns elided."""
+        assistant_indices = [i for i, entry in enumerate(self.entries) if entry.role == 'assistant']
+        if keep_last_turns is None:
+            recent = set(assistant_indices)
+        else:
+            recent = set(assistant_indices[-keep_last_turns:] if keep_last_turns > 0 else [])
+        outputs = []
+        for i, entry in enumerate(self.entries):
+            if entry.output_length and i not in recent:
+                outputs.append(f"[output elided: {entry.output_length} characters]")
+            else:
+                outputs.append(entry.execution_output)
+        return outputs
+
+    def get_chat_messages(self, keep_last_turns: Optional[int] = None) -> List[dict]:
+        """
+        Return the history as alternating user/assistant messages.
+
+        Execution output attached to an assistant entry is folded into the
+        following user message as a <SYSTEM> block, which is how the system
+        prompt examples present it. Outputs older than keep_last_turns are elided.
+        """
+        messages = []
+        pending_output = None
+        for entry, output in zip(self.entries, self._outputs(keep_last_turns)):
+            if entry.role == 'user':
+                content = entry.content
+                if pending_output:
+                    content = f"<SYSTEM>\n{pending_output.strip()}\n</SYSTEM>\n\n{content}"
+                messages.append({"role": "user", "content": content})
+                pending_output = None
+            elif entry.role == 'assistant':
+                messages.append({"role": "assistant", "content": entry.content})
+                pending_output = output
+        return messages
+
+    def construct_turn_message(self) -> str:
+        """
+        Build only the newest user turn (plus any execution output it follows),
+        for backends that keep the earlier turns as structured messages.
+        """
+        assert self.entries and self.entries[-1].role == 'user'
+        content = self.entries[-1].content
+        previous = self.entries[-2] if len(self.entries) > 1 else None
+        if previous is not None and previous.role == 'assistant':
+            output = previous.execution_output
+            if output:
+                content = f"<SYSTEM>\n{output.strip()}\n</SYSTEM>\n\n{content}"
+        return content
+
+    def construct_full_message(self, system_prompt: str, keep_last_turns: Optional[int] = None) -> str:
         messages = []
-        for entry in self.entries:
+        for entry, output in zip(self.entries, self._outputs(keep_last_turns)):
             if entry.role == 'user':
                 messages.append(f"<USER>\n{entry.content}\n</USER>")
             elif entry.role == 'assistant':
                 messages.append(f"<ASSISTANT>\n{entry.content}\n</ASSISTANT>")
-            if entry.execution_output:
-                messages.append(f"<SYSTEM>\n{entry.execution_output.strip()}\n</SYSTEM>")
+            if output:
+                messages.append(f"<SYSTEM>\n{output.strip()}\n</SYSTEM>")
         
         return f"{system_prompt}\n\n" + "\n".join(messages)
@@ -0,0 +1,308 @@
+"""
+`chatsh --daemon`: a warm server that starts sessions for thin clients (see client.py).
+
+Starting chatsh costs the interpreter, the imports of rich, prompt_toolkit and a vendor
+SDK (anthropic alone takes longer to import than the rest of chatsh takes to start), and
+the system description. The daemon pays for them once. For every client it forks a
+session process, which takes over the client's terminal, working directory, environment
+and arguments and runs main() as `chatsh` would. Sessions are processes of their own, so
+a blocking prompt or a crash in one cannot stall another. They build the same system
+prompt, so they share the vendor's prompt cache.
+
+A vendor client is bound to the event loop that uses it and carries the session's own key
+and environment, so each session makes its own: before main() runs, from its arguments,
+and main_loop connects it while the user types the first message. The daemon makes and
+drops one client of each SDK while warming up, which loads what every client needs (CA
+certificates, the SDK's lazily imported modules) once. The history store is imported
+but not opened: an SQLite connection must not cross a fork, and opening one is cheap.
+"""
+import array
+import asyncio
+import contextlib
+import fcntl
+import importlib
+import json
+import os
+import signal
+import socket
+import sys
+import termios
+import time
+import traceback
+from typing import Callable, Optional, Tuple
+
+from chatsh.chat import Chat, chat, get_token, get_vendor_from_model, has_token, make_client, prepare_client
+from chatsh.client import code_stamp, connect, peer_uid, private_directory, socket_path
+from chatsh.interaction_log import default_log_dir
+
+# Imported up front so that no session has to; any of them may be missing
+WARM_MODULES = ("anthropic", "openai", "google.generativeai", "chatsh.history_store")
+# Vendors whose clients sessions make ahead (see chat.prepare_client)
+CLIENT_VENDORS = ("anthropic", "openai")
+# Largest request (arguments, working directory, environment) a client may send
+MAX_REQUEST_BYTES = 1024 * 1024
+# Seconds `chatsh --daemon` waits for the daemon it started to listen
+START_TIMEOUT = 30.0
+
+
+def warm_up() -> None:
+    from chatsh.chatsh import build_system_prompt
+    for name in WARM_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass  # an SDK that is not installed, or fails to import, is not used
+    for vendor in CLIENT_VENDORS:
+        try:
+            make_client(vendor, "warm-up")
+        except Exception:
+            pass
+    # fills the on-disk description cache, and imports the rendering modules
+    asyncio.run(build_system_prompt())
+
+
+def _receive_request(connection: socket.socket) -> Tuple[dict, list]:
+    """The client's JSON request line, and the file descriptors sent with it."""
+    fd_size = array.array("i").itemsize
+    data, ancillary, _, _ = connection.recvmsg(65536, socket.CMSG_SPACE(3 * fd_size))
+    fds = array.array("i")
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[:len(payload) - len(payload) % fd_size])
+    while data and not data.endswith(b"\n") and len(data) < MAX_REQUEST_BYTES:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data or b"{}"), list(fds)
+
+
+def _reply(connection: socket.socket, message: dict) -> None:
+    try:
+        connection.sendall(json.dumps(message).encode() + b"\n")
+    except OSError:
+        pass  # the client has gone; the session still ends normally
+
+
+def _take_over(request: dict, fds: list) -> None:
+    """Make this process look like a chatsh the client started itself."""
+    for target, fd in enumerate(fds[:3]):
+        os.dup2(fd, target)
+    for fd in fds:
+        if fd > 2:
+            os.close(fd)
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", buffering=1, closefd=False)
+    sys.stderr = open(2, "w", buffering=1, closefd=False)
+    sys.argv = ["chatsh"] + list(request["argv"])
+    import chatsh.chatsh
+    from rich.console import Console
+    # the daemon's console was made for the daemon's output, which is not a terminal
+    chatsh.chatsh.console = Console()
+
+
+def _prepare_clients() -> None:
+    """Make the vendor clients of the session's models, before main() runs."""
+    from chatsh.chatsh import parse_args
+    from chatsh.fanout import parse_models
+    try:
+        # main() reports bad arguments, and prints --help
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+                contextlib.redirect_stderr(devnull):
+            args = parse_args(sys.argv[1:])
+        vendors = {get_vendor_from_model(model) for model in parse_models(args.model) + parse_models(args.failover)}
+    except (SystemExit, ValueError):
+        return
+    for vendor in vendors.intersection(CLIENT_VENDORS):
+        if not has_token(vendor):
+            continue  # main() says where the token goes
+        try:
+            prepare_client(vendor, asyncio.run(get_token(vendor)))
+        except Exception:
+            pass  # main() meets the same error, and reports it
+
+
+def _take_terminal() -> bool:
+    """
+    Make the client's terminal this session's controlling terminal, so that commands which
+    open /dev/tty (sudo, ssh and git prompts) work as in a local chatsh. The kernel refuses
+    if the terminal already controls another session, e.g. that of the client's shell.
+    """
+    try:
+        os.setsid()
+        fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+    except OSError:
+        return False
+    return True
+
+
+def run_session(connection: socket.socket, stamp: str, make_backend: Callable[[str], Chat]) -> int:
+    """In a forked process: serve one client; returns the exit status."""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.pthread_sigmask(signal.SIG_SETMASK, set())
+    uid = peer_uid(connection)
+    if uid is not None and uid != os.getuid():
+        return 1
+    try:
+        request, fds = _receive_request(connection)
+    except (OSError, ValueError):
+        return 1
+    if not request:
+        return 0  # a client checking that we listen
+    if request.get("stop"):
+        os.kill(os.getppid(), signal.SIGTERM)
+        _reply(connection, {"stopped": os.getppid()})
+        return 0
+    if request.get("stamp") != stamp:
+        # chatsh was upgraded under us: the client runs it itself, and we make way
+        os.kill(os.getppid(), signal.SIGTERM)
+        _reply(connection, {"stale": True})
+        return 0
+    if len(fds) < 3:
+        _reply(connection, {"error": "no terminal was passed"})
+        return 1
+    try:
+        _take_over(request, fds)
+    except OSError as error:
+        _reply(connection, {"error": str(error)})
+        return 1
+    if not _take_terminal():
+        _reply(connection, {"local": "the terminal controls another session"})
+        return 0
+    _reply(connection, {"pid": os.getpid()})
+    _prepare_clients()
+
+    import chatsh.chatsh
+    status = 0
+    try:
+        chatsh.chatsh.main(make_backend)
+    except SystemExit as exit:
+        if isinstance(exit.code, int):
+            status = exit.code
+        elif exit.code is not None:
+            print(exit.code, file=sys.stderr)
+            status = 1
+    except KeyboardInterrupt:
+        status = 130
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except OSError:
+            pass
+    _reply(connection, {"exit": status})
+    return status
+
+
+def _reap(signum=None, frame=None) -> None:
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+
+def _listen(path: str) -> socket.socket:
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    try:
+        os.mkdir(directory, 0o700)
+        os.chmod(directory, 0o700)  # whatever the umask
+    except FileExistsError:
+        # made by someone else, or by an earlier daemon; only the latter is safe to listen in
+        if not private_directory(directory):
+            raise RuntimeError(f"{directory} is not a directory only this user can enter; not listening in it")
+    if os.path.exists(path):
+        existing = connect(path)
+        if existing is not None:
+            existing.close()
+            raise RuntimeError(f"a chatsh daemon is already listening on {path}")
+        os.unlink(path)  # left behind by a daemon that died
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    os.chmod(path, 0o600)
+    listener.listen(16)
+    return listener
+
+
+def serve(path: Optional[str] = None, make_backend: Callable[[str], Chat] = chat) -> None:
+    """
+    Accept clients on path until SIGTERM, forking a session for each. make_backend makes
+    the chat backends, as in ScheduledChat.
+    """
+    path = path or socket_path()
+    stamp = code_stamp()
+    listener = _listen(path)
+    signal.signal(signal.SIGCHLD, _reap)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    handled = {signal.SIGCHLD, signal.SIGTERM}
+    try:
+        while True:
+            connection, _ = listener.accept()
+            # held off while forking, so neither handler runs in the middle of it
+            signal.pthread_sigmask(signal.SIG_BLOCK, handled)
+            pid = os.fork()
+            if pid == 0:
+                listener.close()
+                status = 1
+                try:
+                    status = run_session(connection, stamp, make_backend)
+                finally:
+                    os._exit(status)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, handled)
+            connection.close()
+    finally:
+        listener.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def start(path: Optional[str] = None) -> int:
+    """`chatsh --daemon`: warm up, then serve in the background; returns the exit status."""
+    path = path or socket_path()
+    existing = connect(path)
+    if existing is not None:
+        existing.close()
+        print(f"A chatsh daemon is already listening on {path}")
+        return 0
+    started = time.perf_counter()
+    warm_up()
+    log_file = default_log_dir() / "daemon.log"
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    pid = os.fork()
+    if pid == 0:
+        os.setsid()  # no controlling terminal: sessions read the clients' terminals freely
+        with open(os.devnull, "r") as devnull, open(log_file, "a") as log:
+            os.dup2(devnull.fileno(), 0)
+            os.dup2(log.fileno(), 1)
+            os.dup2(log.fileno(), 2)
+        try:
+            serve(path)
+        except Exception:
+            traceback.print_exc()  # SIGTERM's SystemExit is a normal stop, not worth a trace
+        finally:
+            os._exit(0)
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        connection = connect(path)
+        if connection is not None:
+            connection.close()
+            print(f"chatsh daemon (pid {pid}) warmed up in {time.perf_counter() - started:.1f}s, "
+                  f"listening on {path}")
+            return 0
+        if os.waitpid(pid, os.WNOHANG)[0]:
+            break
+        time.sleep(0.05)
+    print(f"chatsh daemon did not start; see {log_file}", file=sys.stderr)
+    return 1
@@ -0,0 +1,320 @@
+"""
+Streaming execution of shell code with bounded memory.
+
+Output is handed to a callback as it arrives, stdout and stderr are kept apart, and only
+a head/tail window of each stream is kept for the model. Anything large is spilled to a
+temp file so nothing is lost, without holding it in memory. Spill files live in one temp
+directory per process and are removed by remove_spills() when the session ends, or at exit.
+"""
+import asyncio
+import atexit
+import codecs
+import contextlib
+import functools
+import os
+import shutil
+import signal
+import tempfile
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+# Bytes of each stream kept for the model from the start and the end of the output
+HEAD_BYTES = 8 * 1024
+TAIL_BYTES = 8 * 1024
+# Once a stream grows past this, it is written to a temp file instead of kept in memory
+SPILL_BYTES = 1024 * 1024
+READ_SIZE = 64 * 1024
+# Seconds between SIGTERM and SIGKILL when stopping a command
+KILL_GRACE = 2.0
+
+# This process's spill directory, made at the first spill
+_spill_dir: Optional[str] = None
+
+
+def spill_dir() -> str:
+    global _spill_dir
+    if _spill_dir is None:
+        _spill_dir = tempfile.mkdtemp(prefix="chatsh-spill-")
+        atexit.register(remove_spills)  # a session that crashed never reached its own cleanup
+    return _spill_dir
+
+
+def remove_spills() -> None:
+    """Delete every spill file of this process; the paths in earlier outputs stop working."""
+    global _spill_dir
+    if _spill_dir is not None:
+        shutil.rmtree(_spill_dir, ignore_errors=True)
+        _spill_dir = None
+
+
+class OutputWindow:
+    """Head and tail of one output stream, its byte count and, if large, a spill file."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.total_bytes = 0
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.spill_path: Optional[str] = None
+        self._buffer = bytearray()  # everything so far, until it is spilled
+        self._spill_file = None
+
+    def write(self, data: bytes) -> None:
+        self.total_bytes += len(data)
+        if len(self.head) < HEAD_BYTES:
+            self.head += data[:HEAD_BYTES - len(self.head)]
+        self.tail += data[-TAIL_BYTES:]
+        del self.tail[:-TAIL_BYTES]
+
+        if self._spill_file is not None:
+            self._spill_file.write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) > SPILL_BYTES:
+            self._spill_file = tempfile.NamedTemporaryFile(
+                prefix=f"{self.name}-", suffix=".log", dir=spill_dir(), delete=False)
+            self.spill_path = self._spill_file.name
+            self._spill_file.write(self._buffer)
+            self._buffer = bytearray()
+
+    def close(self) -> None:
+        if self._spill_file is not None:
+            self._spill_file.close()
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > HEAD_BYTES + TAIL_BYTES
+
+    def text(self) -> str:
+        """The stream as shown to the model, with the middle elided if it is too long."""
+        if not self.truncated:
+            # short enough to never have been spilled, so the buffer holds all of it
+            return bytes(self._buffer).decode(errors='replace')
+        omitted = self.total_bytes - len(self.head) - len(self.tail)
+        where = f"; full output in {self.spill_path}" if self.spill_path else ""
+        return (bytes(self.head).decode(errors='replace')
+                + f"\n... [{omitted} of {self.total_bytes} bytes omitted{where}] ...\n"
+                + bytes(self.tail).decode(errors='replace'))
+
+
+@dataclass
+class ExecutionResult:
+    stdout: OutputWindow = field(default_factory=lambda: OutputWindow("stdout"))
+    stderr: OutputWindow = field(default_factory=lambda: OutputWindow("stderr"))
+    exit_code: Optional[int] = None
+    timed_out: bool = False
+    cancelled: bool = False
+    error: Optional[str] = None
+
+    def for_model(self) -> str:
+        """Labeled stdout/stderr sections plus how the command ended, for the conversation."""
+        sections = []
+        for window in (self.stdout, self.stderr):
+            text = window.text().strip()
+            if text:
+                sections.append(f"[{window.name}]\n{text}")
+        if self.error:
+            sections.append(f"[error]\n{self.error}")
+        if self.timed_out:
+            sections.append("[timed out and killed]")
+        elif self.cancelled:
+            sections.append("[cancelled by user]")
+        elif self.exit_code:
+            sections.append(f"[exit code {self.exit_code}]")
+        return "\n".join(sections)
+
+    def metadata(self) -> dict:
+        return {
+            "exit_code": self.exit_code,
+            "timed_out": self.timed_out,
+            "cancelled": self.cancelled,
+            "stdout_bytes": self.stdout.total_bytes,
+            "stderr_bytes": self.stderr.total_bytes,
+            "stdout_spill": self.stdout.spill_path,
+            "stderr_spill": self.stderr.spill_path,
+        }
+
+
+def new_process_group(terminal: Optional[int] = None) -> None:
+    """
+    In a command's process, before it execs: a process group of its own, so that it can be
+    killed as a whole, in chatsh's session, so that it can still open /dev/tty. Ctrl-Z is
+    ignored, as nobody could resume a stopped command. With terminal (a descriptor of the
+    controlling terminal) the group also takes the terminal's foreground.
+    """
+    os.setpgrp()
+    signal.signal(signal.SIGTSTP, signal.SIG_IGN)
+    if terminal is not None:
+        _set_foreground(terminal, os.getpgrp())
+
+
+def _set_foreground(terminal: int, pgid: int) -> None:
+    # from the background this would stop the caller, unless SIGTTOU is blocked
+    blocked = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTTOU})
+    try:
+        os.tcsetpgrp(terminal, pgid)
+    except OSError:
+        pass
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
+
+
+# Whether a command has the terminal; only one can at a time
+_terminal_lent = False
+
+
+@contextlib.contextmanager
+def lend_terminal(pgid: Optional[int] = None):
+    """
+    Let a command read the terminal while the block runs, as a shell does with the command
+    it runs, so that sudo, ssh and git can prompt on /dev/tty; Ctrl-C then goes to the
+    command. Only done if chatsh is in the foreground of its controlling terminal, and for
+    one command at a time: others run beside it in the background.
+
+    pgid is the process group of a command already running. For one the block starts,
+    pass the yielded function as its preexec_fn: it takes the terminal before the command
+    runs, so the command can never find itself in the background.
+    """
+    global _terminal_lent
+    try:
+        terminal = os.open("/dev/tty", os.O_RDWR | os.O_NOCTTY)
+    except OSError:
+        terminal = None  # no controlling terminal, as in headless runs
+    try:
+        lend = terminal is not None and not _terminal_lent and os.tcgetpgrp(terminal) == os.getpgrp()
+    except OSError:
+        lend = False
+    if lend:
+        _terminal_lent = True
+        if pgid is not None:
+            _set_foreground(terminal, pgid)
+    try:
+        yield functools.partial(new_process_group, terminal if lend else None)
+    finally:
+        if lend:
+            _terminal_lent = False
+            _set_foreground(terminal, os.getpgrp())
+        if terminal is not None:
+            os.close(terminal)
+
+
+def kill_group(proc, sig) -> None:
+    try:
+        os.killpg(proc.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def terminate(proc) -> None:
+    kill_group(proc, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), KILL_GRACE)
+    except asyncio.TimeoutError:
+        kill_group(proc, signal.SIGKILL)
+        await proc.wait()
+
+
+# Events of every wait_interruptible in progress; one SIGINT handler sets them all, so
+# concurrent waits neither steal Ctrl-C from each other nor restore the wrong handler
+_interrupt_listeners: List[asyncio.Event] = []
+_previous_sigint = None
+
+
+def _on_sigint() -> None:
+    for event in _interrupt_listeners:
+        event.set()
+
+
+async def wait_interruptible(awaitable, timeout: Optional[float]) -> str:
+    """
+    Wait for awaitable while Ctrl-C is routed to us instead of the event loop.
+
+    @return: "done", "timeout" or "cancelled" (Ctrl-C). The awaitable keeps running
+    unless it finished; stopping the work behind it is up to the caller.
+    """
+    global _previous_sigint
+    loop = asyncio.get_running_loop()
+    interrupted = asyncio.Event()
+    if not _interrupt_listeners:
+        previous_handler = signal.getsignal(signal.SIGINT)
+        try:
+            loop.add_signal_handler(signal.SIGINT, _on_sigint)
+            _previous_sigint = previous_handler
+        except (NotImplementedError, RuntimeError, ValueError):
+            _previous_sigint = None
+    _interrupt_listeners.append(interrupted)
+
+    finished = asyncio.ensure_future(awaitable)
+    cancel = asyncio.ensure_future(interrupted.wait())
+    try:
+        done, _ = await asyncio.wait([finished, cancel], timeout=timeout,
+                                     return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        cancel.cancel()
+        _interrupt_listeners.remove(interrupted)
+        if not _interrupt_listeners and _previous_sigint is not None:
+            loop.remove_signal_handler(signal.SIGINT)
+            signal.signal(signal.SIGINT, _previous_sigint)
+            _previous_sigint = None
+    if finished in done:
+        return "done"
+    return "cancelled" if cancel in done else "timeout"
+
+
+async def _pump(stream, window: OutputWindow, on_output) -> None:
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        data = await stream.read(READ_SIZE)
+        if not data:
+            break
+        window.write(data)
+        if on_output is not None:
+            on_output(window.name, decoder.decode(data))
+    window.close()
+
+
+async def execute_code(code: str,
+                       on_output: Optional[Callable[[str, str], None]] = None,
+                       timeout: Optional[float] = None,
+                       cwd: Optional[str] = None, env: Optional[dict] = None) -> ExecutionResult:
+    """
+    Run code in a shell in its own process group, streaming output to on_output(stream, text).
+    cwd and env default to ours.
+
+    The whole group is killed on timeout or Ctrl-C, so pipelines and background jobs
+    started by the command do not outlive it. While it runs, the command has the terminal
+    (see lend_terminal).
+    """
+    result = ExecutionResult()
+    with lend_terminal() as preexec_fn:
+        try:
+            proc = await asyncio.create_subprocess_shell(
+                code,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                preexec_fn=preexec_fn,
+                cwd=cwd,
+                env=env
+            )
+        except Exception as error:
+            result.error = str(error)
+            return result
+
+        pumps = asyncio.gather(_pump(proc.stdout, result.stdout, on_output),
+                               _pump(proc.stderr, result.stderr, on_output))
+        try:
+            outcome = await wait_interruptible(asyncio.gather(pumps, proc.wait()), timeout)
+            if outcome != "done":
+                result.cancelled = outcome == "cancelled"
+                result.timed_out = outcome == "timeout"
+                await terminate(proc)
+            await pumps
+            result.exit_code = await proc.wait()
+            # Ctrl-C went to the command itself, which had the terminal
+            result.cancelled = result.cancelled or result.exit_code == -signal.SIGINT
+        except asyncio.CancelledError:
+            result.cancelled = True
+            await terminate(proc)
+            raise
+    return result
@@ -0,0 +1,160 @@
+"""
+Send each turn to several models at once (`chatsh s,g,i`).
+
+Every backend gets the same conversation and is asked in parallel. The first model to
+produce text streams to the terminal, so a useful command shows up at the fastest
+model's latency. The others finish in the background, the user picks which answer
+continues the conversation, and the rest are logged as sibling branches. If the model
+that streams first fails before finishing, the first of the others to complete an
+answer takes over the turn.
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from chatsh.chat import MODELS, Chat, UsageEvent, chat, usage_to_dict
+
+# Seconds to wait for the slower models once the first answer is complete (Ctrl-C skips)
+FANOUT_WAIT = 60.0
+# Streamed between a lead that failed mid-reply and the answer that replaces it
+FALLBACK_SEPARATOR = "\n\n---\n\n"
+
+
+def parse_models(spec: str) -> List[str]:
+    """Model shortcodes or names separated by commas, without duplicates."""
+    models = []
+    for model in spec.split(","):
+        model = model.strip()
+        if model and model not in models:
+            models.append(model)
+    return models
+
+
+@dataclass
+class Reply:
+    model: str
+    text: str = ""
+    usage: Optional[dict] = None
+    error: Optional[BaseException] = None
+    done: bool = False
+
+
+class FanOutChat(Chat):
+    def __init__(self, models: List[str], make_chat: Callable[[str], Chat] = chat):
+        super().__init__()
+        self.models = models
+        self.backends: Dict[str, Chat] = {model: make_chat(model) for model in models}
+        self.replies: Dict[str, Reply] = {}
+        self.lead: Optional[str] = None
+        # the model that streamed first but failed before finishing, if any
+        self.failed_lead: Optional[str] = None
+        self._pending: List[asyncio.Task] = []
+
+    def _sync(self) -> None:
+        for backend in self.backends.values():
+            backend.messages = list(self.messages)
+
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False, history_cacheable=False):
+        """Stream the first model to answer; the others keep running until wait_for_others()."""
+        # messages may have been trimmed (back) or replaced (resume) since the last turn
+        self._sync()
+        self.replies = {name: Reply(name) for name in self.models}
+        self.lead = None
+        self.failed_lead = None
+        queue = asyncio.Queue()
+
+        async def run(name):
+            reply = self.replies[name]
+            try:
+                async for chunk in self.backends[name].ask(
+                        user_message, system, name, temperature=temperature, max_tokens=max_tokens,
+                        stream=stream, system_cacheable=system_cacheable, history_cacheable=history_cacheable):
+                    if isinstance(chunk, UsageEvent):
+                        reply.usage = chunk.usage
+                    else:
+                        reply.text += chunk
+                        queue.put_nowait(name)
+            except Exception as error:
+                reply.error = error
+            finally:
+                reply.done = True
+                queue.put_nowait(name)
+
+        self._pending = [asyncio.ensure_future(run(name)) for name in self.models]
+        try:
+            sent = 0
+            while True:
+                name = await queue.get()
+                reply = self.replies[name]
+                if self.lead is None:
+                    if reply.text:
+                        self.lead = name
+                    elif all(r.done for r in self.replies.values()):
+                        # nobody produced any text
+                        raise next((r.error for r in self.replies.values() if r.error),
+                                   RuntimeError("No model returned an answer"))
+                    else:
+                        continue
+                if name != self.lead:
+                    continue
+                if len(reply.text) > sent:
+                    yield reply.text[sent:]
+                    sent = len(reply.text)
+                if reply.done:
+                    break
+            lead = self.replies[self.lead]
+            if lead.error is not None:
+                # the lead broke off mid-reply: carry on with the first answer that completes
+                fallback = await self._first_success(queue)
+                if fallback is None:
+                    raise lead.error
+                self.failed_lead, self.lead, lead = self.lead, fallback.model, fallback
+                if sent:
+                    yield FALLBACK_SEPARATOR
+                yield lead.text
+        except BaseException:
+            self.cancel()
+            raise
+
+        usage = {**usage_to_dict(None), **(lead.usage or {}), "model": self.lead}
+        yield self._finish_turn(user_message, lead.text, usage)
+
+    async def _first_success(self, queue: asyncio.Queue) -> Optional[Reply]:
+        """Wait for a model to finish an answer; None once every model is done without one."""
+        while True:
+            for reply in self.replies.values():
+                if reply.done and reply.error is None and reply.text:
+                    return reply
+            if all(reply.done for reply in self.replies.values()):
+                return None
+            await queue.get()
+
+    async def wait_for_others(self, timeout: Optional[float] = FANOUT_WAIT) -> None:
+        """Let the slower models finish; Ctrl-C or the timeout cancels the stragglers."""
+        from chatsh.execution import wait_interruptible
+        pending = [task for task in self._pending if not task.done()]
+        if pending:
+            await wait_interruptible(asyncio.gather(*pending, return_exceptions=True), timeout)
+        self.cancel()
+
+    def cancel(self) -> None:
+        for task in self._pending:
+            task.cancel()
+
+    def alternatives(self) -> List[Reply]:
+        """Finished answers other than the lead, in model order."""
+        return [reply for name, reply in self.replies.items()
+                if name != self.lead and reply.done and reply.error is None and reply.text]
+
+    def choose(self, name: str) -> Reply:
+        """Continue the conversation with name's answer instead of the lead's."""
+        reply = self.replies[name]
+        self.messages[-1] = {"role": "assistant", "content": reply.text}
+        if self.usage:
+            self.usage[-1] = {**usage_to_dict(None), **(reply.usage or {}), "model": name}
+        self._sync()
+        return reply
+
+
+def model_label(model: str) -> str:
+    return f"{model} ({MODELS[model]})" if model in MODELS else model
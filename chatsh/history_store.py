@@ -0,0 +1,220 @@
+"""
+SQLite index over the interaction logs of every session.
+
+The JSONL files stay the source of truth; the store is a derived index that makes
+searching thousands of sessions a query instead of a pass over all of them. It lives next
+to the logs, runs in WAL mode so a live session can write while another searches, and
+keeps an FTS5 index over the content (falling back to LIKE where SQLite lacks FTS5).
+Files are (re)imported whenever their size differs from what was indexed.
+
+    chatsh history search "docker compose" [--type llm_response] [--limit 20]
+    chatsh history import [FILE ...]
+    chatsh history convert OLD.json ...
+"""
+import argparse
+import asyncio
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from chatsh.interaction_log import (Interaction, InteractionType, convert_json_log, default_log_dir,
+                                    iter_interactions, log_files)
+
+DB_NAME = "history.sqlite3"
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    file TEXT UNIQUE NOT NULL,
+    indexed_bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS interactions (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    interaction_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    metadata TEXT,
+    parent_id INTEGER,
+    UNIQUE (session_id, interaction_id)
+);
+CREATE INDEX IF NOT EXISTS interactions_type ON interactions(type);
+CREATE INDEX IF NOT EXISTS interactions_timestamp ON interactions(timestamp);
+CREATE INDEX IF NOT EXISTS interactions_parent ON interactions(session_id, parent_id);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS interactions_fts USING fts5(
+    content, content='interactions', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS interactions_fts_insert AFTER INSERT ON interactions BEGIN
+    INSERT INTO interactions_fts(rowid, content) VALUES (new.rowid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS interactions_fts_delete AFTER DELETE ON interactions BEGIN
+    INSERT INTO interactions_fts(interactions_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS interactions_fts_update AFTER UPDATE OF content ON interactions BEGIN
+    INSERT INTO interactions_fts(interactions_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+    INSERT INTO interactions_fts(rowid, content) VALUES (new.rowid, new.content);
+END;
+"""
+
+
+class HistoryStore:
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or default_log_dir() / DB_NAME
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # used from the event loop's executor threads, serialized by the lock
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        with self.db:
+            self.db.executescript(SCHEMA)
+            try:
+                self.db.executescript(FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                self.fts = False
+            self.db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self) -> None:
+        self.db.close()
+
+    def _session_id(self, file: Path) -> int:
+        key = str(file.resolve())
+        self.db.execute("INSERT OR IGNORE INTO sessions(file) VALUES (?)", (key,))
+        return self.db.execute("SELECT id FROM sessions WHERE file = ?", (key,)).fetchone()[0]
+
+    def add(self, file: Path, interactions: Iterable[Interaction]) -> None:
+        """Index interactions of the session logged to file, and note how much of it is indexed."""
+        with self.lock, self.db:
+            session_id = self._session_id(file)
+            self.db.executemany(
+                "INSERT INTO interactions"
+                "(session_id, interaction_id, type, content, timestamp, metadata, parent_id)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(session_id, interaction_id) DO UPDATE SET type = excluded.type,"
+                " content = excluded.content, timestamp = excluded.timestamp,"
+                " metadata = excluded.metadata, parent_id = excluded.parent_id",
+                [(session_id, i.interaction_id, i.type.value, i.content, i.timestamp.isoformat(),
+                  json.dumps(i.metadata) if i.metadata else None, i.parent_id)
+                 for i in interactions])
+            self.db.execute("UPDATE sessions SET indexed_bytes = ? WHERE id = ?",
+                            (_size(file), session_id))
+
+    def is_current(self, file: Path) -> bool:
+        with self.lock:
+            row = self.db.execute("SELECT indexed_bytes FROM sessions WHERE file = ?",
+                                  (str(file.resolve()),)).fetchone()
+        return row is not None and row[0] == _size(file)
+
+    def forget(self, file: Path) -> None:
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM sessions WHERE file = ?", (str(file.resolve()),))
+
+    def search(self, query: str, type: Optional[InteractionType] = None,
+               limit: int = 20) -> List[sqlite3.Row]:
+        """
+        Interactions matching query, best matches first.
+
+        @return: rows with file, interaction_id, type, timestamp, parent_id and snippet.
+        """
+        where, params = [], []
+        if self.fts:
+            source = ("interactions_fts JOIN interactions ON interactions.rowid = interactions_fts.rowid")
+            snippet = "snippet(interactions_fts, 0, '[', ']', ' ... ', 12)"
+            where.append("interactions_fts MATCH ?")
+            params.append(_fts_query(query))
+            order = "bm25(interactions_fts)"
+        else:
+            source = "interactions"
+            snippet = "substr(content, 1, 120)"
+            where.append("content LIKE ?")
+            params.append(f"%{query}%")
+            order = "timestamp DESC"
+        if type is not None:
+            where.append("type = ?")
+            params.append(InteractionType(type).value)
+        params.append(limit)
+        sql = (f"SELECT sessions.file, interaction_id, type, timestamp, parent_id, {snippet} AS snippet"
+               f" FROM {source} JOIN sessions ON sessions.id = interactions.session_id"
+               f" WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ?")
+        with self.lock:
+            cursor = self.db.execute(sql, params)
+            cursor.row_factory = sqlite3.Row
+            return cursor.fetchall()
+
+
+def _size(file: Path) -> int:
+    try:
+        return file.stat().st_size
+    except OSError:
+        return 0
+
+
+def _fts_query(query: str) -> str:
+    """Treat every word as a literal term, so punctuation in shell snippets is not FTS syntax."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+async def import_logs(store: HistoryStore, files: Iterable[Path]) -> int:
+    """Index every file that changed since it was last indexed; returns how many were."""
+    loop = asyncio.get_running_loop()
+    imported = 0
+    for file in files:
+        if store.is_current(file):
+            continue
+        try:
+            interactions = [interaction async for interaction in iter_interactions(file)]
+        except (OSError, ValueError, KeyError) as error:
+            print(f"Skipping {file}: {error}")
+            continue
+        await loop.run_in_executor(None, store.forget, file)
+        await loop.run_in_executor(None, store.add, file, interactions)
+        imported += 1
+    return imported
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="chatsh history", description="Search and index past sessions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    search = commands.add_parser("search", help="full-text search over every session")
+    search.add_argument("query", nargs="+")
+    search.add_argument("--type", choices=[t.value for t in InteractionType], default=None)
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument("--no-sync", action="store_true", help="do not index new sessions first")
+    index = commands.add_parser("import", help="index interaction logs (all of them by default)")
+    index.add_argument("files", nargs="*", type=Path)
+    convert = commands.add_parser("convert", help="convert JSON-array logs to JSONL")
+    convert.add_argument("files", nargs="+", type=Path)
+    return parser.parse_args(argv)
+
+
+async def run(args) -> None:
+    if args.command == "convert":
+        for file in args.files:
+            print(await convert_json_log(file))
+        return
+
+    store = HistoryStore()
+    try:
+        if args.command == "import":
+            count = await import_logs(store, args.files or log_files(default_log_dir()))
+            print(f"Indexed {count} session(s) into {store.path}")
+            return
+
+        if not args.no_sync:
+            await import_logs(store, log_files(default_log_dir()))
+        for row in store.search(" ".join(args.query), type=args.type, limit=args.limit):
+            snippet = " ".join(row["snippet"].split())
+            print(f"{row['file']}#{row['interaction_id']}  {row['timestamp'][:19]}  {row['type']}\n    {snippet}")
+    finally:
+        store.close()
+
+
+def main(argv=None) -> None:
+    asyncio.run(run(parse_args(argv)))
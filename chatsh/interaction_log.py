@@ -6,14 +6,18 @@ Eventually this would be used to inspect interaction histories, and hopefully en
 - conversation playback: replay the conversation from a specific point to understand the context
 - training on the conversation branch that ended up being taken by the user to improve the model
 """
-from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum, auto, EnumMeta
 from pathlib import Path
-from dataclasses_json import dataclass_json, config
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator
+import asyncio
 import aiofiles
 import json
+import os
+import sys
+import time
+
+from chatsh.blob_store import BlobStore, BlobText, use_blobs
 
 
 class StrEnumMeta(EnumMeta):
@@ -46,65 +50,221 @@ class InteractionType(AutoNameLower):
     SYSTEM_MESSAGE = auto()
 
 
-@dataclass_json
-@dataclass
 class Interaction:
-    type: InteractionType
-    content: str
-    timestamp: datetime = field(
-        metadata=config(
-            encoder=datetime.isoformat,
-            decoder=datetime.fromisoformat
+    """
+    One logged event. Slotted, as a long session holds many; with a BlobStore (see
+    use_blobs) a long content is kept there and read back when accessed.
+    """
+    __slots__ = ("type", "_content", "timestamp", "metadata", "parent_id", "interaction_id", "_blobs")
+    content = BlobText()
+
+    def __init__(self, type: InteractionType, content: str, timestamp: datetime,
+                 metadata: Optional[Dict[str, Any]] = None, parent_id: Optional[int] = None,
+                 interaction_id: Optional[int] = None, blobs: Optional[BlobStore] = None):
+        self._blobs = blobs
+        self.type = type
+        self.content = content
+        self.timestamp = timestamp
+        self.metadata = metadata if metadata is not None else {}
+        self.parent_id = parent_id
+        self.interaction_id = interaction_id
+
+    def use_blobs(self, blobs: Optional[BlobStore]) -> None:
+        use_blobs(self, blobs, "content")
+
+    def __eq__(self, other):
+        if not isinstance(other, Interaction):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (f"Interaction(type={self.type!r}, content={self._content!r}, timestamp={self.timestamp!r}, "
+                f"metadata={self.metadata!r}, parent_id={self.parent_id!r}, interaction_id={self.interaction_id!r})")
+
+    # Hand-written rather than dataclasses_json, which costs ~100 ms of startup to import
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "type": self.type,
+            "content": self.content,
+            "timestamp": self.timestamp.isoformat(),
+            "metadata": self.metadata,
+            "parent_id": self.parent_id,
+            "interaction_id": self.interaction_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Interaction':
+        return cls(
+            type=InteractionType(data["type"]),
+            content=data["content"],
+            timestamp=datetime.fromisoformat(data["timestamp"]),
+            metadata=data.get("metadata") or {},
+            parent_id=data.get("parent_id"),
+            interaction_id=data.get("interaction_id"),
         )
-    )
-    metadata: Dict[str, Any] = field(default_factory=dict)
-    parent_id: Optional[int] = field(default=None)
-    interaction_id: Optional[int] = field(default=None)
+
+
+# Bytes read at a time when streaming a log file
+READ_SIZE = 256 * 1024
+
+
+def default_log_dir() -> Path:
+    return Path.home() / '.local' / 'share' / 'chatsh_history'
+
+
+class FsyncPolicy(AutoNameLower):
+    NEVER = auto()   # leave it to the OS
+    BATCH = auto()   # fsync after every batch the writer flushes
+    ALWAYS = auto()  # write and fsync every record before add_interaction returns
 
 
 class InteractionLog:
-    def __init__(self, log_dir: Optional[Path] = None):
+    """
+    Append-only JSONL log, one interaction per line.
+
+    Records are buffered and written in batches by a background task, once FLUSH_BYTES
+    are pending or FLUSH_INTERVAL seconds have passed, and on flush()/close(). A crash
+    can lose at most the unflushed batch, never corrupt earlier records: a record torn by
+    a crash is skipped when the log is read and cut off before the log is appended to.
+    A batch that fails to write stays pending and is retried.
+    """
+    FLUSH_BYTES = 64 * 1024
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, log_dir: Optional[Path] = None, fsync: FsyncPolicy = FsyncPolicy.BATCH,
+                 store=None, tag: Optional[str] = None, blobs: Optional[BlobStore] = None):
+        """
+        store: optional history_store.HistoryStore that every flushed batch is also indexed in.
+        tag: appended to the file name, so logs started in the same second stay apart.
+        blobs: where long contents are kept once their record is queued for writing, so
+        the records held in memory stay small however long the session runs.
+        """
         if log_dir is None:
-            xdg_data_home = Path(Path.home() / '.local' / 'share')
-            log_dir = xdg_data_home / 'chatsh_history'
+            log_dir = default_log_dir()
         
         self.log_dir = log_dir
         self.log_dir.mkdir(parents=True, exist_ok=True)
-        self.current_file = self.log_dir / f"interaction_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        name = datetime.now().strftime('%Y%m%d_%H%M%S') + (f"_{tag}" if tag else "")
+        self.current_file = self.log_dir / f"interaction_log_{name}.jsonl"
         self.interactions: List[Interaction] = []
         self.next_id = 1
-        
-        # Initialize empty array if file doesn't exist
-        if not self.current_file.exists():
-            self.current_file.write_text('[\n]')
+        # Tree index, kept up to date as interactions are added; roots are children of None
+        self._by_id: Dict[int, Interaction] = {}
+        self._children: Dict[Optional[int], List[int]] = {}
+        self.fsync = FsyncPolicy(fsync)
+        self.store = store
+        self.blobs = blobs
+        # total time add_interaction has kept its callers waiting, for telemetry
+        self.record_seconds = 0.0
+        self._pending: List[str] = []
+        self._unindexed: List[Interaction] = []
+        self._pending_bytes = 0
+        self._tail_repaired = False
+        self._closing = False
+        self._write_error: Optional[str] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._write_lock: Optional[asyncio.Lock] = None
 
     def _get_next_id(self) -> int:
         current_id = self.next_id
         self.next_id += 1
         return current_id
 
-    async def _append_interaction_to_file(self, interaction: Interaction) -> None:
-        """Append an interaction to the JSON file with array items at column 0 but internal indentation"""
-        # Format the interaction JSON with indentation
-        interaction_json = json.dumps(interaction.to_dict(), indent=2)
-        # The object itself starts at column 0, but its contents are indented 2 spaces
-        formatted_interaction = interaction_json
-
-        async with aiofiles.open(self.current_file, 'rb+') as f:
-            # Read current size
-            await f.seek(0, 2)  # Seek to end
-            size = await f.tell()
-            
-            if size <= 3:  # File just has '[\n]'
-                # For first item, write after opening [
-                await f.seek(1)  # Position after [
-                await f.write(f"\n{formatted_interaction}".encode())
-                await f.write(b"\n]")
-            else:
-                # For subsequent items, add comma and newline after previous item
-                await f.seek(size - 2)  # Position before \n]
-                await f.write(f",\n{formatted_interaction}".encode())
-                await f.write(b"\n]")
+    def _index(self, interaction: Interaction) -> None:
+        self.interactions.append(interaction)
+        self._by_id[interaction.interaction_id] = interaction
+        parent_id = interaction.parent_id if interaction.parent_id in self._by_id else None
+        self._children.setdefault(parent_id, []).append(interaction.interaction_id)
+
+    def _enqueue(self, interaction: Interaction) -> None:
+        line = json.dumps(interaction.to_dict(), separators=(',', ':')) + "\n"
+        self._pending.append(line)
+        if self.store is not None:
+            self._unindexed.append(interaction)
+        self._pending_bytes += len(line)
+        if self._writer is None:
+            # created lazily so they bind to the running loop
+            self._flush_requested = asyncio.Event()
+            self._write_lock = asyncio.Lock()
+            self._closing = False
+            self._writer = asyncio.ensure_future(self._run_writer())
+        if self._pending_bytes >= self.FLUSH_BYTES:
+            self._flush_requested.set()
+
+    async def _run_writer(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            if self._closing:
+                return  # close() writes what is left
+            try:
+                await self.flush()
+            except Exception as error:
+                # the batch is still pending; a full disk or a lost mount may come back
+                if str(error) != self._write_error:
+                    print(f"chatsh: could not write {self.current_file}, will retry: {error}", file=sys.stderr)
+                self._write_error = str(error)
+
+    async def flush(self) -> None:
+        """Write out all pending records."""
+        if self._write_lock is None:
+            return
+        async with self._write_lock:
+            if not self._pending:
+                return
+            # records stay pending until they are on disk, so a failed or cancelled write loses none
+            count, indexed = len(self._pending), len(self._unindexed)
+            batch = "".join(self._pending[:count])
+            size = self._prepare_append()
+            try:
+                async with aiofiles.open(self.current_file, 'a') as f:
+                    await f.write(batch)
+                    if self.fsync != FsyncPolicy.NEVER:
+                        await f.flush()
+                        await asyncio.get_running_loop().run_in_executor(None, os.fsync, f.fileno())
+            except BaseException:
+                try:
+                    os.truncate(self.current_file, size)  # no half-written batch for the retry to follow
+                except OSError:
+                    pass
+                raise
+            del self._pending[:count]
+            self._pending_bytes -= len(batch)
+            self._write_error = None
+            if self.store is not None:
+                batch, self._unindexed = self._unindexed[:indexed], self._unindexed[indexed:]
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.store.add, self.current_file, batch)
+
+    def _prepare_append(self) -> int:
+        """The file's size, after cutting off a record a crash tore (the first time only)."""
+        if not self._tail_repaired:
+            if self.current_file.exists():
+                repair_tail(self.current_file)
+            self._tail_repaired = True
+        try:
+            return self.current_file.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    async def close(self) -> None:
+        """Stop the background writer and flush what is left, blobs included."""
+        if self._writer is not None:
+            self._closing = True
+            self._flush_requested.set()
+            try:
+                await self._writer
+            finally:
+                self._writer = None
+        await self.flush()
+        if self.blobs is not None:
+            await self.blobs.flush()
 
     async def add_interaction(self, 
                             type: InteractionType, 
@@ -115,6 +275,7 @@ class InteractionLog:
         Add a new interaction to the log and write it to disk.
         Returns the interaction_id of the newly added interaction.
         """
+        started = time.perf_counter()
         interaction_id = self._get_next_id()
         interaction = Interaction(
             type=type,
@@ -125,9 +286,13 @@ class InteractionLog:
             interaction_id=interaction_id
         )
         
-        self.interactions.append(interaction)
-        await self._append_interaction_to_file(interaction)
-        
+        self._index(interaction)
+        self._enqueue(interaction)
+        if self.blobs is not None:
+            interaction.use_blobs(self.blobs)
+        if self.fsync == FsyncPolicy.ALWAYS:
+            await self.flush()
+        self.record_seconds += time.perf_counter() - started
         return interaction_id
 
     async def record_user_message(self, message: str) -> int:
@@ -137,19 +302,23 @@ class InteractionLog:
             content=message
         )
 
-    async def record_llm_response(self, response: str, parent_id: int) -> int:
+    async def record_llm_response(self, response: str, parent_id: int,
+                                  metadata: Optional[Dict[str, Any]] = None) -> int:
         """Record the LLM's response to a user message."""
         return await self.add_interaction(
             type=InteractionType.LLM_RESPONSE,
             content=response,
+            metadata=metadata,
             parent_id=parent_id
         )
 
-    async def record_code_execution_prompt(self, code: str, parent_id: int) -> int:
+    async def record_code_execution_prompt(self, code: str, parent_id: int,
+                                           metadata: Optional[Dict[str, Any]] = None) -> int:
         """Record when the user is prompted about code execution."""
         return await self.add_interaction(
             type=InteractionType.CODE_EXECUTION_PROMPT,
             content=code,
+            metadata=metadata,
             parent_id=parent_id
         )
 
@@ -162,11 +331,13 @@ class InteractionLog:
             parent_id=parent_id
         )
 
-    async def record_code_output(self, output: str, parent_id: int) -> int:
+    async def record_code_output(self, output: str, parent_id: int,
+                                 metadata: Optional[Dict[str, Any]] = None) -> int:
         """Record the output of executed code."""
         return await self.add_interaction(
             type=InteractionType.CODE_EXECUTION_OUTPUT,
             content=output,
+            metadata=metadata,
             parent_id=parent_id
         )
 
@@ -194,50 +365,90 @@ class InteractionLog:
             parent_id=parent_id
         )
 
-    async def record_system_message(self, message: str, parent_id: Optional[int] = None) -> int:
+    async def record_system_message(self, message: str, parent_id: Optional[int] = None,
+                                    metadata: Optional[Dict[str, Any]] = None) -> int:
         """Record a system message or notification."""
         return await self.add_interaction(
             type=InteractionType.SYSTEM_MESSAGE,
             content=message,
+            metadata=metadata,
             parent_id=parent_id
         )
 
+    def get_interaction(self, interaction_id: int) -> Optional[Interaction]:
+        return self._by_id.get(interaction_id)
+
+    def get_children(self, interaction_id: Optional[int]) -> List[Interaction]:
+        """Direct replies to an interaction, oldest first; None gives the roots."""
+        return [self._by_id[child] for child in self._children.get(interaction_id, ())]
+
+    def iter_ancestors(self, interaction_id: int) -> Iterator[Interaction]:
+        """The interaction and its ancestors, walking up to the root; O(depth)."""
+        interaction = self._by_id.get(interaction_id)
+        while interaction is not None:
+            yield interaction
+            interaction = self._by_id.get(interaction.parent_id)
+
+    def iter_subtree(self, interaction_id: Optional[int]) -> Iterator[Interaction]:
+        """The interaction and everything that descends from it, depth first, oldest child first."""
+        stack = [interaction_id] if interaction_id is not None else list(reversed(self._children.get(None, ())))
+        while stack:
+            current = stack.pop()
+            if current in self._by_id:
+                yield self._by_id[current]
+            stack.extend(reversed(self._children.get(current, ())))
+
+    def iter_branches(self, interaction_id: Optional[int] = None) -> Iterator[List[Interaction]]:
+        """
+        Multiverse travel: every root-to-leaf path through the subtree of interaction_id
+        (the whole log by default), one list per leaf, in the order the leaves were reached.
+        """
+        prefix = list(self.iter_ancestors(interaction_id))[:0:-1] if interaction_id is not None else []
+        starts = [interaction_id] if interaction_id is not None else self._children.get(None, [])
+        path: List[Interaction] = []
+        # (id, depth) pairs; the path is cut back to depth before id is appended
+        stack = [(start, 0) for start in reversed(starts)]
+        while stack:
+            current, depth = stack.pop()
+            del path[depth:]
+            path.append(self._by_id[current])
+            children = self._children.get(current)
+            if children:
+                stack.extend((child, depth + 1) for child in reversed(children))
+            else:
+                yield prefix + path
+
     async def get_conversation_branch(self, interaction_id: int) -> List[Interaction]:
         """
         Get all interactions in a conversation branch leading to the specified interaction.
         """
-        branch = []
-        current_id = interaction_id
-        
-        # Create a map of id to interaction for faster lookup
-        id_map = {i.interaction_id: i for i in self.interactions}
-        
-        while current_id is not None:
-            if current_id not in id_map:
-                break
-            
-            interaction = id_map[current_id]
-            branch.insert(0, interaction)
-            current_id = interaction.parent_id
-            
+        branch = list(self.iter_ancestors(interaction_id))
+        branch.reverse()
         return branch
 
     @classmethod
-    async def load_from_file(cls, file_path: Path) -> 'InteractionLog':
-        """Load an interaction log from a file."""
-        log = cls(log_dir=file_path.parent)
+    async def load_from_file(cls, file_path: Path, **kwargs) -> 'InteractionLog':
+        """
+        Load an interaction log from a file, streaming JSONL line by line.
+
+        New interactions are appended to the same file. A legacy JSON-array log is first
+        converted to JSONL next to it (once; its conversion is used from then on), and that
+        file is loaded and appended to, so it holds the whole session. kwargs go to the
+        constructor.
+        """
+        if file_path.suffix != '.jsonl':
+            converted = file_path.with_suffix('.jsonl')
+            file_path = converted if converted.exists() else await convert_json_log(file_path)
+        log = cls(log_dir=file_path.parent, **kwargs)
+        log.current_file = file_path
         
-        async with aiofiles.open(file_path, 'r') as f:
-            content = await f.read()
-            # Parse as JSON array
-            interactions_data = json.loads(content)
-            
-            for interaction_data in interactions_data:
-                interaction = Interaction.from_dict(interaction_data)
-                log.interactions.append(interaction)
-                # Update next_id to be higher than any loaded id
-                if interaction.interaction_id and interaction.interaction_id >= log.next_id:
-                    log.next_id = interaction.interaction_id + 1
+        async for interaction in iter_interactions(file_path):
+            if log.blobs is not None:
+                interaction.use_blobs(log.blobs)
+            log._index(interaction)
+            # Update next_id to be higher than any loaded id
+            if interaction.interaction_id and interaction.interaction_id >= log.next_id:
+                log.next_id = interaction.interaction_id + 1
         
         return log
 
@@ -255,13 +466,103 @@ class InteractionLog:
         
         # Get the branch leading to start_id
         branch = await self.get_conversation_branch(start_id)
+        if not branch:
+            return []
         
-        # Find all subsequent interactions that branch from this path
-        branch_ids = {i.interaction_id for i in branch}
+        # Interactions recorded after start_id that reply to something on this path
         subsequent = [
-            i for i in self.interactions 
-            if i.timestamp > branch[-1].timestamp 
-            and (i.parent_id in branch_ids or i.interaction_id in branch_ids)
+            child for interaction in branch
+            for child in self._children.get(interaction.interaction_id, ())
+            if child > start_id
         ]
+        subsequent.sort()
         
-        return branch + subsequent
\ No newline at end of file
+        return branch + [self._by_id[child] for child in subsequent]
+
+
+def log_files(log_dir: Path) -> List[Path]:
+    """Every session log in log_dir; a JSON-array log is skipped once it has been converted."""
+    jsonl = sorted(log_dir.glob("interaction_log_*.jsonl"))
+    converted = {file.stem for file in jsonl}
+    return [file for file in sorted(log_dir.glob("interaction_log_*.json"))
+            if file.stem not in converted] + jsonl
+
+
+async def iter_interactions(file_path: Path):
+    """
+    Yield the interactions in a log file. JSONL logs are streamed line by line; the older
+    JSON-array logs have to be parsed whole.
+    """
+    # a record torn by a crash can end inside a character
+    async with aiofiles.open(file_path, 'r', errors='replace') as f:
+        first = await f.read(1)
+        while first and first.isspace():
+            first = await f.read(1)
+        if first == '[':
+            for interaction_data in json.loads(first + await f.read()):
+                yield Interaction.from_dict(interaction_data)
+            return
+
+        await f.seek(0)
+        # read in chunks: iterating lines through aiofiles costs a thread hop per line
+        rest = ""
+        while True:
+            chunk = await f.read(READ_SIZE)
+            if not chunk:
+                break
+            lines = (rest + chunk).split("\n")
+            rest = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield Interaction.from_dict(json.loads(line))
+        if rest.strip():
+            try:
+                data = json.loads(rest)
+            except ValueError:
+                return  # the last record, torn by a crash while it was written
+            yield Interaction.from_dict(data)
+
+
+def repair_tail(file_path: Path) -> None:
+    """
+    Make a JSONL log end in a newline, so the next record starts a line of its own: a
+    last line that is a whole record gets its newline, a torn one is cut off.
+    """
+    with open(file_path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        start = position = size
+        while position > 0:
+            step = min(READ_SIZE, position)
+            position -= step
+            f.seek(position)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                start = position + newline + 1
+                break
+        else:
+            start = 0
+        f.seek(start)
+        try:
+            json.loads(f.read())
+        except ValueError:
+            f.truncate(start)
+        else:
+            f.write(b"\n")
+
+
+async def convert_json_log(file_path: Path) -> Path:
+    """Convert a JSON-array log to JSONL next to it; returns the new file."""
+    target = file_path.with_suffix('.jsonl')
+    # written aside and renamed, so a JSONL file next to a legacy log is always a whole conversion
+    partial = file_path.with_suffix('.jsonl.partial')
+    async with aiofiles.open(partial, 'w') as out:
+        async for interaction in iter_interactions(file_path):
+            await out.write(json.dumps(interaction.to_dict(), separators=(',', ':')) + "\n")
+    os.replace(partial, target)
+    return target
+
@@ -0,0 +1,220 @@
+"""
+Run every ```sh block of a reply, the independent ones at the same time (`--parallel`).
+
+Blocks are analysed before anything runs. A block is a barrier if it changes shell state
+(cd, export, source, ...), runs a command not known to be read-only, or cannot be parsed.
+A barrier waits for every earlier block, and every later block waits for it. Any other
+block waits only for earlier blocks that write a file it mentions, or that mention a file
+it writes. Two annotations on a block's first line override the analysis for that block:
+`# chatsh: independent` waits for nothing, and `# chatsh: after 1 3` waits for exactly
+blocks 1 and 3.
+
+Barriers run in the persistent shell, so their effects carry over as usual. The other
+blocks run in processes of their own, started from the shell's working directory and
+exported environment, at most `jobs` at a time.
+"""
+import asyncio
+import re
+import shlex
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from chatsh.execution import ExecutionResult, execute_code
+from chatsh.shell_session import ShellSession
+
+DEFAULT_JOBS = 4
+
+# Commands that neither change the shell nor write files, unless WRITING_FLAGS say otherwise
+READ_ONLY_COMMANDS = {
+    "ls", "cat", "head", "tail", "grep", "egrep", "fgrep", "rg", "ag", "find", "wc", "du", "df",
+    "stat", "file", "tree", "echo", "printf", "pwd", "whoami", "id", "hostname", "uname", "date",
+    "uptime", "free", "ps", "pgrep", "which", "printenv", "ping", "curl", "dig", "nslookup",
+    "host", "traceroute", "ssh", "sort", "uniq", "cut", "awk", "sed", "tr", "jq", "diff", "cmp",
+    "md5sum", "sha1sum", "sha256sum", "realpath", "readlink", "basename", "dirname", "test",
+    "[", "[[", "]]", "true", "false", "sleep", "lsof", "netstat", "ss", "nproc", "lscpu",
+    "lsblk", "tee", "column", "less", "more", "zcat", "nl", "strings", "od", "xxd",
+}
+# Read-only subcommands of commands that can also write
+READ_ONLY_SUBCOMMANDS = {
+    "git": {"status", "log", "diff", "show", "grep", "blame", "rev-parse", "ls-files", "shortlog", "describe"},
+    "docker": {"ps", "images", "inspect", "logs", "version", "info"},
+    "kubectl": {"get", "describe", "logs", "version", "top"},
+    "systemctl": {"status", "is-active", "is-enabled", "list-units"},
+}
+# Flags that make an otherwise read-only command write, or run arbitrary commands
+WRITING_FLAGS = {
+    "find": ("-delete", "-exec", "-execdir", "-ok", "-okdir", "-fprint", "-fls"),
+    "sed": ("-i", "--in-place"),
+    "curl": ("-o", "-O", "--output", "--remote-name"),
+    "sort": ("-o", "--output"),
+}
+# Words that start a compound command, after which the next word is a command again
+KEYWORDS = {"if", "then", "else", "elif", "fi", "do", "done", "while", "until", "esac", "{", "}", "!", "time"}
+SEPARATORS = {";", "&&", "||", "|", "&", "(", ")", "|&", ";;"}
+REDIRECTS = {">", ">>", ">|", "&>", "&>>", "<", "<>"}
+ANNOTATION = re.compile(r"^\s*#\s*chatsh:\s*(independent|after((?:\s+\d+)+))\s*$")
+
+
+@dataclass
+class BlockPlan:
+    index: int  # 0-based
+    code: str
+    depends_on: List[int] = field(default_factory=list)
+    barrier: bool = False
+    reason: str = ""  # why it is a barrier
+
+    def describe(self) -> str:
+        if self.barrier:
+            return f"runs in the shell ({self.reason})"
+        if self.depends_on:
+            return "after block " + ", ".join(str(i + 1) for i in self.depends_on)
+        return "independent"
+
+
+def _command_words(code: str) -> Tuple[Optional[str], Set[str], Set[str]]:
+    """
+    @return: (reason the block is a barrier or None, files it writes, words it mentions).
+    """
+    if "$(" in code or "`" in code or "<<" in code:
+        return "command substitution or here-document", set(), set()
+    writes: Set[str] = set()
+    words: Set[str] = set()
+    for line in code.replace("\\\n", " ").splitlines():
+        lexer = shlex.shlex(line, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        try:
+            tokens = list(lexer)
+        except ValueError as error:
+            return f"cannot be parsed: {error}", set(), set()
+
+        expect_command, in_loop_header, assigned = True, False, False
+        command, arguments = None, []
+        for position, token in enumerate(tokens + [";"]):
+            if token in SEPARATORS:
+                if command is None and assigned:
+                    return "sets shell variables", set(), set()
+                if command is not None:
+                    reason = _check_command(command, arguments, writes)
+                    if reason:
+                        return reason, set(), set()
+                expect_command, in_loop_header, assigned = True, False, False
+                command, arguments = None, []
+                continue
+            if in_loop_header:
+                words.add(token)
+                continue
+            if position > 0 and (tokens[position - 1] in REDIRECTS or tokens[position - 1] == ">&"):
+                if tokens[position - 1] != "<" and not token.startswith("/dev/") and not token.isdigit():
+                    writes.add(_normalize(token))
+                words.add(_normalize(token))
+                continue
+            if token in REDIRECTS or token == ">&":
+                continue
+            if expect_command:
+                if token in KEYWORDS:
+                    continue
+                if token in ("for", "select", "case"):
+                    in_loop_header = True  # the loop variable and list, up to the next separator
+                    continue
+                if re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", token):
+                    assigned = True  # prefixing a command, or on its own
+                    continue
+                command, expect_command = token, False
+                continue
+            arguments.append(token)
+            words.add(_normalize(token))
+    return None, writes, words
+
+
+def _check_command(command: str, arguments: List[str], writes: Set[str]) -> Optional[str]:
+    """Why command makes its block a barrier, or None; records the files it writes."""
+    name = command.rsplit("/", 1)[-1]
+    if name == "sudo":
+        if not arguments:
+            return "runs sudo"
+        return _check_command(arguments[0], arguments[1:], writes)
+    if name in READ_ONLY_SUBCOMMANDS:
+        subcommand = next((argument for argument in arguments if not argument.startswith("-")), None)
+        if subcommand in READ_ONLY_SUBCOMMANDS[name]:
+            return None
+        return f"runs {name} {subcommand or ''}".rstrip()
+    if name not in READ_ONLY_COMMANDS:
+        return f"runs {name}"
+    for flag in WRITING_FLAGS.get(name, ()):
+        if any(argument == flag or (len(flag) == 2 and argument.startswith(flag))
+               for argument in arguments):
+            return f"runs {name} {flag}".rstrip()
+    if name == "tee":
+        writes.update(_normalize(argument) for argument in arguments if not argument.startswith("-"))
+    return None
+
+
+def _normalize(word: str) -> str:
+    return word[2:] if word.startswith("./") else word
+
+
+def plan_blocks(codes: List[str]) -> List[BlockPlan]:
+    plans = []
+    analysed = []
+    for index, code in enumerate(codes):
+        reason, writes, words = _command_words(code)
+        plan = BlockPlan(index, code, barrier=reason is not None, reason=reason or "")
+        first_line = code.strip().split("\n", 1)[0]
+        annotation = ANNOTATION.match(first_line)
+        if annotation is not None:
+            plan.barrier = False  # the annotation says what it waits for
+            if annotation.group(2):
+                plan.depends_on = sorted({int(n) - 1 for n in annotation.group(2).split() if 0 < int(n) <= index})
+        else:
+            for earlier, (earlier_barrier, earlier_writes, earlier_words) in enumerate(analysed):
+                if plan.barrier or earlier_barrier or writes & earlier_words or earlier_writes & words:
+                    plan.depends_on.append(earlier)
+        analysed.append((plan.barrier, writes, words))
+        plans.append(plan)
+    return plans
+
+
+def format_block_outputs(outputs: Dict[int, str]) -> str:
+    """The outputs of a parallel run as one execution output, in block order."""
+    return "\n\n".join(f"[block {index + 1}]\n{outputs[index].strip()}" for index in sorted(outputs))
+
+
+async def run_blocks(plans: List[BlockPlan], shell: ShellSession, jobs: int = DEFAULT_JOBS,
+                     timeout: Optional[float] = None,
+                     on_finish: Optional[Callable[[BlockPlan, ExecutionResult, float], Awaitable[None]]] = None
+                     ) -> List[ExecutionResult]:
+    """
+    Run the blocks as planned; on_finish(plan, result, wall_seconds) is awaited as each
+    one ends. A block whose dependency failed still runs, as it would in one script.
+    """
+    slots = asyncio.Semaphore(jobs)
+    tasks: List[asyncio.Task] = []
+    environment: Optional[asyncio.Future] = None
+
+    async def run(plan: BlockPlan) -> ExecutionResult:
+        nonlocal environment
+        if plan.depends_on:
+            await asyncio.gather(*(tasks[i] for i in plan.depends_on), return_exceptions=True)
+        async with slots:
+            started = time.perf_counter()
+            if plan.barrier:
+                result = await shell.run(plan.code, timeout=timeout)
+                environment = None  # the barrier may have changed it
+            else:
+                if environment is None:
+                    environment = asyncio.ensure_future(shell.environment())
+                cwd, env = await environment
+                result = await execute_code(plan.code, timeout=timeout, cwd=cwd, env=env)
+            if on_finish is not None:
+                await on_finish(plan, result, time.perf_counter() - started)
+            return result
+
+    for plan in plans:
+        tasks.append(asyncio.ensure_future(run(plan)))
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
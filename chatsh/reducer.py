@@ -0,0 +1,117 @@
+"""
+Shrink command output before it enters the conversation context.
+
+Every output stays in the prompt for the rest of the session, so a noisy build log is paid
+for on every later turn. The reducer deduplicates repeated lines, collapses runs of lines
+that differ only in numbers, and keeps the head and tail of whatever still exceeds the
+token budget.
+"""
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+# Rough token estimate; good enough for budgeting without a tokenizer dependency
+CHARS_PER_TOKEN = 4
+
+_VARIABLE_PARTS = re.compile(r'0x[0-9a-fA-F]+|\d+')
+
+
+@dataclass
+class ReducerConfig:
+    max_tokens: int = 2000  # per output block
+    head_fraction: float = 0.5  # share of the budget kept from the start
+    dedupe: bool = True
+    collapse_similar: bool = True
+    min_similar_run: int = 4  # shortest run of similar lines worth collapsing
+    keep_last_turns: Optional[int] = None  # elide outputs older than this many turns
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _dedupe(lines: List[str]) -> Tuple[List[str], int]:
+    """Fold consecutive identical lines into one with a repeat count."""
+    result = []
+    removed = 0
+    i = 0
+    while i < len(lines):
+        j = i
+        while j + 1 < len(lines) and lines[j + 1] == lines[i]:
+            j += 1
+        count = j - i + 1
+        result.append(lines[i] if count == 1 else f"{lines[i]}  [repeated {count} times]")
+        removed += count - 1
+        i = j + 1
+    return result, removed
+
+
+def _collapse_similar(lines: List[str], min_run: int) -> Tuple[List[str], int]:
+    """Keep the first and last of a run of lines that match once numbers are masked."""
+    result = []
+    removed = 0
+    shapes = [_VARIABLE_PARTS.sub('#', line) for line in lines]
+    i = 0
+    while i < len(lines):
+        j = i
+        while j + 1 < len(lines) and shapes[j + 1] == shapes[i]:
+            j += 1
+        count = j - i + 1
+        if count >= min_run:
+            result.extend([lines[i], f"[... {count - 2} similar lines ...]", lines[j]])
+            removed += count - 2
+        else:
+            result.extend(lines[i:j + 1])
+        i = j + 1
+    return result, removed
+
+
+def _head_tail(lines: List[str], max_tokens: int, head_fraction: float) -> Tuple[List[str], int]:
+    """Keep whole lines from both ends until the budget is spent."""
+    budget = max_tokens * CHARS_PER_TOKEN
+    head_budget = int(budget * head_fraction)
+    # a single huge line (minified JSON, progress bars) would otherwise swallow the budget
+    limit = budget // 4
+    lines = [line if len(line) <= limit
+             else f"{line[:limit // 2]}[... {len(line) - limit} chars omitted ...]{line[-(limit // 2):]}"
+             for line in lines]
+    head, used = [], 0
+    for line in lines:
+        if used + len(line) + 1 > head_budget:
+            break
+        head.append(line)
+        used += len(line) + 1
+    tail = []
+    for line in reversed(lines[len(head):]):
+        if used + len(line) + 1 > budget:
+            break
+        tail.append(line)
+        used += len(line) + 1
+    tail.reverse()
+    omitted = len(lines) - len(head) - len(tail)
+    if not omitted:
+        return head + tail, 0
+    return head + [f"[... {omitted} lines omitted ...]"] + tail, omitted
+
+
+def reduce_output(text: str, config: ReducerConfig) -> Tuple[str, dict]:
+    """
+    Reduce one output block to fit config.
+
+    @return: the reduced text and a stats dict suitable for interaction log metadata.
+    """
+    lines = text.splitlines()
+    stats = {"original_tokens": estimate_tokens(text), "deduplicated_lines": 0,
+             "collapsed_lines": 0, "omitted_lines": 0}
+    if config.dedupe:
+        lines, stats["deduplicated_lines"] = _dedupe(lines)
+    if config.collapse_similar:
+        lines, stats["collapsed_lines"] = _collapse_similar(lines, config.min_similar_run)
+    reduced = "\n".join(lines)
+    if estimate_tokens(reduced) > config.max_tokens:
+        lines, stats["omitted_lines"] = _head_tail(lines, config.max_tokens, config.head_fraction)
+        reduced = "\n".join(lines)
+    if text.endswith("\n") and reduced:
+        reduced += "\n"
+    stats["reduced_tokens"] = estimate_tokens(reduced)
+    return reduced, stats
@@ -0,0 +1,162 @@
+"""
+Incremental Markdown rendering for streamed replies.
+
+Re-parsing the whole reply on every chunk makes long answers quadratic. Instead, blocks
+that can no longer change (paragraphs followed by a blank line, closed code fences) are
+printed once above the live area and forgotten; only the open tail is re-rendered.
+"""
+import re
+import time
+from itertools import chain
+from typing import Optional
+
+from rich.console import Console, Group
+from rich.live import Live
+from rich.markdown import Markdown
+from rich.segment import Segments
+from rich.text import Text
+
+# Refresh no faster than this, however cheap rendering is
+MIN_REFRESH_INTERVAL = 1 / 20
+# Refresh at least this often, however slow the terminal is
+MAX_REFRESH_INTERVAL = 1.0
+# Keep rendering to roughly 1/RENDER_BUDGET_FACTOR of wall time
+RENDER_BUDGET_FACTOR = 5
+
+# A line that may continue the block before a blank line: indented content or a list item
+_CONTINUATION = re.compile(r'[ \t]|[-*+][ \t]|\d{1,9}[.)][ \t]')
+
+
+def _fence_marker(line: str) -> Optional[str]:
+    stripped = line.lstrip(' ')
+    if len(line) - len(stripped) > 3:
+        return None
+    for char in '`~':
+        if stripped.startswith(char * 3):
+            return char * (len(stripped) - len(stripped.lstrip(char)))
+    return None
+
+
+class StreamingMarkdown:
+    """
+    Render a Markdown stream in O(n) total work.
+
+    Use as a context manager: feed() each chunk, and the rendered tail is shown in a
+    rich Live area whose refresh interval follows how long a render actually takes.
+    """
+
+    def __init__(self, console: Console):
+        self.console = console
+        self.live = Live(console=console, auto_refresh=False)
+        self.tail = ""
+        self.frozen_chars = 0
+        self.refresh_interval = MIN_REFRESH_INTERVAL
+        self.render_time = 0.0
+        self._scanned = 0  # offset in tail up to which complete lines were scanned
+        self._fence = None  # marker of the currently open code fence
+        self._fence_indented = False
+        self._candidate = None  # offset after a blank line, pending on what follows it
+        self._needs_separator = False
+        self._last_refresh = 0.0
+
+    def __enter__(self) -> 'StreamingMarkdown':
+        self.live.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.finish()
+        self.live.stop()
+
+    def feed(self, chunk: str) -> None:
+        self.tail += chunk
+        boundary = self._find_boundary()
+        if boundary:
+            self._freeze(boundary)
+        if time.perf_counter() - self._last_refresh >= self.refresh_interval:
+            self._refresh()
+
+    def finish(self) -> None:
+        self._refresh()
+
+    def _find_boundary(self) -> int:
+        """
+        Scan newly completed lines; return the end offset of the last finished block.
+
+        A blank line only ends a block once the next line shows it is not a continuation
+        (a loose list item or indented content), so lists are never split.
+        """
+        boundary = 0
+        while True:
+            newline = self.tail.find('\n', self._scanned)
+            if newline == -1:
+                return boundary
+            line = self.tail[self._scanned:newline]
+            line_start, self._scanned = self._scanned, newline + 1
+
+            marker = _fence_marker(line)
+            if self._fence is not None:
+                if marker and marker[0] == self._fence[0] and len(marker) >= len(self._fence) \
+                        and not line.strip()[len(marker):].strip():
+                    self._fence = None
+                    if not self._fence_indented:
+                        boundary = self._scanned
+                continue
+
+            if not line.strip():
+                if self._candidate is None:
+                    self._candidate = self._scanned
+                continue
+            if self._candidate is not None:
+                if not _CONTINUATION.match(line):
+                    boundary = line_start
+                self._candidate = None
+            if marker:
+                self._fence = marker
+                self._fence_indented = line[:1] == ' '
+
+    def _freeze(self, boundary: int) -> None:
+        block, self.tail = self.tail[:boundary], self.tail[boundary:]
+        self._scanned -= boundary
+        if self._candidate is not None:
+            self._candidate -= boundary
+        self.frozen_chars += boundary
+        if not block.strip():
+            return
+        started = time.perf_counter()
+        rendered = self._render_block(block)
+        if rendered is not None:
+            self.live.console.print(rendered)
+            self._needs_separator = True
+        self.render_time += time.perf_counter() - started
+
+    def _render_block(self, text: str):
+        """
+        Render text as Markdown, preceded by exactly one blank line if it follows a frozen block.
+
+        Some elements (lists) render their own leading blank line; after a frozen block it
+        is dropped so the spacing matches rendering the whole reply at once.
+        Returns None when nothing visible was rendered (e.g. only HTML).
+        """
+        lines = self.console.render_lines(Markdown(text), pad=False, new_lines=True)
+        if self._needs_separator:
+            while lines and not "".join(segment.text for segment in lines[0]).strip('\n'):
+                lines.pop(0)
+        if not lines:
+            return None
+        rendered = Segments(chain.from_iterable(lines))
+        if self._needs_separator:
+            return Group(Text(""), rendered)
+        return rendered
+
+    def _renderable(self):
+        rendered = self._render_block(self.tail) if self.tail.strip() else None
+        return Text("") if rendered is None else rendered
+
+    def _refresh(self) -> None:
+        started = time.perf_counter()
+        self.live.update(self._renderable(), refresh=True)
+        elapsed = time.perf_counter() - started
+        self.render_time += elapsed
+        self._last_refresh = time.perf_counter()
+        self.refresh_interval = min(MAX_REFRESH_INTERVAL,
+                                    max(MIN_REFRESH_INTERVAL, elapsed * RENDER_BUDGET_FACTOR))
@@ -0,0 +1,157 @@
+"""
+Content-addressed cache of model responses, replayed as a stream.
+
+The key is a hash of everything that determines a reply: vendor, model, system prompt,
+the conversation so far and the sampling parameters. Only deterministic requests
+(temperature 0) are stored. Entries live under $XDG_CACHE_HOME/chatsh/responses; a hit
+refreshes the entry's mtime, and the least recently used entries are evicted once the
+cache exceeds its size or entry budget.
+
+With replay_only, nothing goes to the network: a miss is an error. This re-runs scripted
+sessions instantly and lets tests run offline against recorded traffic.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from chatsh.chat import MODELS, Chat, UsageEvent, get_vendor_from_model
+from chatsh.system_info import cache_dir
+
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+MAX_CACHE_ENTRIES = 10_000
+# Bump when the key material or the entry format changes
+CACHE_FORMAT = 1
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache:
+    def __init__(self, directory: Optional[Path] = None,
+                 max_bytes: int = MAX_CACHE_BYTES, max_entries: int = MAX_CACHE_ENTRIES):
+        self.directory = directory or cache_dir() / "responses"
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(vendor: str, model: str, system, messages: List[dict], **params) -> str:
+        material = {"format": CACHE_FORMAT, "vendor": vendor, "model": model,
+                    "system": system, "messages": messages, "params": params}
+        return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text())
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(entry))
+            os.replace(tmp_path, path)
+            self.evict()
+        except OSError:
+            pass  # a read-only cache only costs us the network round trip
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits its budgets."""
+        entries = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes and count <= self.max_entries:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            count -= 1
+
+
+class CachedChat(Chat):
+    """
+    Wraps a Chat backend: a cached reply is replayed chunk by chunk without a request,
+    anything else is passed through and recorded.
+    """
+
+    def __init__(self, inner: Chat, cache: Optional[ResponseCache] = None, replay_only: bool = False):
+        # no super().__init__(): messages and usage are the inner backend's
+        self.inner = inner
+        self.cache = cache or ResponseCache()
+        self.replay_only = replay_only
+        self.hits = 0
+
+    @property
+    def messages(self):
+        return self.inner.messages
+
+    @messages.setter
+    def messages(self, value):
+        self.inner.messages = value
+
+    @property
+    def usage(self):
+        return self.inner.usage
+
+    def back(self, steps):
+        return self.inner.back(steps)
+
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False, history_cacheable=False):
+        full_model = MODELS.get(model, model)
+        # the prompt-cache flags and streaming change how a reply is fetched, not what it is
+        key = self.cache.key(get_vendor_from_model(model), full_model, system,
+                             self.inner.messages + [{"role": "user", "content": user_message}],
+                             temperature=temperature, max_tokens=max_tokens)
+        loop = asyncio.get_running_loop()
+        entry = await loop.run_in_executor(None, self.cache.get, key)
+
+        if entry is not None:
+            self.hits += 1
+            started = time.perf_counter()
+            for chunk in entry["chunks"]:
+                yield chunk
+            yield self.inner._finish_turn(user_message, "".join(entry["chunks"]), {
+                "input_tokens": 0, "output_tokens": 0,
+                "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0,
+                "time_to_first_token": round(time.perf_counter() - started, 3),
+                "warm_client": True, "replayed": True,
+            })
+            return
+
+        if self.replay_only:
+            raise CacheMiss(f"No cached response for this turn (key {key[:12]}) and --replay allows no requests")
+
+        chunks = []
+        usage = None
+        async for chunk in self.inner.ask(user_message, system, model, temperature=temperature,
+                                          max_tokens=max_tokens, stream=stream,
+                                          system_cacheable=system_cacheable,
+                                          history_cacheable=history_cacheable):
+            if isinstance(chunk, UsageEvent):
+                usage = chunk.usage
+            else:
+                chunks.append(chunk)
+            yield chunk
+
+        if temperature == 0:
+            entry = {"model": full_model, "created": time.time(), "chunks": chunks, "usage": usage}
+            await loop.run_in_executor(None, self.cache.put, key, entry)
@@ -0,0 +1,89 @@
+"""
+Resume a session from its interaction log.
+
+The log is replayed locally: user turns, replies, execution outputs, failed turns and
+back commands rebuild the ConversationHistory, and the chat backend's messages are
+derived from that history exactly as they were sent, so the next request shares the
+cached prompt prefix. Nothing is sent until the user's next turn.
+"""
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from chatsh.blob_store import BlobStore
+from chatsh.conversation import SKIPPED_OUTPUT, ConversationHistory
+from chatsh.interaction_log import Interaction, InteractionType, default_log_dir, log_files
+from chatsh.parallel import format_block_outputs
+
+# metadata flag on the system message that holds the system prompt
+SYSTEM_PROMPT_KEY = "system_prompt"
+# metadata flag on the system message recording a `pin` command
+PINNED_KEY = "pinned"
+
+
+def find_log(spec: str, log_dir: Optional[Path] = None) -> Path:
+    """A log file given by path, or "latest" for the most recently written one."""
+    if spec != "latest":
+        path = Path(spec).expanduser()
+        if not path.is_file():
+            raise FileNotFoundError(f"No interaction log at {path}")
+        return path
+    files = log_files(log_dir or default_log_dir())
+    if not files:
+        raise FileNotFoundError(f"No interaction logs in {log_dir or default_log_dir()}")
+    return max(files, key=lambda path: path.stat().st_mtime)
+
+
+def _is_system_prompt(interaction: Interaction) -> bool:
+    if interaction.metadata.get(SYSTEM_PROMPT_KEY):
+        return True
+    # logs written before the flag existed: everything but the startup notice
+    return not interaction.metadata and not interaction.content.startswith("ChatSH ")
+
+
+def replay(interactions: Iterable[Interaction],
+           blobs: Optional[BlobStore] = None) -> Tuple[ConversationHistory, Optional[str]]:
+    """
+    Rebuild the conversation from logged interactions, in the order they were recorded.
+    blobs is given to the rebuilt history.
+
+    @return: the history and the system prompt the session used (None if none was logged).
+    """
+    history = ConversationHistory(blobs)
+    system_prompt = None
+    block_outputs = {}  # outputs of the latest reply's blocks, in a parallel run
+    for interaction in interactions:
+        kind = interaction.type
+        if kind == InteractionType.SYSTEM_MESSAGE:
+            if interaction.metadata.get(PINNED_KEY):
+                history.pin_last_turn()
+            elif "compacted_turns" in interaction.metadata:
+                history.compact(interaction.metadata["compacted_turns"], interaction.metadata["summary"])
+            elif _is_system_prompt(interaction):
+                system_prompt = interaction.content
+        elif kind == InteractionType.USER_MESSAGE:
+            history.add_entry('user', interaction.content)
+        elif kind == InteractionType.LLM_RESPONSE:
+            # in fan-out sessions, answers that were not picked are sibling branches
+            if interaction.metadata.get("chosen", True):
+                history.add_entry('assistant', interaction.content)
+                block_outputs = {}
+        elif kind == InteractionType.CODE_EXECUTION_OUTPUT:
+            if history.entries and history.entries[-1].role == 'assistant':
+                if "block" in interaction.metadata:
+                    block_outputs[interaction.metadata["block"]] = interaction.content
+                    history.entries[-1].execution_output = format_block_outputs(block_outputs)
+                else:
+                    history.entries[-1].execution_output = interaction.content
+        elif kind == InteractionType.CODE_EXECUTION_DECISION:
+            if not interaction.metadata.get("executed") and history.entries \
+                    and history.entries[-1].role == 'assistant':
+                history.entries[-1].execution_output = SKIPPED_OUTPUT
+        elif kind == InteractionType.ERROR:
+            # the turn failed, and the live session dropped it
+            history.pop_unanswered()
+        elif kind == InteractionType.BACK_COMMAND:
+            if history.entries and history.entries[-1].role == 'assistant':
+                history.back(interaction.metadata.get("steps", 1))
+    # a session that died mid-turn leaves a question without an answer
+    history.pop_unanswered()
+    return history, system_prompt
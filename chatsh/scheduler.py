@@ -0,0 +1,302 @@
+"""
+Pace, retry and fail over requests to the chat backends.
+
+ScheduledChat wraps the vendor backends. Every request first takes a request and its
+estimated input tokens from the model's token buckets (the vendors limit each model
+separately). The bucket is sized from the
+rate-limit headers of the previous response, so a busy key (such as the shared loaner
+token) is paced instead of hammered. A 429, 529, 5xx or dropped connection is retried
+with full-jitter exponential backoff, and never sooner than the server's retry-after.
+
+If the stream broke after some text was already shown, the retry continues from that
+text rather than starting over. Anthropic gets the text as an assistant prefill. Other
+vendors are asked again, and their new reply is checked to start with what was shown.
+With fallbacks, a model that keeps failing, or that asks us to wait too long, is replaced
+by the next one for the rest of the turn. The messages are vendor-neutral, so any model
+can pick up the conversation.
+"""
+import asyncio
+import random
+import re
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+from chatsh.chat import MODELS, Chat, UsageEvent, chat
+from chatsh.reducer import estimate_tokens
+
+MAX_RETRIES = 4
+BASE_DELAY = 1.0
+MAX_DELAY = 30.0
+# A retry-after longer than this moves on to the next fallback model instead of waiting
+FAILOVER_AFTER = 10.0
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+# Error classes (matched by name, so no vendor SDK has to be imported) for dropped connections
+CONNECTION_ERRORS = {"APIConnectionError", "APITimeoutError", "RemoteProtocolError", "ReadError",
+                     "ReadTimeout", "ConnectError", "ServerDisconnectedError", "IncompleteRead"}
+# Error types reported in the body of a streamed error event
+RETRY_ERROR_TYPES = {"overloaded_error", "rate_limit_error", "api_error"}
+
+
+class StreamResumeError(RuntimeError):
+    """The stream broke, and the retry's reply did not continue the text already shown."""
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, rate: float, tokens: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """rate: tokens added per second, up to capacity."""
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity if tokens is None else tokens
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until amount can be taken (amount is capped at the capacity)."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else MAX_DELAY
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+def _seconds_until(reset: str, now: datetime) -> Optional[float]:
+    """A reset header: an RFC 3339 time (Anthropic) or a duration such as 6m0s or 20ms (OpenAI)."""
+    if re.fullmatch(r"(\d+(\.\d+)?(ms|s|m|h))+", reset):
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(number) * units[unit] for number, _, unit in re.findall(r"(\d+(\.\d+)?)(ms|s|m|h)", reset))
+    try:
+        return (datetime.fromisoformat(reset.replace("Z", "+00:00")) - now).total_seconds()
+    except ValueError:
+        return None
+
+
+def parse_rate_limits(headers: Mapping[str, str], now: Optional[datetime] = None) -> Dict[str, Tuple[float, float, float]]:
+    """
+    The request and input-token limits in a response's headers.
+
+    @return: kind ("requests" or "input_tokens") -> (limit, remaining, seconds until reset).
+    """
+    headers = {name.lower(): value for name, value in headers.items()}
+    now = now or datetime.now(timezone.utc)
+    names = {
+        "requests": ["anthropic-ratelimit-requests-{}", "x-ratelimit-{}-requests"],
+        "input_tokens": ["anthropic-ratelimit-input-tokens-{}", "anthropic-ratelimit-tokens-{}",
+                         "x-ratelimit-{}-tokens"],
+    }
+    limits = {}
+    for kind, patterns in names.items():
+        for pattern in patterns:
+            try:
+                limit = float(headers[pattern.format("limit")])
+                remaining = float(headers[pattern.format("remaining")])
+            except (KeyError, ValueError):
+                continue
+            reset = _seconds_until(headers.get(pattern.format("reset"), ""), now)
+            limits[kind] = (limit, remaining, max(reset or 0.0, 0.0))
+            break
+    return limits
+
+
+class RateLimiter:
+    """Per-model token buckets for requests and input tokens, shared by every backend."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, sleep=asyncio.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self.paused_until: Dict[str, float] = {}
+
+    def update(self, model: str, headers: Optional[Mapping[str, str]]) -> None:
+        if not headers:
+            return
+        for kind, (limit, remaining, reset) in parse_rate_limits(headers).items():
+            if limit <= 0:
+                continue
+            # the vendors refill continuously; limits are per minute
+            rate = (limit - remaining) / reset if remaining < limit and reset > 0 else limit / 60
+            bucket = self.buckets.get((model, kind))
+            if bucket is None:
+                self.buckets[(model, kind)] = TokenBucket(limit, rate, remaining, clock=self.clock)
+            else:
+                bucket.capacity, bucket.rate, bucket.tokens, bucket.updated = limit, rate, remaining, self.clock()
+
+    def pause(self, model: str, seconds: float) -> None:
+        """Hold every request to model for seconds (a retry-after)."""
+        self.paused_until[model] = max(self.paused_until.get(model, 0.0), self.clock() + seconds)
+
+    async def acquire(self, model: str, input_tokens: int = 0) -> float:
+        """Wait until model's buckets allow one more request of input_tokens; returns the seconds waited."""
+        waited = 0.0
+        while True:
+            costs = [(self.buckets.get((model, "requests")), 1),
+                     (self.buckets.get((model, "input_tokens")), input_tokens)]
+            delay = max([self.paused_until.get(model, 0.0) - self.clock()]
+                        + [bucket.delay(cost) for bucket, cost in costs if bucket is not None])
+            if delay <= 0:
+                for bucket, cost in costs:
+                    if bucket is not None:
+                        bucket.take(cost)
+                return waited
+            await self.sleep(delay)
+            waited += delay
+
+
+def status_of(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def error_headers(error: BaseException) -> Optional[Mapping[str, str]]:
+    return getattr(getattr(error, "response", None), "headers", None)
+
+
+def is_retryable(error: BaseException) -> bool:
+    if status_of(error) in RETRY_STATUS:
+        return True
+    if any(cls.__name__ in CONNECTION_ERRORS for cls in type(error).__mro__):
+        return True
+    if isinstance(error, (ConnectionError, asyncio.TimeoutError)):
+        return True
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        detail = body.get("error", body)
+        return isinstance(detail, dict) and detail.get("type") in RETRY_ERROR_TYPES
+    return False
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    headers = error_headers(error)
+    if not headers:
+        return None
+    headers = {name.lower(): value for name, value in headers.items()}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass  # an HTTP date; fall back to our own backoff
+    return None
+
+
+def backoff(attempt: int, base: float = BASE_DELAY, cap: float = MAX_DELAY) -> float:
+    """Full jitter: uniform between 0 and the exponential delay for this attempt."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class ScheduledChat(Chat):
+    def __init__(self, fallbacks: Optional[List[str]] = None, limiter: Optional[RateLimiter] = None,
+                 make_backend: Callable[[str], Chat] = chat, max_retries: int = MAX_RETRIES,
+                 on_retry: Optional[Callable[[str], None]] = None, sleep=asyncio.sleep):
+        """on_retry(notice) is told about every retry and failover, e.g. to print it."""
+        super().__init__()
+        self.fallbacks = fallbacks or []
+        self.limiter = limiter or RateLimiter()
+        self.make_backend = make_backend
+        self.max_retries = max_retries
+        self.on_retry = on_retry or (lambda notice: None)
+        self.sleep = sleep
+        self.backends: Dict[str, Chat] = {}
+
+    def _backend(self, model: str) -> Chat:
+        if model not in self.backends:
+            self.backends[model] = self.make_backend(model)
+        return self.backends[model]
+
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False, history_cacheable=False):
+        chain = [model] + [fallback for fallback in self.fallbacks if fallback != model]
+        estimate = estimate_tokens(system) + estimate_tokens(user_message) \
+            + sum(estimate_tokens(message["content"]) for message in self.messages)
+        shown = ""  # text already yielded this turn
+        link, attempt, retries = 0, 0, 0
+        while True:
+            current = chain[link]
+            backend = self._backend(current)
+            backend.messages = list(self.messages)
+            limited = MODELS.get(current, current)
+            await self.limiter.acquire(limited, estimate)
+
+            shown_before = shown if shown.strip() else ""  # whitespace is not worth continuing from
+            prefill = shown_before if shown_before and getattr(backend, "supports_prefill", False) else ""
+            kwargs = {"temperature": temperature, "max_tokens": max_tokens, "stream": stream,
+                      "system_cacheable": system_cacheable, "history_cacheable": history_cacheable}
+            if prefill:
+                kwargs["prefill"] = prefill
+            # a prefill loses its trailing whitespace, which the continuation may repeat
+            skip_whitespace = prefill[len(prefill.rstrip()):]
+            received = ""
+            usage = None
+            try:
+                replies = backend.ask(user_message, system, current, **kwargs)
+                try:
+                    async for chunk in replies:
+                        if isinstance(chunk, UsageEvent):
+                            usage = chunk.usage
+                            continue
+                        if prefill:
+                            while skip_whitespace and chunk and chunk[0] == skip_whitespace[0]:
+                                chunk, skip_whitespace = chunk[1:], skip_whitespace[1:]
+                            if chunk:
+                                skip_whitespace = ""
+                        elif shown_before and len(received) < len(shown_before):
+                            # a restarted reply: hold it back until it has passed what was shown
+                            received += chunk
+                            if not (shown_before.startswith(received) or received.startswith(shown_before)):
+                                raise StreamResumeError(
+                                    f"The reply from {current} was cut off, and the retry answered differently; ask again.")
+                            if len(received) < len(shown_before):
+                                continue
+                            chunk = received[len(shown_before):]
+                        if chunk:
+                            shown += chunk
+                            yield chunk
+                finally:
+                    await replies.aclose()
+                if shown_before and not prefill and len(received) < len(shown_before):
+                    raise StreamResumeError(f"The retry of {current} ended before the text already shown; ask again.")
+            except StreamResumeError:
+                raise
+            except Exception as error:
+                self.limiter.update(limited, error_headers(error))
+                if not is_retryable(error):
+                    raise
+                attempt += 1
+                retries += 1
+                wait = retry_after(error)
+                if wait:
+                    self.limiter.pause(limited, wait)
+                give_up = attempt > self.max_retries or (wait is not None and wait > FAILOVER_AFTER)
+                if give_up and link + 1 < len(chain):
+                    link, attempt = link + 1, 0
+                    self.on_retry(f"{current} failed ({error}); switching to {chain[link]}")
+                    continue
+                if attempt > self.max_retries:
+                    raise
+                delay = max(backoff(attempt), wait or 0.0)
+                self.on_retry(f"{current} failed ({error}); retry {attempt} of {self.max_retries} in {delay:.1f}s")
+                await self.sleep(delay)
+                continue
+
+            self.limiter.update(limited, getattr(backend, "response_headers", None))
+            usage = dict(usage or {})
+            if current != model:
+                usage["model"] = current
+            if retries:
+                usage["retries"] = retries
+            if shown_before:
+                usage["resumed"] = True
+            yield self._finish_turn(user_message, shown, usage)
+            return
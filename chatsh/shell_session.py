@@ -0,0 +1,161 @@
+"""
+A long-lived shell that commands are sent to, so state carries over between turns.
+
+`cd`, exported variables, activated virtualenvs and shell functions persist, and no turn
+pays for starting a shell. Each command is written to a script that the shell sources;
+a per-command sentinel printed on stdout and stderr marks completion and carries the
+exit status. If the shell dies (e.g. the command ran `exit`), it is restarted on the
+next command.
+"""
+import asyncio
+import codecs
+import os
+import shutil
+import signal
+import tempfile
+import uuid
+from typing import Callable, Optional, Tuple
+
+from chatsh.execution import (ExecutionResult, OutputWindow, READ_SIZE, lend_terminal, new_process_group, terminate,
+                              wait_interruptible)
+
+
+class ShellSession:
+    def __init__(self, shell: Optional[str] = None):
+        # bash survives syntax errors in sourced scripts; plain sh would exit and restart
+        self.shell = shell or shutil.which("bash") or "/bin/sh"
+        self.proc = None
+        self.restarts = 0
+        self._script_dir = tempfile.mkdtemp(prefix="chatsh-shell-")
+        self._script_path = os.path.join(self._script_dir, "command.sh")
+        self._lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self) -> None:
+        if self.proc is not None:
+            self.restarts += 1
+        self.proc = await asyncio.create_subprocess_exec(
+            self.shell,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=new_process_group
+        )
+
+    async def close(self) -> None:
+        if self.alive:
+            self.proc.stdin.close()
+            await terminate(self.proc)
+        shutil.rmtree(self._script_dir, ignore_errors=True)
+
+    async def environment(self) -> Tuple[Optional[str], Optional[dict]]:
+        """
+        The session's working directory and exported variables, for commands that run
+        beside it in processes of their own. Either is None if it could not be read.
+        """
+        cwd_path = os.path.join(self._script_dir, "cwd")
+        env_path = os.path.join(self._script_dir, "env")
+        await self.run(f"pwd > {cwd_path}; env -0 > {env_path} 2>/dev/null")
+        try:
+            with open(cwd_path) as f:
+                cwd = f.read().rstrip("\n") or None
+            with open(env_path, "rb") as f:
+                pairs = [item.decode(errors="replace").partition("=") for item in f.read().split(b"\0") if item]
+        except OSError:
+            return None, None
+        env = {name: value for name, _, value in pairs} if pairs else None
+        return cwd, env
+
+    async def run(self, code: str,
+                  on_output: Optional[Callable[[str, str], None]] = None,
+                  timeout: Optional[float] = None) -> ExecutionResult:
+        """Run code in the session; same contract as execution.execute_code."""
+        async with self._lock:
+            result = ExecutionResult()
+            try:
+                if not self.alive:
+                    await self.start()
+            except Exception as error:
+                result.error = str(error)
+                return result
+
+            with open(self._script_path, "w") as f:
+                f.write(code + "\n")
+            marker = f"__CHATSH_DONE_{uuid.uuid4().hex}__"
+            status = {}
+            pumps = asyncio.gather(
+                _pump_until(self.proc.stdout, marker.encode(), result.stdout, on_output, status),
+                _pump_until(self.proc.stderr, marker.encode(), result.stderr, on_output, {}))
+            # the shell has the terminal before the command is sent, so it never runs in the background
+            with lend_terminal(self.proc.pid):
+                try:
+                    self.proc.stdin.write(
+                        f". {self._script_path} < /dev/null\n"
+                        f"printf '\\n%s %d\\n' {marker} $?\n"
+                        f"printf '\\n%s\\n' {marker} >&2\n".encode())
+                    await self.proc.stdin.drain()
+                except (ConnectionResetError, BrokenPipeError):
+                    pass  # the shell is already gone; the pumps will see EOF
+
+                try:
+                    outcome = await wait_interruptible(pumps, timeout)
+                except asyncio.CancelledError:
+                    await terminate(self.proc)
+                    raise
+            if outcome != "done":
+                # The command shares the shell's process group, so stopping it costs the
+                # shell; the next command gets a fresh one.
+                result.cancelled = outcome == "cancelled"
+                result.timed_out = outcome == "timeout"
+                await terminate(self.proc)
+                pumps.cancel()
+            await asyncio.gather(pumps, return_exceptions=True)
+
+            if "exit_code" in status:
+                result.exit_code = status["exit_code"]
+            else:
+                # no sentinel: the shell itself exited, e.g. on a Ctrl-C sent to the command
+                result.exit_code = await self.proc.wait()
+                result.cancelled = result.cancelled or result.exit_code == -signal.SIGINT
+            return result
+
+
+async def _pump_until(stream, marker: bytes, window: OutputWindow, on_output, status: dict) -> None:
+    """Copy stream into window until the sentinel line; record the status printed after it."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    sentinel = b"\n" + marker
+    pending = b""
+
+    def emit(data: bytes) -> None:
+        if data:
+            window.write(data)
+            if on_output is not None:
+                on_output(window.name, decoder.decode(data))
+
+    while True:
+        data = await stream.read(READ_SIZE)
+        if not data:
+            emit(pending)
+            break
+        pending += data
+        index = pending.find(sentinel)
+        if index != -1:
+            emit(pending[:index])
+            rest = pending[index + len(sentinel):]
+            while b"\n" not in rest:
+                more = await stream.read(READ_SIZE)
+                if not more:
+                    break
+                rest += more
+            code = rest.split(b"\n", 1)[0].strip()
+            if code:
+                status["exit_code"] = int(code)
+            break
+        # hold back enough bytes to catch a sentinel split across reads
+        keep = len(sentinel) - 1
+        emit(pending[:-keep] if len(pending) > keep else b"")
+        pending = pending[-keep:] if len(pending) > keep else pending
+    window.close()
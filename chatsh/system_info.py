@@ -0,0 +1,219 @@
+"""
+System description appended to the system prompt, cached on disk between sessions.
+
+The description sits right after the static system prompt, inside the cached prefix, so it
+must be byte-for-byte identical from one session to the next. It is computed once per
+environment fingerprint (PATH and its directories, SHELL, kernel version, tool catalogue)
+and stored under $XDG_CACHE_HOME/chatsh.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+COMMAND_DESCRIPTIONS = {
+    "ag": "code-searching tool similar to ack",
+    "bat": "cat with syntax highlighting",
+    "btop": "interactive resource monitor",
+    "cargo": "Rust package manager and build tool",
+    "clang": "C/C++ compiler",
+    "cmake": "cross-platform build system generator",
+    "curl": "transfer data from or to a server",
+    "delta": "syntax-highlighting pager for git diffs",
+    "docker": "container runtime",
+    "dust": "intuitive disk usage viewer",
+    "entr": "run commands when files change",
+    "eza": "modern replacement for ls",
+    "fd": "faster alternative to find",
+    "fzf": "command-line fuzzy finder",
+    "gcc": "GNU C compiler",
+    "gh": "GitHub command-line client",
+    "git": "version control system",
+    "go": "Go toolchain",
+    "htop": "interactive process viewer",
+    "http": "HTTPie, user-friendly HTTP client",
+    "hyperfine": "command-line benchmarking tool",
+    "java": "Java runtime",
+    "jq": "command-line JSON processor",
+    "kubectl": "Kubernetes command-line client",
+    "make": "build automation tool",
+    "ncdu": "disk usage analyzer",
+    "nix": "Nix package manager",
+    "node": "JavaScript runtime",
+    "npm": "Node.js package manager",
+    "parallel": "GNU parallel, run jobs in parallel",
+    "podman": "daemonless container engine",
+    "poetry": "Python dependency manager",
+    "python3": "Python 3 interpreter",
+    "rg": "faster replacement for grep",
+    "rsync": "fast incremental file transfer",
+    "rustc": "Rust compiler",
+    "sd": "intuitive find and replace",
+    "shellcheck": "static analysis for shell scripts",
+    "sqlite3": "SQLite command-line shell",
+    "tldr": "simplified man pages",
+    "tmux": "terminal multiplexer",
+    "tokei": "count lines of code",
+    "tree": "list directories as a tree",
+    "uv": "fast Python package and project manager",
+    "wget": "non-interactive network downloader",
+    "xh": "fast HTTP client similar to HTTPie",
+    "yq": "command-line YAML processor",
+    "zoxide": "smarter cd that learns frequent directories",
+}
+
+# Bump when the description format changes, so stale cache entries are not reused
+CACHE_VERSION = 1
+# One entry per environment (e.g. terminals with different PATHs); the oldest are pruned
+MAX_CACHE_ENTRIES = 32
+
+
+def _xdg_dir(variable: str, default: Path) -> Path:
+    value = os.environ.get(variable)
+    return Path(value) if value else default
+
+
+def cache_dir() -> Path:
+    return _xdg_dir('XDG_CACHE_HOME', Path.home() / '.cache') / 'chatsh'
+
+
+def load_catalogue() -> Dict[str, str]:
+    """
+    The built-in tool catalogue, extended or overridden by $XDG_CONFIG_HOME/chatsh/tools.json
+    (an object of tool name to description).
+    """
+    catalogue = dict(COMMAND_DESCRIPTIONS)
+    config_file = _xdg_dir('XDG_CONFIG_HOME', Path.home() / '.config') / 'chatsh' / 'tools.json'
+    try:
+        catalogue.update(json.loads(config_file.read_text()))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as error:
+        print(f"Ignoring tool catalogue {config_file}: {error}", file=sys.stderr)
+    return catalogue
+
+
+def _path_dirs() -> List[str]:
+    seen = []
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        if directory and directory not in seen:
+            seen.append(directory)
+    return seen
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def environment_fingerprint(catalogue: Dict[str, str]) -> str:
+    """
+    Hash of everything the description depends on. Directory and shell mtimes catch tools
+    being installed or the shell being upgraded without PATH or SHELL changing.
+    """
+    shell = os.environ.get('SHELL', '')
+    uname = os.uname()
+    parts = {
+        "version": CACHE_VERSION,
+        "path": [(directory, _mtime(directory)) for directory in _path_dirs()],
+        "shell": [shell, _mtime(shell) if shell else None],
+        "kernel": [uname.sysname, uname.release, uname.version],
+        "catalogue": sorted(catalogue.items()),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def _executables(directory: str, wanted: frozenset) -> List[str]:
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return [name for name in names
+            if name in wanted and os.access(os.path.join(directory, name), os.X_OK)]
+
+
+def get_available_commands(catalogue: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    Catalogue entries found on PATH, sorted by name.
+
+    Lists each PATH directory once, in parallel, instead of probing every tool in every
+    directory.
+    """
+    catalogue = load_catalogue() if catalogue is None else catalogue
+    wanted = frozenset(catalogue)
+    directories = _path_dirs()
+    found = set()
+    if directories:
+        with ThreadPoolExecutor(max_workers=min(16, len(directories))) as pool:
+            for names in pool.map(lambda directory: _executables(directory, wanted), directories):
+                found.update(names)
+    return [f"{cmd}: {catalogue[cmd]}" for cmd in sorted(found)]
+
+
+async def get_shell_info() -> str:
+    shell_version = ""
+    shell = os.environ.get('SHELL')
+    if shell:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                shell, '--version',
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            stdout, _ = await proc.communicate()
+            shell_version = stdout.decode(errors='replace').strip().split('\n')[0]
+        except OSError:
+            pass
+    return "\n".join(line for line in [os.uname().version, shell_version] if line)
+
+
+def format_system_description(shell_info: str, available_commands: List[str]) -> str:
+    commands = "\n".join(available_commands)
+    return f"""
+- system information:
+{shell_info}
+
+Available commands:
+{commands}
+"""
+
+
+async def compute_system_description(catalogue: Dict[str, str]) -> str:
+    loop = asyncio.get_running_loop()
+    shell_info, available_commands = await asyncio.gather(
+        get_shell_info(),
+        loop.run_in_executor(None, get_available_commands, catalogue)
+    )
+    return format_system_description(shell_info, available_commands)
+
+
+async def generate_system_description(refresh: bool = False) -> str:
+    """The system description, from the on-disk cache when the environment is unchanged."""
+    catalogue = load_catalogue()
+    cache_file = cache_dir() / f"system_description_{environment_fingerprint(catalogue)}.txt"
+    if not refresh:
+        try:
+            return cache_file.read_text()
+        except OSError:
+            pass
+
+    description = await compute_system_description(catalogue)
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(description)
+        os.replace(tmp_file, cache_file)
+        entries = sorted(cache_file.parent.glob("system_description_*.txt"),
+                         key=lambda path: path.stat().st_mtime, reverse=True)
+        for stale in entries[MAX_CACHE_ENTRIES:]:
+            stale.unlink()
+    except OSError:
+        pass  # a read-only cache only costs us the recomputation
+    return description
@@ -0,0 +1,160 @@
+"""
+Per-turn latency and token metrics, and their aggregation across sessions.
+
+Each llm_response record carries a "telemetry" dict in its metadata. It holds time to
+first token, streaming time, tokens per second, token counts, render time and the time
+spent writing the log. Each code_execution_output record carries the command's
+wall_seconds. `chatsh stats` reads every log and reports percentiles per model, which
+tells whether a slow turn was the vendor, the renderer or the shell. It can also print
+them in the OpenMetrics text format.
+
+    chatsh stats [--openmetrics] [FILE ...]
+"""
+import argparse
+import asyncio
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from chatsh.interaction_log import InteractionType, default_log_dir, iter_interactions, log_files
+
+PERCENTILES = [50, 90, 99]
+
+# metric name -> (help text, unit); the units are the OpenMetrics ones
+METRICS = {
+    "time_to_first_token": ("Time from sending a turn to its first text delta", "seconds"),
+    "stream_seconds": ("Time from the first to the last text delta", "seconds"),
+    "tokens_per_second": ("Output tokens per second of streaming", ""),
+    "input_tokens": ("Prompt tokens, cached or not", ""),
+    "output_tokens": ("Reply tokens", ""),
+    "cached_tokens": ("Prompt tokens read from the prompt cache", ""),
+    "render_seconds": ("Time spent rendering the reply", "seconds"),
+    "log_write_seconds": ("Time the turn waited on the interaction log, up to recording the reply", "seconds"),
+    "command_seconds": ("Wall time of executed commands", "seconds"),
+}
+
+
+def turn_metrics(usage: Optional[dict], model: str, started: float, first_token_at: Optional[float],
+                 finished: float, render_seconds: float) -> dict:
+    """Metrics for one streamed reply; times are time.perf_counter() values."""
+    usage = usage or {}
+    metrics = {
+        "model": model,
+        "time_to_first_token": round((first_token_at or finished) - started, 4),
+        "stream_seconds": round(finished - (first_token_at or finished), 4),
+        "render_seconds": round(render_seconds, 4),
+    }
+    if usage:
+        output_tokens = usage.get("output_tokens", 0)
+        metrics.update(
+            input_tokens=usage.get("input_tokens", 0) + usage.get("cache_creation_input_tokens", 0)
+            + usage.get("cache_read_input_tokens", 0),
+            output_tokens=output_tokens,
+            cached_tokens=usage.get("cache_read_input_tokens", 0),
+        )
+        if metrics["stream_seconds"] > 0 and output_tokens:
+            metrics["tokens_per_second"] = round(output_tokens / metrics["stream_seconds"], 1)
+    return metrics
+
+
+def format_turn_metrics(metrics: dict) -> str:
+    parts = [f"first token {metrics['time_to_first_token']:.2f}s",
+             f"stream {metrics['stream_seconds']:.2f}s"]
+    if "tokens_per_second" in metrics:
+        parts.append(f"{metrics['tokens_per_second']:.0f} tok/s")
+    parts.append(f"render {metrics['render_seconds']:.3f}s")
+    if "log_write_seconds" in metrics:
+        parts.append(f"log {metrics['log_write_seconds'] * 1000:.1f}ms")
+    return ", ".join(parts)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linearly interpolated percentile of values, 0 <= q <= 100."""
+    ordered = sorted(values)
+    if not ordered:
+        raise ValueError("percentile of no values")
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+async def collect(files: Iterable[Path]) -> Dict[str, Dict[str, List[float]]]:
+    """model -> metric -> samples, over every turn in files."""
+    samples: Dict[str, Dict[str, List[float]]] = {}
+    for file in files:
+        # command outputs hang off a prompt, which hangs off the reply that has the model
+        model_of: Dict[Optional[int], str] = {}
+        try:
+            async for interaction in iter_interactions(file):
+                metadata = interaction.metadata
+                if interaction.type == InteractionType.LLM_RESPONSE and "telemetry" in metadata:
+                    telemetry = metadata["telemetry"]
+                    model_of[interaction.interaction_id] = telemetry.get("model", "unknown")
+                    by_metric = samples.setdefault(telemetry.get("model", "unknown"), {})
+                    for name in METRICS:
+                        if isinstance(telemetry.get(name), (int, float)):
+                            by_metric.setdefault(name, []).append(telemetry[name])
+                elif interaction.type == InteractionType.CODE_EXECUTION_PROMPT:
+                    if interaction.parent_id in model_of:
+                        model_of[interaction.interaction_id] = model_of[interaction.parent_id]
+                elif interaction.type == InteractionType.CODE_EXECUTION_OUTPUT and "wall_seconds" in metadata:
+                    model = model_of.get(interaction.parent_id, "unknown")
+                    samples.setdefault(model, {}).setdefault("command_seconds", []).append(metadata["wall_seconds"])
+        except (OSError, ValueError, KeyError) as error:
+            print(f"Skipping {file}: {error}")
+    return samples
+
+
+def format_stats(samples: Dict[str, Dict[str, List[float]]]) -> str:
+    if not samples:
+        return "No turns with telemetry found."
+    lines = []
+    header = f"  {'metric':<22}{'count':>7}" + "".join(f"{'p' + str(q):>10}" for q in PERCENTILES)
+    for model in sorted(samples):
+        lines.append(model)
+        lines.append(header)
+        for name in METRICS:
+            values = samples[model].get(name)
+            if values:
+                lines.append(f"  {name:<22}{len(values):>7}"
+                             + "".join(f"{percentile(values, q):>10.3f}" for q in PERCENTILES))
+    return "\n".join(lines)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def openmetrics(samples: Dict[str, Dict[str, List[float]]]) -> str:
+    """The aggregated samples as OpenMetrics summaries, one per metric, labelled by model."""
+    lines = []
+    for name, (help_text, unit) in METRICS.items():
+        family = f"chatsh_{name}" if not unit or name.endswith(unit) else f"chatsh_{name}_{unit}"
+        series = [(model, by_metric[name]) for model, by_metric in sorted(samples.items()) if by_metric.get(name)]
+        if not series:
+            continue
+        lines.append(f"# TYPE {family} summary")
+        if unit:
+            lines.append(f"# UNIT {family} {unit}")
+        lines.append(f"# HELP {family} {help_text}.")
+        for model, values in series:
+            label = f'model="{_escape(model)}"'
+            for q in PERCENTILES:
+                lines.append(f'{family}{{{label},quantile="{q / 100}"}} {percentile(values, q):.6g}')
+            lines.append(f"{family}_count{{{label}}} {len(values)}")
+            lines.append(f"{family}_sum{{{label}}} {sum(values):.6g}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="chatsh stats", description="Latency and token percentiles per model.")
+    parser.add_argument("files", nargs="*", type=Path, help="interaction logs (default: all of them)")
+    parser.add_argument("--openmetrics", action="store_true", help="print in the OpenMetrics text format")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    samples = asyncio.run(collect(args.files or log_files(default_log_dir())))
+    print(openmetrics(samples) if args.openmetrics else format_stats(samples), end="\n" if not args.openmetrics else "")
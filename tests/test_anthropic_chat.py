@@ -1,6 +1,6 @@
 import pytest
 from unittest.mock import patch, mock_open
-from chatsh.chat import AnthropicChat, get_token
+from chatsh.chat import AnthropicChat, accepts_parameter, get_client, get_token, plan_cache_breakpoints
 import os
 import io
 import sys
@@ -36,13 +36,60 @@ async def test_get_token(mock_aiofiles_open, mock_expanduser):
     with pytest.raises(Exception):
         await get_token('openai')
 
-    # Test when the file doesn't exist for Anthropic
+    # Test when the file doesn't exist for Anthropic: the loaner token is used instead
     captured_output = io.StringIO()
     sys.stdout = captured_output
-    with pytest.raises(Exception):
-        await get_token('anthropic')
-    sys.stdout = sys.__stdout__
-    
-    assert "Error reading anthropic.token file:" in captured_output.getvalue()
+    try:
+        token = await get_token('anthropic')
+    finally:
+        sys.stdout = sys.__stdout__
+
+    assert token.startswith("sk-ant-")
+    assert "Error reading token from /mock/home/.config/anthropic.token" in captured_output.getvalue()
+
+@pytest.mark.asyncio
+async def test_get_token_reloads_when_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(os.path, 'expanduser', lambda path: str(tmp_path))
+    token_file = tmp_path / '.config' / 'anthropic.token'
+    token_file.parent.mkdir()
+    token_file.write_text("first\n")
+
+    assert await get_token('anthropic') == "first"
+    with patch('aiofiles.open') as mock_aiofiles_open:
+        assert await get_token('anthropic') == "first"
+        mock_aiofiles_open.assert_not_called()
+
+    token_file.write_text("second\n")
+    os.utime(token_file, (0, 12345))
+    assert await get_token('anthropic') == "second"
+
+@pytest.mark.asyncio
+async def test_get_client_is_reused_per_key():
+    client, warm = get_client('anthropic', 'key-a')
+    assert not warm
+    assert get_client('anthropic', 'key-a') == (client, True)
+    assert get_client('anthropic', 'key-b')[0] is not client
+
+def test_plan_cache_breakpoints_marks_latest_user_turns():
+    messages = []
+    for i in range(5):
+        messages.append({"role": "user", "content": f"question {i}"})
+        messages.append({"role": "assistant", "content": f"answer {i}"})
+    messages.append({"role": "user", "content": "question 5"})
+
+    planned = plan_cache_breakpoints(messages, 3)
+
+    marked = [m["content"][-1]["text"] for m in planned if isinstance(m["content"], list)]
+    assert marked == ["question 3", "question 4", "question 5"]
+    assert all(m["content"][-1]["cache_control"] == {"type": "ephemeral"} for m in planned if isinstance(m["content"], list))
+    # the caller's messages are left untouched so breakpoints never pile up
+    assert all(isinstance(m["content"], str) for m in messages)
+
+
+def test_sampling_parameters_follow_the_sdk():
+    def old_stream(self, *, max_tokens, messages, model, temperature=None): ...
+    def new_stream(self, *, max_tokens, messages, model, thinking=None): ...
+    assert accepts_parameter(old_stream, "temperature")
+    assert not accepts_parameter(new_stream, "temperature")
 
 # More tests can be added here later
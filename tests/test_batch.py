@@ -0,0 +1,112 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from chatsh.batch import AutoExecute, CONTINUE_MESSAGE, Task, parse_tasks, read_tasks, run_batch, run_task
+from chatsh.chat import Chat
+from chatsh.interaction_log import InteractionLog, InteractionType
+from chatsh.resume import replay
+
+
+class ScriptedChat(Chat):
+    """Answers with the given replies in turn, recording what it was sent."""
+
+    def __init__(self, *replies, delay=0.0):
+        super().__init__()
+        self.replies = list(replies)
+        self.sent = []
+        self.delay = delay
+
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False, history_cacheable=False):
+        self.sent.append(user_message)
+        await asyncio.sleep(self.delay)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        yield reply
+        yield self._finish_turn(user_message, reply, {"output_tokens": 1})
+
+
+def test_parse_tasks():
+    tasks = parse_tasks(['"list files"', '', '{"prompt": "df -h", "id": "disk", "model": "h"}'])
+    assert tasks == [Task("list files", "1"), Task("df -h", "disk", "h")]
+    with pytest.raises(ValueError, match="line 2"):
+        parse_tasks(['"ok"', '{"id": 3}'])
+
+
+def test_read_tasks_from_stdin():
+    assert read_tasks("-", None, stdin=io.StringIO("  check the disk\n")) == [Task("check the disk", "1")]
+    assert read_tasks("do it", None) == [Task("do it", "1")]
+    assert read_tasks(None, "-", stdin=io.StringIO('"a"\n"b"\n'))[1].prompt == "b"
+
+
+async def test_runs_commands_until_the_model_is_done(tmp_path):
+    chat_instance = ScriptedChat("```sh\necho hello\n```", "It printed hello.")
+    result = await run_task(Task("say hello", "t1"), chat_instance, "system", "s",
+                            policy=AutoExecute.ALWAYS, log_dir=tmp_path)
+
+    assert result["status"] == "done"
+    assert result["reply"] == "It printed hello."
+    assert result["steps"][0]["executed"] and result["steps"][0]["exit_code"] == 0
+    assert "hello" in result["steps"][0]["output"]
+    assert chat_instance.sent[1].startswith("<SYSTEM>\n[stdout]\nhello") and chat_instance.sent[1].endswith(CONTINUE_MESSAGE)
+    assert result["log"].endswith("_t1.jsonl")
+
+    # the log is a normal transcript, which resume can rebuild
+    log = await InteractionLog.load_from_file(tmp_path / result["log"].split("/")[-1])
+    history, system_prompt = replay(log.interactions)
+    assert system_prompt == "system"
+    assert history.get_chat_messages() == chat_instance.messages
+
+
+async def test_policy_decides_what_runs(tmp_path):
+    risky = "```sh\nsudo rm -rf /tmp/x\n```"
+    result = await run_task(Task("clean", "t"), ScriptedChat(risky), "", "s",
+                            policy=AutoExecute.SAFE, log_dir=tmp_path)
+    assert result["status"] == "declined"
+    assert result["steps"] == [{"code": "sudo rm -rf /tmp/x", "risk": "medium",
+                                "syntax_ok": result["steps"][0]["syntax_ok"], "executed": False}]
+
+    result = await run_task(Task("look", "t"), ScriptedChat("```sh\nls\n```"), "", "s", log_dir=tmp_path)
+    assert result["status"] == "declined"  # NEVER is the default
+
+    result = await run_task(Task("loop", "t"), ScriptedChat(*["```sh\ntrue\n```"] * 3), "", "s",
+                            policy=AutoExecute.SAFE, max_turns=3, log_dir=tmp_path)
+    assert result["status"] == "max_turns" and len(result["steps"]) == 3
+
+
+async def test_backend_error_is_reported_and_logged(tmp_path):
+    result = await run_task(Task("x", "t"), ScriptedChat(RuntimeError("overloaded")), "", "s", log_dir=tmp_path)
+    assert result["status"] == "error" and result["error"] == "overloaded"
+    log = await InteractionLog.load_from_file(tmp_path / result["log"].split("/")[-1])
+    assert log.interactions[-1].type == InteractionType.ERROR
+
+
+async def test_pool_bounds_concurrency_and_writes_json_lines(tmp_path):
+    running = peak = 0
+
+    class CountingChat(ScriptedChat):
+        async def ask(self, *args, **kwargs):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            try:
+                async for chunk in super().ask(*args, **kwargs):
+                    yield chunk
+            finally:
+                running -= 1
+
+    tasks = [Task(f"task {i}", str(i)) for i in range(10)]
+    out = io.StringIO()
+    results = await run_batch(tasks, lambda model: CountingChat("done", delay=0.01), "", "s", out,
+                              jobs=3, log_dir=tmp_path)
+
+    assert peak == 3
+    assert [result["id"] for result in results] == [str(i) for i in range(10)]
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert sorted(line["id"] for line in lines) == sorted(str(i) for i in range(10))
+    assert all(line["status"] == "done" for line in lines)
+    # every task has a log of its own
+    assert len({result["log"] for result in results}) == 10
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import time
+
+import chatsh.chatsh
+from benchmarks.bench_e2e import compare, figures, run_session, windows
+from benchmarks.fake_llm import FakeLLM, make_reply, tokens
+from chatsh.interaction_log import InteractionType, iter_interactions
+
+
+async def post(url, path, body):
+    """An HTTP/1.0 request, so the reply is not chunked; returns the response body."""
+    host, port = url.rsplit("/", 1)[-1].split(":")
+    reader, writer = await asyncio.open_connection(host, int(port))
+    data = json.dumps(body).encode()
+    writer.write(f"POST {path} HTTP/1.0\r\ncontent-type: application/json\r\n"
+                 f"content-length: {len(data)}\r\n\r\n".encode() + data)
+    response = await reader.read()
+    writer.close()
+    return response.partition(b"\r\n\r\n")[2].decode()
+
+
+async def test_fake_llm_speaks_the_anthropic_sdk():
+    from anthropic import AsyncAnthropic
+    server = FakeLLM(rate=0, latency=0)
+    client = AsyncAnthropic(api_key="fake-key", base_url=await server.start())
+    messages = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"},
+                {"role": "user", "content": "list files"}]
+    try:
+        async with client.messages.stream(model="m", max_tokens=100, messages=messages) as stream:
+            text = "".join([delta async for delta in stream.text_stream])
+            usage = (await stream.get_final_message()).usage
+    finally:
+        await server.close()
+    assert text == make_reply()({"messages": messages})
+    assert text.startswith("Turn 2.") and "```sh\nseq 1 40" in text
+    assert usage.output_tokens == len(tokens(text)) and usage.input_tokens > 0
+    assert server.requests == 1
+
+
+async def test_fake_llm_paces_openai_chunks():
+    server = FakeLLM(rate=300, latency=0.05, reply=make_reply(reply_tokens=10, output_lines=3))
+    url = await server.start()
+    started = time.perf_counter()
+    try:
+        body = await post(url, "/v1/chat/completions", {
+            "model": "g", "stream": True, "stream_options": {"include_usage": True},
+            "messages": [{"role": "user", "content": "hi"}]})
+    finally:
+        await server.close()
+    elapsed = time.perf_counter() - started
+    events = [line[len("data: "):] for line in body.splitlines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    text = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks if chunk["choices"])
+    assert text.endswith("```sh\nseq 1 3 | sed 's/^/turn 1 line /'\n```\n")
+    assert chunks[-1]["usage"]["completion_tokens"] == len(tokens(text))
+    assert elapsed >= 0.05 + (len(tokens(text)) - 1) / 300
+
+
+async def test_scripted_session_runs_main_loop_end_to_end(tmp_path):
+    server = FakeLLM(rate=0, latency=0, reply=make_reply(reply_tokens=20, output_lines=3))
+    console, home = chatsh.chatsh.console, os.environ.get("HOME")
+    try:
+        samples, telemetry = await run_session(3, "anthropic", tmp_path, await server.start(), context_budget=0)
+    finally:
+        await server.close()
+    assert len(samples) == 4 and len(telemetry) == 3
+    # the prompt grows with the history
+    assert telemetry[0]["input_tokens"] < telemetry[1]["input_tokens"] < telemetry[2]["input_tokens"]
+
+    # every command was confirmed and run
+    log_file = next((tmp_path / ".local" / "share" / "chatsh_history").glob("interaction_log_*.jsonl"))
+    outputs = [interaction.content async for interaction in iter_interactions(log_file)
+               if interaction.type == InteractionType.CODE_EXECUTION_OUTPUT]
+    assert len(outputs) == 3 and "turn 3 line 3" in outputs[-1]
+    assert chatsh.chatsh.console is console and os.environ.get("HOME") == home
+
+    rows = windows(samples, telemetry, 2)
+    assert [row["turns"] for row in rows] == [2, 3]
+    assert set(figures(rows, telemetry, 100.0)) == {
+        "turn_p50_ms", "turn_p90_ms", "first_token_ms", "render_ms", "cpu_ms", "rss_growth_mb",
+        "log_write_ms", "log_kb_per_turn"}
+
+
+def test_compare_flags_regressions_beyond_tolerance_and_noise():
+    baseline = {"turn_p50_ms": 200.0, "render_ms": 2.0, "cpu_ms": 80.0, "rss_growth_mb": 5.0}
+    current = {"turn_p50_ms": 300.0, "render_ms": 2.9, "cpu_ms": 60.0, "rss_growth_mb": 5.5}
+    # render got 45% worse but by less than a millisecond; memory grew within tolerance
+    assert compare(current, baseline, 0.25) == ["turn latency p50, ms: 200.00 -> 300.00"]
+    assert compare(current, baseline, 0.6) == []
@@ -0,0 +1,118 @@
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+from chatsh.blob_store import INLINE_LIMIT, BlobRef, BlobStore
+from chatsh.conversation import ConversationHistory
+from chatsh.interaction_log import Interaction, InteractionLog, InteractionType
+from chatsh.resume import replay
+
+LONG = "total 0\n" + "drwxr-xr-x  2 root root 4096 Jan  1 00:00 dir\n" * 100
+
+
+def blob_files(store):
+    return list(store.directory.glob("??/*"))
+
+
+def test_round_trip_and_dedup(tmp_path):
+    store = BlobStore(tmp_path)
+    text = LONG + "é ☃ \udcff"  # not ASCII, and a lone surrogate from a badly encoded output
+    ref = store.put(text)
+    assert store.get(ref) == text and ref.length == len(text)
+    assert store.put(text) == ref and BlobStore(tmp_path).put(text) == ref
+    assert len(blob_files(store)) == 1
+    assert store.store("short") == "short" and isinstance(store.store(LONG), BlobRef)
+
+
+def test_interaction_keeps_long_content_out_of_line(tmp_path):
+    store = BlobStore(tmp_path)
+    plain = Interaction(InteractionType.CODE_EXECUTION_OUTPUT, LONG, datetime.now(), interaction_id=1)
+    stored = Interaction(InteractionType.CODE_EXECUTION_OUTPUT, LONG, plain.timestamp, interaction_id=1, blobs=store)
+    assert isinstance(stored._content, BlobRef)
+    assert stored.content == LONG and stored == plain and stored.to_dict() == plain.to_dict()
+    # short contents stay inline, interned
+    decision = Interaction(InteractionType.CODE_EXECUTION_DECISION, "".join(["exec", "uted"]), datetime.now(),
+                           blobs=store)
+    assert decision._content is sys.intern("executed")
+
+
+async def test_log_stores_each_body_once(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    system_prompt = "You are ChatSH.\n" * INLINE_LIMIT
+    for _ in range(2):  # two launches
+        log = InteractionLog(log_dir=tmp_path, blobs=store, tag=str(_))
+        await log.record_system_message(system_prompt)
+        await log.record_code_output(LONG, 1)
+        await log.close()
+        assert all(isinstance(interaction._content, BlobRef) for interaction in log.interactions)
+    assert len(blob_files(store)) == 2
+
+    # the log file itself still holds the full bodies
+    loaded = await InteractionLog.load_from_file(log.current_file)
+    assert [interaction.content for interaction in loaded.interactions] == [system_prompt, LONG]
+    loaded = await InteractionLog.load_from_file(log.current_file, blobs=store)
+    assert isinstance(loaded.interactions[1]._content, BlobRef)
+    assert loaded.interactions[1].content == LONG
+
+
+def test_history_with_blobs_builds_the_same_messages(tmp_path):
+    histories = [ConversationHistory(), ConversationHistory(BlobStore(tmp_path))]
+    for history in histories:
+        history.add_entry('user', 'list it')
+        history.add_entry('assistant', '```sh\nls -l\n```')
+        history.entries[-1].execution_output = LONG
+        history.add_entry('user', 'and now?')
+    plain, stored = histories
+    assert isinstance(stored.entries[1]._execution_output, BlobRef)
+    assert stored.entries[1].output_length == len(LONG)
+    assert stored.entries == plain.entries
+    assert stored.get_chat_messages(keep_last_turns=0) == plain.get_chat_messages(keep_last_turns=0)
+    assert stored.construct_turn_message() == plain.get_chat_messages()[-1]["content"]
+
+
+async def test_replay_into_blobs(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    user_id = await log.record_user_message("list it")
+    reply_id = await log.record_llm_response("```sh\nls -l\n```", user_id)
+    prompt_id = await log.record_code_execution_prompt("ls -l", reply_id)
+    await log.record_code_execution_decision(True, prompt_id)
+    await log.record_code_output(LONG, prompt_id)
+    await log.close()
+
+    history, _ = replay(log.interactions, BlobStore(tmp_path / "blobs"))
+    assert isinstance(history.entries[-1]._execution_output, BlobRef)
+    assert history.entries == replay(log.interactions)[0].entries
+
+
+async def test_blobs_are_written_off_the_event_loop(tmp_path, monkeypatch, capsys):
+    store = BlobStore(tmp_path)
+    ref = store.put(LONG)
+    assert store.get(ref) == LONG  # from memory, or from disk if the write was quick
+    await store.flush()
+    assert len(blob_files(store)) == 1 and not store._pending
+
+    def failing(digest, data):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(store, "_save", failing)
+    ref = store.put(LONG + "more")
+    await store.flush()
+    # kept in memory instead
+    assert store.get(ref) == LONG + "more"
+    assert "No space left on device" in capsys.readouterr().err
+
+
+def test_blobs_no_live_session_uses_are_swept(tmp_path):
+    store = BlobStore(tmp_path)
+    gone = store.put(LONG)
+    dead = subprocess.Popen([sys.executable, "-c", ""])
+    dead.wait()
+    # as if a session that has ended had put it
+    os.rename(tmp_path / "leases" / str(os.getpid()), tmp_path / "leases" / str(dead.pid))
+
+    later = BlobStore(tmp_path)
+    kept = later.put(LONG + "kept")
+    assert [path.parent.name + path.name for path in blob_files(later)] == [kept.digest.hex()]
+    assert os.listdir(tmp_path / "leases") == [str(os.getpid())]
+    assert later.get(kept) == LONG + "kept"
+    assert later.sweep() == 0 and gone != kept
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from chatsh import chat_vendors
+from chatsh.chat import UsageEvent, chat
+from chatsh.chat_vendors import OpenAIChat, stream_in_thread
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.params = None
+
+    async def create(self, **params):
+        self.params = params
+
+        async def chunks():
+            for text in ["Hel", "lo"]:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+            usage = SimpleNamespace(prompt_tokens=120, completion_tokens=2,
+                                    prompt_tokens_details=SimpleNamespace(cached_tokens=100))
+            yield SimpleNamespace(choices=[], usage=usage)
+        return chunks()
+
+
+async def test_openai_streams_deltas_then_usage(monkeypatch):
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(chat_vendors, "get_client", lambda vendor, key: (client, True))
+
+    async def fake_token(vendor):
+        return "key"
+    monkeypatch.setattr(chat_vendors, "get_token", fake_token)
+
+    openai_chat = chat("g")
+    assert isinstance(openai_chat, OpenAIChat)
+    events = [event async for event in openai_chat.ask("hi", system="be brief", model="g")]
+
+    assert events[:2] == ["Hel", "lo"]
+    assert isinstance(events[2], UsageEvent)
+    assert events[2].usage["input_tokens"] == 20 and events[2].usage["cache_read_input_tokens"] == 100
+    assert completions.params["messages"][0] == {"role": "system", "content": "be brief"}
+    # the system prompt is sent, not kept in the shared history
+    assert openai_chat.messages == [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "Hello"}]
+
+
+async def test_stream_in_thread_keeps_the_loop_responsive():
+    def produce(emit, stopped):
+        for word in ["slow", "sdk"]:
+            time.sleep(0.05)
+            emit(0, word)
+
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker = asyncio.ensure_future(tick())
+    items = [value async for _, value in stream_in_thread(produce)]
+    ticker.cancel()
+    assert items == ["slow", "sdk"]
+    assert ticks >= 5
+
+
+async def test_stream_in_thread_stops_producer_and_raises_errors():
+    seen = []
+
+    def produce(emit, stopped):
+        for i in range(100):
+            if stopped.is_set():
+                return
+            seen.append(i)
+            emit(0, i)
+            time.sleep(0.01)
+
+    async for _, value in stream_in_thread(produce):
+        break
+    await asyncio.sleep(0.05)
+    assert len(seen) < 100
+
+    def fail(emit, stopped):
+        raise RuntimeError("quota")
+
+    try:
+        async for _ in stream_in_thread(fail):
+            pass
+    except RuntimeError as error:
+        assert str(error) == "quota"
+    else:
+        raise AssertionError("the producer's error was not raised")
@@ -1,21 +1,13 @@
 import pytest
-from unittest.mock import mock_open, patch
-from datetime import datetime
-from pathlib import Path
-import re
-
-# Import the functions to be tested
-from chatsh.chat import chat  # Assuming the chat function is in a file named chat.py in the chatsh directory
-from chatsh.chatsh import (
-    extract_codes,
-    handle_back_command,
-    append_to_history,
-    generate_system_description,
-)
-
-# Test for extract_codes function
+import inspect
+
+from chatsh.chat import chat
+from chatsh.chatsh import parse_args
+from chatsh.conversation import ConversationEntry, ConversationHistory
+
+
+# sh blocks are found by the conversation entry that holds the reply
 def test_extract_codes():
-    import inspect
     test_text = inspect.cleandoc("""
     Here's some code:
     ```sh
@@ -27,50 +19,44 @@ def test_extract_codes():
     grep "pattern" file.txt
     ```
     """)
-    expected_codes = [
+    entry = ConversationEntry('assistant', test_text)
+    assert entry.get_codeblocks(last_only=False) == [
         'echo "Hello, World!"\nls -la',
         'grep "pattern" file.txt'
     ]
-    assert extract_codes(test_text) == expected_codes
+    assert entry.get_codeblocks() == ['grep "pattern" file.txt']
+
 
-# Test for handle_back_command function
 def test_handle_back_command():
-    chat_instance = chat("s")  # Create a mock chat instance
+    history = ConversationHistory()
+    for i in range(3):
+        history.add_entry('user', f'question {i}')
+        history.add_entry('assistant', f'answer {i}')
 
     # Test valid 'back' command
-    assert handle_back_command("back 2", chat_instance) == True
+    assert len(history.handle_back_command("back 2")) == 4
 
     # Test valid 'b' command
-    assert handle_back_command("b 1", chat_instance) == True
+    assert len(history.handle_back_command("b 1")) == 2
+    assert history.entries == []
 
     # Test invalid command
-    assert handle_back_command("invalid command", chat_instance) == False
+    assert history.handle_back_command("invalid command") == []
 
-# Test for append_to_history function
-def test_append_to_history():
-    mock_file = mock_open()
-    with patch('builtins.open', mock_file):
-        append_to_history('USER', 'Test message')
 
-    mock_file().write.assert_called_once_with('<USER>\nTest message\n</USER>\n\n')
+def test_parse_args_defaults():
+    args = parse_args([])
+    assert args.model == "s"
+    assert not args.flat and not args.parallel and args.prompt is None
 
-# Test for generate_system_description function
-@patch('shutil.which')
-def test_generate_system_description(mock_which):
-    # Mock the behavior of shutil.which
-    mock_which.side_effect = lambda cmd: cmd in ['rg', 'fd', 'jq']
 
-    # Mock the get_shell function
-    with patch('asyncio.run') as mock_run:
-        mock_run.return_value = "Mock System Info"
+@pytest.mark.parametrize("argv", [["--jobs", "0"], ["--jobs", "-2"], ["--parallel", "0"],
+                                  ["-p", "task", "--parallel"], ["--tasks", "t.jsonl", "--resume"]])
+def test_parse_args_rejects_what_would_run_nothing_or_be_ignored(argv, capsys):
+    with pytest.raises(SystemExit):
+        parse_args(argv)
+    assert "chatsh: error:" in capsys.readouterr().err
 
-        result = generate_system_description()
-
-        assert "Mock System Info" in result
-        assert "rg: faster replacement for grep" in result
-        assert "fd: faster alternative to find" in result
-        assert "jq: command-line JSON processor" in result
-        assert "tldr: simplified man pages" not in result
 
 # Test for chat instance creation
 def test_chat_instance_creation():
@@ -80,5 +66,3 @@ def test_chat_instance_creation():
 
 if __name__ == "__main__":
     pytest.main()
-
-
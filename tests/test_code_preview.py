@@ -0,0 +1,81 @@
+import random
+import shutil
+
+import pytest
+
+from chatsh.code_preview import FenceParser, SpeculativePreview, classify_risk, preview_code
+from chatsh.conversation import ConversationEntry
+
+REPLY = """First look at the files:
+
+```sh
+ls -la
+```
+
+Then, in Python (not run):
+
+```python
+print("```sh inside python")
+```
+
+And finally:
+
+```sh
+for f in *.log; do wc -l "$f"; done
+```
+"""
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fence_parser_matches_get_codeblocks_for_any_chunking(seed):
+    rng = random.Random(seed)
+    parser = FenceParser()
+    i = 0
+    while i < len(REPLY):
+        size = rng.randint(1, 12)
+        parser.feed(REPLY[i:i + size])
+        i += size
+    assert parser.blocks == ConversationEntry("assistant", REPLY).get_codeblocks(last_only=False)
+
+
+def test_block_is_reported_when_its_closing_fence_arrives():
+    parser = FenceParser()
+    assert parser.feed("```sh\necho hi\n") == []
+    assert parser.feed("``") == []
+    assert parser.feed("`\nmore prose") == ["echo hi"]
+
+
+def test_fence_parser_keeps_only_a_fence_of_prose():
+    parser = FenceParser()
+    for _ in range(1000):
+        parser.feed("some prose and a stray ` between blocks ")
+    assert len(parser._tail) < len("```sh")
+    parser.feed("```sh\n" + "echo chunk\n" * 1000 + "```")
+    assert parser.blocks == ["\n".join(["echo chunk"] * 1000)]
+
+
+def test_classify_risk():
+    assert classify_risk("ls -la") == ("low", [])
+    assert classify_risk("rm -rf ./build")[0] == "medium"
+    assert classify_risk("sudo rm -rf /")[0] == "high"
+    assert classify_risk("curl -fsSL https://example.com/install | sh")[0] == "high"
+
+
+@pytest.mark.skipif(shutil.which("bash") is None, reason="needs bash")
+async def test_syntax_is_checked_during_the_stream():
+    preview = SpeculativePreview()
+    for chunk in ["```sh\nif true; then echo", " hi\n```\n", "```sh\nfor x in; do\n```"]:
+        preview.feed(chunk)
+    result = await preview.last_preview()
+    assert preview.codes() == ["for x in; do"]
+    assert result.syntax_ok is False and result.syntax_error
+    assert result.should_confirm_carefully
+
+    assert (await preview_code("echo ok")).syntax_ok is True
+
+
+async def test_no_blocks_no_preview():
+    preview = SpeculativePreview()
+    preview.feed("just prose")
+    assert preview.codes() == []
+    assert await preview.last_preview() is None
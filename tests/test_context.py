@@ -0,0 +1,156 @@
+import asyncio
+
+from chatsh.context import ContextManager, pick_summary_model, render_transcript
+from chatsh.conversation import SUMMARY_ACK, ConversationHistory
+from chatsh.interaction_log import InteractionLog
+from chatsh.reducer import estimate_tokens
+from chatsh.resume import PINNED_KEY, replay
+from tests.test_conversation import RecordingChat
+
+
+class FakeSummarizer:
+    def __init__(self):
+        self.transcripts = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, transcript):
+        self.transcripts.append(transcript)
+        await self.release.wait()
+        return f"summary of {transcript.count('<USER>')} turns"
+
+
+def make_history(turns, size=400):
+    history = ConversationHistory()
+    for i in range(turns):
+        history.add_entry('user', f"question {i} " + "x" * size)
+        history.add_entry('assistant', f"answer {i} " + "y" * size)
+    return history
+
+
+def manager_for(history, budget, summarizer, keep=2):
+    chat_instance = RecordingChat()
+    chat_instance.messages = history.get_chat_messages()
+    return ContextManager(history, chat_instance, budget, summarizer, keep_recent_turns=keep), chat_instance
+
+
+async def test_compaction_keeps_recent_and_pinned_turns():
+    history = make_history(3)
+    history.pin_last_turn()
+    for i in range(3, 8):
+        history.add_entry('user', f"question {i} " + "x" * 400)
+        history.add_entry('assistant', f"answer {i} " + "y" * 400)
+    summarizer = FakeSummarizer()
+    manager, chat_instance = manager_for(history, manager_total(history), summarizer)
+
+    assert manager.maybe_start()
+    assert not manager.maybe_start()  # one summary at a time
+    result = await manager.apply()
+
+    assert result["compacted_turns"] == 6
+    assert result["tokens_after"] < result["tokens_before"]
+    # the pinned turn is left out of the summary, and kept verbatim after it
+    assert "question 2" not in summarizer.transcripts[0]
+    assert summarizer.transcripts[0].count("<USER>") == 5
+    contents = [entry.content for entry in history.entries]
+    assert "summary of 5 turns" in contents[0] and contents[1] == SUMMARY_ACK
+    assert [c.split(" ")[1] for c in contents[2:]] == ["2", "2", "6", "6", "7", "7"]
+    assert [entry.role for entry in history.entries] == ['user', 'assistant'] * 4
+    assert chat_instance.messages == history.get_chat_messages()
+
+
+def manager_total(history):
+    return sum(estimate_tokens(entry.content) for entry in history.entries)
+
+
+async def test_nothing_starts_under_the_threshold():
+    history = make_history(8)
+    manager, _ = manager_for(history, manager_total(history) * 10, FakeSummarizer())
+    assert not manager.maybe_start()
+    assert await manager.apply() is None
+
+
+async def test_apply_waits_only_when_over_budget():
+    history = make_history(8)
+    summarizer = FakeSummarizer()
+    summarizer.release.clear()
+    # past the compaction threshold, but still under the budget
+    manager, _ = manager_for(history, int(manager_total(history) * 1.2), summarizer)
+    assert manager.maybe_start()
+    await asyncio.sleep(0)
+    assert await manager.apply() is None
+    assert len(history.entries) == 16
+
+    history.add_entry('user', "z" * 4000)
+    history.add_entry('assistant', "z" * 4000)
+    waiting = asyncio.ensure_future(manager.apply())
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    summarizer.release.set()
+    assert (await waiting)["compacted_turns"] == 6
+
+
+async def test_summary_of_turns_removed_by_back_is_discarded():
+    history = make_history(8)
+    summarizer = FakeSummarizer()
+    manager, _ = manager_for(history, manager_total(history), summarizer, keep=6)
+    assert manager.maybe_start()
+    history.handle_back_command("back 7")
+    assert await manager.apply() is None
+    assert len(history.entries) == 2 and not history.entries[0].summary
+
+
+async def test_summary_failure_leaves_history_alone():
+    async def failing(transcript):
+        raise RuntimeError("overloaded")
+    history = make_history(8)
+    manager, _ = manager_for(history, manager_total(history), failing)
+    manager.maybe_start()
+    assert await manager.apply() == {"error": "overloaded"}
+    assert len(history.entries) == 16
+
+
+def test_summaries_stay_with_the_session_vendor(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    config = tmp_path / ".config"
+    config.mkdir()
+    (config / "openai.token").write_text("key")
+    assert pick_summary_model("g") == "gpt-4o-mini"
+    assert pick_summary_model("gpt-4o-2024-08-06,s") == "gpt-4o-mini"
+    # an explicit choice is kept, if that vendor has a token
+    assert pick_summary_model("g", "gpt-4o") == "gpt-4o"
+    # no anthropic token: the loaner is not used for summaries
+    assert pick_summary_model("s") is None
+    assert pick_summary_model("g", "h") is None
+    (config / "anthropic.token").write_text("key")
+    assert pick_summary_model("s") == "h"
+
+
+def test_transcript_cuts_long_outputs():
+    history = make_history(1)
+    history.entries[-1].execution_output = "o" * 10_000
+    transcript = render_transcript(history.entries)
+    assert "<SYSTEM>" in transcript and "characters cut" in transcript
+    assert len(transcript) < 5000
+
+
+async def test_replay_reproduces_pins_and_compaction(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    history = ConversationHistory()
+    for i in range(4):
+        user_id = await log.record_user_message(f"q{i}")
+        history.add_entry('user', f"q{i}")
+        await log.record_llm_response(f"a{i}", user_id)
+        history.add_entry('assistant', f"a{i}")
+        if i == 1:
+            history.pin_last_turn()
+            await log.record_system_message("Pinned the last exchange", metadata={PINNED_KEY: True})
+    history.compact(3, "the summary")
+    await log.record_system_message("Compacted 3 turns into a summary",
+                                    metadata={"compacted_turns": 3, "summary": "the summary"})
+    await log.close()
+
+    loaded = await InteractionLog.load_from_file(log.current_file)
+    resumed, _ = replay(loaded.interactions)
+    assert resumed.entries == history.entries
+    assert [entry.content for entry in resumed.entries][2:] == ["q1", "a1", "q3", "a3"]
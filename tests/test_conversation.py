@@ -0,0 +1,64 @@
+from chatsh.chat import Chat, UsageEvent
+from chatsh.chatsh import format_usage_report
+from chatsh.conversation import ConversationHistory
+
+
+class RecordingChat(Chat):
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False, history_cacheable=False):
+        reply = f"reply {len(self.messages) // 2}"
+        yield reply
+        yield self._finish_turn(user_message, reply, {})
+
+
+def test_get_chat_messages_folds_execution_output():
+    history = ConversationHistory()
+    history.add_entry('user', 'list files')
+    history.add_entry('assistant', '```sh\nls\n```', execution_output='a.txt\n')
+    history.add_entry('user', 'what is in it?')
+
+    assert history.get_chat_messages() == [
+        {"role": "user", "content": "list files"},
+        {"role": "assistant", "content": "```sh\nls\n```"},
+        {"role": "user", "content": "<SYSTEM>\na.txt\n</SYSTEM>\n\nwhat is in it?"},
+    ]
+    assert history.construct_turn_message() == "<SYSTEM>\na.txt\n</SYSTEM>\n\nwhat is in it?"
+
+
+async def test_turn_messages_keep_backend_in_sync():
+    history = ConversationHistory()
+    chat_instance = RecordingChat()
+
+    for i in range(3):
+        history.add_entry('user', f'question {i}')
+        async for reply in chat_instance.ask(history.construct_turn_message(), system="", model="s"):
+            if not isinstance(reply, UsageEvent):
+                history.add_entry('assistant', reply)
+        history.entries[-1].execution_output = f'output {i}'
+
+    removed = history.handle_back_command('back 1')
+    chat_instance.back(len(removed))
+
+    assert chat_instance.messages == history.get_chat_messages()
+
+
+def test_pop_unanswered_only_drops_trailing_user_entry():
+    history = ConversationHistory()
+    history.add_entry('user', 'hi')
+    history.add_entry('assistant', 'hello')
+    assert history.pop_unanswered() is None
+
+    history.add_entry('user', 'this request failed')
+    assert history.pop_unanswered().content == 'this request failed'
+    assert [entry.role for entry in history.entries] == ['user', 'assistant']
+
+
+def test_format_usage_report_shows_input_growth():
+    usage = [
+        {"input_tokens": 100, "output_tokens": 10, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0},
+        {"input_tokens": 20, "output_tokens": 12, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 110},
+    ]
+    assert format_usage_report(usage) == (
+        "turn 1: input 100, output 10, cached 0 (miss)\n"
+        "turn 2: input 130 (+30), output 12, cached 110 (hit)"
+    )
+    assert format_usage_report(usage, last_only=True) == "turn 2: input 130 (+30), output 12, cached 110 (hit)"
@@ -0,0 +1,249 @@
+import asyncio
+import os
+import pty
+import re
+import select
+import socket
+import struct
+import subprocess
+import sys
+import termios
+import fcntl
+import time
+
+import pytest
+
+from benchmarks.fake_llm import FakeLLM
+from chatsh import chat, client, daemon as chatsh_daemon
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A daemon whose sessions talk to a local fake vendor instead of a real one
+SERVER = """
+import sys
+from chatsh.chat import Chat
+from chatsh.daemon import serve
+
+class FakeVendor(Chat):
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True,
+                  system_cacheable=False, history_cacheable=False, prefill=""):
+        request = user_message.splitlines()[-1]
+        replies = {"where": "```sh\\npwd; echo $CHATSH_TEST\\n```", "tty": "```sh\\necho reached > /dev/tty\\n```"}
+        reply = replies.get(request, f"You said: {request}")
+        for word in reply.split(" "):
+            yield word if word == reply.split(" ")[-1] else word + " "
+        yield self._finish_turn(user_message, reply, {"input_tokens": 10, "output_tokens": 3})
+
+serve(sys.argv[1], make_backend=lambda model: FakeVendor())
+"""
+
+ANSI = re.compile(r"\x1b\[[0-9;?]*[a-zA-Z]|\x1b[()][0-9A-Za-z]|\x1b[>=]|\r")
+
+
+class Terminal:
+    """A client chatsh on a pseudo-terminal."""
+
+    def __init__(self, env, cwd, *args):
+        self.master, slave = pty.openpty()
+        fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", 24, 100, 0, 0))
+        self.proc = subprocess.Popen([sys.executable, "-c", "import chatsh; chatsh.main()", *args],
+                                     stdin=slave, stdout=slave, stderr=slave, env=env, cwd=cwd,
+                                     start_new_session=True)
+        os.close(slave)
+        self.screen = ""
+        self.matched = 0
+
+    def read_until(self, text, timeout=20.0):
+        """Wait for text to appear after what earlier calls matched; returns the screen."""
+        deadline = time.monotonic() + timeout
+        while text not in ANSI.sub("", self.screen)[self.matched:]:
+            ready, _, _ = select.select([self.master], [], [], max(0.0, deadline - time.monotonic()))
+            if not ready:
+                raise AssertionError(f"no {text!r} on the screen:\n{ANSI.sub('', self.screen)}")
+            try:
+                self.screen += os.read(self.master, 65536).decode(errors="replace")
+            except OSError:
+                raise AssertionError(f"terminal closed before {text!r}:\n{ANSI.sub('', self.screen)}")
+        screen = ANSI.sub("", self.screen)
+        self.matched = screen.index(text, self.matched) + len(text)
+        return screen
+
+    def wait(self, timeout=20.0):
+        """The client's exit status, reading the screen meanwhile so the session never blocks on it."""
+        deadline = time.monotonic() + timeout
+        while self.proc.poll() is None and time.monotonic() < deadline:
+            if select.select([self.master], [], [], 0.05)[0]:
+                try:
+                    self.screen += os.read(self.master, 65536).decode(errors="replace")
+                except OSError:
+                    break
+        return self.proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+
+    def type(self, keys):
+        os.write(self.master, keys.encode())
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        os.close(self.master)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    path = str(tmp_path / "run" / "daemon.sock")
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "gh").write_text("#!/bin/sh\nexit 0\n")  # the transcript upload on exit
+    (bin_dir / "gh").chmod(0o755)
+    env = dict(os.environ, HOME=str(tmp_path), XDG_CACHE_HOME=str(tmp_path / "cache"), CHATSH_SOCKET=path,
+               PATH=f"{bin_dir}:{os.environ['PATH']}", PYTHONPATH=ROOT, TERM="xterm")
+    server = subprocess.Popen([sys.executable, "-c", SERVER, path], env=env, cwd=ROOT)
+    deadline = time.monotonic() + 20
+    while client.connect(path) is None:
+        assert server.poll() is None and time.monotonic() < deadline, "the daemon did not start"
+        time.sleep(0.05)
+    yield env
+    server.terminate()
+    server.wait(timeout=10)
+    assert not os.path.exists(path)
+
+
+def test_without_a_daemon_chatsh_runs_in_process(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHATSH_SOCKET", str(tmp_path / "none.sock"))
+    assert client.attach([]) is None
+    assert client.attach(["--no-daemon"]) is None
+    assert client.stop() is None
+
+
+def test_session_runs_in_the_daemon_with_the_clients_terminal(daemon, tmp_path):
+    work = tmp_path / "work"
+    work.mkdir()
+    terminal = Terminal(dict(daemon, CHATSH_TEST="from the client"), str(work), "--fresh-shell")
+    try:
+        terminal.read_until("λ")
+        terminal.type("hello\r")
+        terminal.read_until("You said: hello")
+
+        # commands run in the client's directory, with its environment
+        terminal.type("where\r")
+        terminal.read_until("Execute the code?")
+        terminal.type("y\r")
+        screen = terminal.read_until("from the client")
+        assert str(work) in screen
+        terminal.read_until("λ")
+
+        # the terminal is the session's controlling terminal, so prompts on /dev/tty work
+        terminal.type("tty\r")
+        terminal.read_until("Execute the code?")
+        terminal.type("y\r")
+        terminal.read_until("reached")
+        terminal.read_until("λ")
+        terminal.type("\x04")  # Ctrl-D ends the session
+        assert terminal.wait() == 0
+    finally:
+        terminal.close()
+    # the session logged to the client's HOME
+    assert list((tmp_path / ".local" / "share" / "chatsh_history").glob("interaction_log_*.jsonl"))
+
+
+def test_sessions_share_one_daemon(daemon, tmp_path):
+    terminals = [Terminal(daemon, str(tmp_path)) for _ in range(2)]
+    try:
+        for number, terminal in enumerate(terminals):
+            terminal.read_until("λ")
+            terminal.type(f"terminal {number}\r")
+        for number, terminal in enumerate(terminals):
+            terminal.read_until(f"You said: terminal {number}")
+    finally:
+        for terminal in terminals:
+            terminal.close()
+
+
+def test_a_stale_daemon_steps_aside(daemon, monkeypatch):
+    monkeypatch.setenv("CHATSH_SOCKET", daemon["CHATSH_SOCKET"])
+    monkeypatch.setattr(client, "code_stamp", lambda: "older")
+    connection = client.connect()
+    with connection:
+        client.send_request(connection, {"argv": [], "cwd": "/", "env": {}, "stamp": "older"}, [0, 1, 2])
+        assert connection.makefile("r").readline().strip() == '{"stale": true}'
+    deadline = time.monotonic() + 10
+    while os.path.exists(daemon["CHATSH_SOCKET"]):
+        assert time.monotonic() < deadline, "the stale daemon kept listening"
+        time.sleep(0.05)
+
+
+def test_a_terminal_that_controls_another_session_is_not_taken():
+    def take(slave):
+        pid = os.fork()
+        if pid == 0:
+            os.dup2(slave, 0)
+            os._exit(0 if chatsh_daemon._take_terminal() else 1)
+        return os.waitpid(pid, 0)[1] == 0
+
+    master, slave = pty.openpty()
+    try:
+        assert take(slave)
+        # a shell's terminal: opened by a session leader that had none
+        shell = subprocess.Popen([sys.executable, "-c", "import os, sys; os.open(os.ttyname(0), os.O_RDWR); sys.stdin.read()"],
+                                 stdin=slave, start_new_session=True)
+        time.sleep(0.5)
+        assert not take(slave)
+        shell.kill()
+        shell.wait()
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+def test_a_socket_others_could_have_made_is_not_used(daemon, monkeypatch):
+    monkeypatch.setenv("CHATSH_SOCKET", daemon["CHATSH_SOCKET"])
+    directory = os.path.dirname(daemon["CHATSH_SOCKET"])
+    connection = client.connect()
+    assert connection is not None
+    connection.close()
+    os.chmod(directory, 0o755)
+    try:
+        assert client.connect() is None
+        # and no daemon listens in such a directory
+        with pytest.raises(RuntimeError, match="only this user"):
+            chatsh_daemon._listen(os.path.join(directory, "other.sock"))
+    finally:
+        os.chmod(directory, 0o700)
+
+
+def test_sessions_get_only_the_environment_they_need(monkeypatch):
+    monkeypatch.setenv("LC_ALL", "C.UTF-8")
+    monkeypatch.setenv("CHATSH_TEST", "kept")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+    env = client.session_env()
+    assert env["LC_ALL"] == "C.UTF-8" and env["CHATSH_TEST"] == "kept" and env["PATH"] == os.environ["PATH"]
+    assert "AWS_SECRET_ACCESS_KEY" not in env
+
+
+def test_session_connects_its_vendor_client_before_the_first_request(tmp_path, monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", f"http://127.0.0.1:{port}")
+    monkeypatch.setenv("HOME", str(tmp_path))
+    (tmp_path / ".config").mkdir()
+    (tmp_path / ".config" / "anthropic.token").write_text("key\n")
+    monkeypatch.setattr(sys, "argv", ["chatsh", "s", "--failover", "g"])
+    monkeypatch.setattr(chat, "_clients", {})
+    # in the forked session, before main() and its event loop
+    chatsh_daemon._prepare_clients()
+    assert [key for key, (owner, _) in chat._clients.items()] == [("anthropic", "key")]
+
+    async def first_turn():
+        server = FakeLLM(rate=0, latency=0)
+        await server.start(port=port)
+        try:
+            await chat.warm_clients()
+            assert server.requests == 1
+            replies = [reply async for reply in chat.AnthropicChat().ask("hi", system="", model="s")]
+        finally:
+            await server.close()
+        return replies[-1].usage, server.requests
+    usage, requests = asyncio.run(first_turn())
+    assert usage["warm_client"] and requests == 2
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import pty
+import select
+import subprocess
+import sys
+
+import chatsh.execution as execution
+from chatsh.execution import OutputWindow, execute_code
+
+
+async def test_streams_are_separate_and_labeled():
+    seen = []
+    result = await execute_code("echo out; echo err >&2; exit 3",
+                                on_output=lambda stream, text: seen.append((stream, text)))
+
+    assert result.exit_code == 3
+    assert ("stdout", "out\n") in seen and ("stderr", "err\n") in seen
+    assert result.for_model() == "[stdout]\nout\n[stderr]\nerr\n[exit code 3]"
+
+
+async def test_large_output_keeps_head_tail_and_spills(monkeypatch):
+    monkeypatch.setattr(execution, "SPILL_BYTES", 64 * 1024)
+    result = await execute_code("seq 1 200000")
+
+    text = result.stdout.text()
+    assert text.startswith("1\n2\n3\n")
+    assert text.rstrip().endswith("199999\n200000")
+    assert "bytes omitted" in text
+    assert len(text) < execution.HEAD_BYTES + execution.TAIL_BYTES + 200
+    with open(result.stdout.spill_path, 'rb') as f:
+        assert f.read().count(b"\n") == 200000
+
+    # the session's end removes the spill files with their directory
+    spill_dir = os.path.dirname(result.stdout.spill_path)
+    execution.remove_spills()
+    assert not os.path.exists(spill_dir)
+
+
+async def test_timeout_kills_the_process_group():
+    started = asyncio.get_running_loop().time()
+    result = await execute_code("sleep 30 | cat", timeout=0.2)
+
+    assert result.timed_out
+    assert asyncio.get_running_loop().time() - started < 5
+    assert "[timed out and killed]" in result.for_model()
+
+
+def test_output_window_small_output_is_kept_whole():
+    window = OutputWindow("stdout")
+    window.write(b"hello\n")
+    assert not window.truncated
+    assert window.text() == "hello\n"
+
+
+# A chatsh in a terminal of its own: a session leader that opens it becomes its controller
+IN_TERMINAL = """
+import asyncio, os, sys
+os.close(os.open(os.ttyname(0), os.O_RDWR))
+from chatsh.execution import execute_code
+for code in sys.argv[1:]:
+    result = asyncio.run(execute_code(code))
+    print(f"[{result.stdout.text().strip()}|{result.exit_code}|{result.cancelled}]", flush=True)
+"""
+
+
+def run_in_terminal(*codes, keys=b"", script=IN_TERMINAL):
+    master, slave = pty.openpty()
+    proc = subprocess.Popen([sys.executable, "-c", script, *codes], stdin=slave, stdout=slave,
+                            stderr=slave, start_new_session=True)
+    os.close(slave)
+    screen = b""
+    try:
+        while proc.poll() is None or select.select([master], [], [], 0)[0]:
+            if select.select([master], [], [], 0.1)[0]:
+                try:
+                    data = os.read(master, 4096)
+                except OSError:
+                    break
+                screen += data
+                if keys and b"?" in screen:
+                    os.write(master, keys)
+                    keys = b""
+    finally:
+        proc.wait(timeout=10)
+        os.close(master)
+    return screen.decode().replace("\r", "")
+
+
+def test_commands_can_prompt_on_the_terminal():
+    screen = run_in_terminal("printf 'continue? ' > /dev/tty; read answer < /dev/tty; echo $answer",
+                             keys=b"yes\n")
+    assert "[yes|0|False]" in screen
+    # Ctrl-C goes to the command that has the terminal, and stops only it
+    screen = run_in_terminal("printf '?' > /dev/tty; sleep 30", "echo after", keys=b"\x03")
+    assert "|True]" in screen and "[after|0|False]" in screen
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from chatsh.chat import Chat, UsageEvent
+from chatsh.fanout import FALLBACK_SEPARATOR, FanOutChat, parse_models
+
+
+class DelayedChat(Chat):
+    """Answers after delay seconds, in two deltas, or fails if error is set."""
+
+    def __init__(self, name, delay, error=None, midway=False):
+        super().__init__()
+        self.name, self.delay, self.error, self.midway = name, delay, error, midway
+        self.seen = []
+
+    async def ask(self, user_message, system, model, **kwargs):
+        self.seen.append(list(self.messages))
+        await asyncio.sleep(self.delay)
+        reply = f"{self.name} says ```sh\necho {self.name}\n```"
+        if self.error and self.midway:
+            yield reply[:5]
+            await asyncio.sleep(0.02)
+        if self.error:
+            raise RuntimeError(self.error)
+        yield reply[:5]
+        yield reply[5:]
+        yield self._finish_turn(user_message, reply, {"output_tokens": len(reply)})
+
+
+def fanout(delays, errors=None, midway=False):
+    errors = errors or {}
+    return FanOutChat(list(delays), lambda name: DelayedChat(name, delays[name], errors.get(name), midway))
+
+
+async def ask(chat_instance, message):
+    chunks = [chunk async for chunk in chat_instance.ask(message, system="", model="s,g")]
+    return "".join(chunk for chunk in chunks if not isinstance(chunk, UsageEvent)), chunks[-1]
+
+
+def test_parse_models():
+    assert parse_models("s, g,s,,i") == ["s", "g", "i"]
+
+
+async def test_fastest_model_streams_and_others_become_alternatives():
+    chat_instance = fanout({"s": 0.05, "g": 0.0, "i": 0.02})
+    text, usage = await ask(chat_instance, "hi")
+    assert chat_instance.lead == "g"
+    assert text.startswith("g says")
+    assert usage.usage["model"] == "g"
+
+    await chat_instance.wait_for_others()
+    assert [reply.model for reply in chat_instance.alternatives()] == ["s", "i"]
+    assert chat_instance.messages[-1]["content"] == text
+
+
+async def test_choosing_an_answer_continues_every_backend_from_it():
+    chat_instance = fanout({"s": 0.0, "g": 0.01})
+    await ask(chat_instance, "first")
+    await chat_instance.wait_for_others()
+    chosen = chat_instance.choose("g")
+    assert chat_instance.messages[-1]["content"] == chosen.text
+    assert chat_instance.usage[-1]["model"] == "g"
+
+    await ask(chat_instance, "second")
+    expected = [{"role": "user", "content": "first"}, {"role": "assistant", "content": chosen.text}]
+    assert all(backend.seen[-1] == expected for backend in chat_instance.backends.values())
+    await chat_instance.wait_for_others()
+
+
+async def test_failing_model_does_not_stop_the_others():
+    chat_instance = fanout({"s": 0.0, "g": 0.01}, errors={"s": "overloaded"})
+    text, _ = await ask(chat_instance, "hi")
+    assert chat_instance.lead == "g" and text.startswith("g says")
+    assert str(chat_instance.replies["s"].error) == "overloaded"
+
+    everyone_fails = fanout({"s": 0.0, "g": 0.0}, errors={"s": "down", "g": "down"})
+    with pytest.raises(RuntimeError):
+        await ask(everyone_fails, "hi")
+
+
+async def test_lead_failing_mid_reply_hands_the_turn_to_the_first_success():
+    chat_instance = fanout({"s": 0.0, "g": 0.01, "i": 0.2}, errors={"s": "connection reset"}, midway=True)
+    text, usage = await ask(chat_instance, "hi")
+    assert chat_instance.failed_lead == "s" and chat_instance.lead == "g"
+    assert text == "s say" + FALLBACK_SEPARATOR + chat_instance.replies["g"].text
+    assert usage.usage["model"] == "g"
+    assert chat_instance.messages[-1]["content"] == chat_instance.replies["g"].text
+    assert str(chat_instance.replies["s"].error) == "connection reset"
+    await chat_instance.wait_for_others()
+
+    alone = fanout({"s": 0.0, "g": 0.005}, errors={"s": "reset", "g": "down"}, midway=True)
+    with pytest.raises(RuntimeError, match="reset"):
+        await ask(alone, "hi")
+
+
+async def test_slow_models_are_cancelled_after_the_wait():
+    chat_instance = fanout({"s": 0.0, "g": 10})
+    await ask(chat_instance, "hi")
+    await chat_instance.wait_for_others(timeout=0.05)
+    assert chat_instance.alternatives() == []
+    assert chat_instance.replies["g"].text == ""
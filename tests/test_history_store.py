@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from chatsh.history_store import HistoryStore, import_logs, log_files
+from chatsh.interaction_log import InteractionLog, InteractionType
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(tmp_path / "history.sqlite3")
+    yield store
+    store.close()
+
+
+async def write_session(log_dir, question, answer):
+    log = InteractionLog(log_dir=log_dir)
+    log.current_file = log_dir / f"interaction_log_{question.split()[0]}.jsonl"
+    user_id = await log.record_user_message(question)
+    await log.record_llm_response(answer, user_id)
+    await log.close()
+    return log.current_file
+
+
+async def test_search_across_sessions(tmp_path, store):
+    await write_session(tmp_path, "restart docker compose", "```sh\ndocker compose restart\n```")
+    await write_session(tmp_path, "count lines", "```sh\nwc -l *.py\n```")
+    assert await import_logs(store, log_files(tmp_path)) == 2
+
+    rows = store.search("docker compose")
+    assert {row["type"] for row in rows} == {"user_message", "llm_response"}
+    assert all(row["file"].endswith("interaction_log_restart.jsonl") for row in rows)
+    assert [row["interaction_id"] for row in store.search("docker", type=InteractionType.USER_MESSAGE)] == [1]
+    # shell punctuation is searched literally rather than parsed as query syntax
+    assert len(store.search("*.py")) == 1
+
+
+async def test_import_skips_unchanged_files(tmp_path, store):
+    file = await write_session(tmp_path, "first question", "first answer")
+    assert await import_logs(store, [file]) == 1
+    assert await import_logs(store, [file]) == 0
+
+    with file.open("a") as f:
+        f.write(json.dumps({"type": "user_message", "content": "second question",
+                            "timestamp": "2024-01-01T00:00:00", "interaction_id": 3}) + "\n")
+    assert await import_logs(store, [file]) == 1
+    assert len(store.search("question")) == 2
+
+
+async def test_live_session_is_indexed_on_flush(tmp_path, store):
+    log = InteractionLog(log_dir=tmp_path, store=store)
+    await log.record_user_message("tail the nginx logs")
+    await log.close()
+    assert len(store.search("nginx")) == 1
+    assert store.is_current(log.current_file)
+
+
+def test_converted_legacy_logs_are_not_listed_twice(tmp_path):
+    (tmp_path / "interaction_log_a.json").write_text("[\n]")
+    (tmp_path / "interaction_log_a.jsonl").write_text("")
+    (tmp_path / "interaction_log_b.json").write_text("[\n]")
+    assert [file.name for file in log_files(tmp_path)] == ["interaction_log_b.json", "interaction_log_a.jsonl"]
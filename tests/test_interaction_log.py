@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import json
+
+import aiofiles
+
+from chatsh.interaction_log import (FsyncPolicy, InteractionLog, InteractionType, convert_json_log,
+                                    iter_interactions)
+
+
+async def record_turn(log):
+    user_id = await log.record_user_message("list files")
+    reply_id = await log.record_llm_response("```sh\nls\n```", user_id, metadata={"cache": "hit"})
+    return user_id, reply_id
+
+
+async def test_records_are_buffered_until_flush(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    await record_turn(log)
+    assert not log.current_file.exists()
+
+    await log.close()
+    lines = log.current_file.read_text().splitlines()
+    assert [json.loads(line)["type"] for line in lines] == ["user_message", "llm_response"]
+
+
+async def test_large_batch_is_flushed_without_waiting(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    log.FLUSH_INTERVAL = 60
+    await log.record_code_output("x" * (InteractionLog.FLUSH_BYTES + 1), parent_id=1)
+    for _ in range(100):
+        if log.current_file.exists():
+            break
+        await asyncio.sleep(0.01)
+    assert log.current_file.exists()
+    await log.close()
+
+
+async def test_fsync_always_writes_every_record(tmp_path):
+    log = InteractionLog(log_dir=tmp_path, fsync=FsyncPolicy.ALWAYS)
+    await log.record_user_message("hello")
+    assert len(log.current_file.read_text().splitlines()) == 1
+    await log.close()
+
+
+async def test_record_seconds_counts_only_what_callers_wait_for(tmp_path, monkeypatch):
+    async def slow_flush():
+        await asyncio.sleep(0.05)
+    for policy, waited in ((FsyncPolicy.BATCH, False), (FsyncPolicy.ALWAYS, True)):
+        log = InteractionLog(log_dir=tmp_path, fsync=policy, tag=policy.value)
+        monkeypatch.setattr(log, "flush", slow_flush)
+        await log.record_user_message("hello")
+        await asyncio.sleep(0.1)  # the background writer's batch is not the caller's time
+        assert (log.record_seconds >= 0.05) == waited
+        await log.close()
+
+
+async def test_close_keeps_the_batch_being_written(tmp_path, monkeypatch):
+    real_open = aiofiles.open
+
+    @contextlib.asynccontextmanager
+    async def slow_open(*args, **kwargs):
+        await asyncio.sleep(0.2)
+        async with real_open(*args, **kwargs) as f:
+            yield f
+
+    monkeypatch.setattr(aiofiles, "open", slow_open)
+    log = InteractionLog(log_dir=tmp_path)
+    await record_turn(log)
+    log._flush_requested.set()
+    await asyncio.sleep(0.05)  # the writer is now in the middle of its flush
+    await log.record_user_message("one more")
+    await log.close()
+    lines = log.current_file.read_text().splitlines()
+    assert [json.loads(line)["content"] for line in lines] == ["list files", "```sh\nls\n```", "one more"]
+
+
+async def test_writer_survives_a_failed_write(tmp_path, monkeypatch, capsys):
+    real_open = aiofiles.open
+    failures = []
+
+    def failing_open(*args, **kwargs):
+        if not failures:
+            failures.append(args)
+            raise OSError("No space left on device")
+        return real_open(*args, **kwargs)
+
+    monkeypatch.setattr(aiofiles, "open", failing_open)
+    log = InteractionLog(log_dir=tmp_path)
+    log.FLUSH_INTERVAL = 0.01
+    await record_turn(log)
+    for _ in range(100):
+        if log.current_file.exists():
+            break
+        await asyncio.sleep(0.01)
+    assert failures and "No space left on device" in capsys.readouterr().err
+    # the writer carries on, and the batch that failed was written on the retry
+    assert not log._writer.done()
+    await log.record_user_message("after the failure")
+    await log.close()
+    assert len(log.current_file.read_text().splitlines()) == 3
+
+
+async def test_torn_last_record_is_skipped_then_cut_off(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    await record_turn(log)
+    await log.close()
+    with open(log.current_file, "ab") as f:
+        f.write('{"type":"user_message","content":"par\u00e9'.encode()[:-1])  # a crash mid-record
+
+    loaded = await InteractionLog.load_from_file(log.current_file)
+    assert [i.content for i in loaded.interactions] == ["list files", "```sh\nls\n```"]
+    await loaded.record_user_message("next")
+    await loaded.close()
+    lines = log.current_file.read_text().splitlines()
+    assert [json.loads(line)["content"] for line in lines] == ["list files", "```sh\nls\n```", "next"]
+
+
+async def test_load_round_trip(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    user_id, reply_id = await record_turn(log)
+    await log.close()
+
+    loaded = await InteractionLog.load_from_file(log.current_file)
+    assert [i.interaction_id for i in loaded.interactions] == [user_id, reply_id]
+    assert loaded.interactions[1].type == InteractionType.LLM_RESPONSE
+    assert loaded.interactions[1].metadata == {"cache": "hit"}
+    assert loaded.next_id == reply_id + 1
+
+
+async def test_legacy_json_array_is_loaded_and_converted(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    await record_turn(log)
+    legacy = tmp_path / "interaction_log_legacy.json"
+    legacy.write_text("[\n" + ",\n".join(json.dumps(i.to_dict(), indent=2) for i in log.interactions) + "\n]")
+
+    loaded = [i async for i in iter_interactions(legacy)]
+    assert [i.content for i in loaded] == ["list files", "```sh\nls\n```"]
+
+    converted = await convert_json_log(legacy)
+    assert converted.suffix == ".jsonl"
+    assert [i.to_dict() for i in loaded] == [i.to_dict() async for i in iter_interactions(converted)]
+
+
+async def build_tree(log):
+    """
+    1 user
+    └── 2 reply
+        ├── 3 retry        (a sibling branch)
+        │   └── 5 output
+        └── 4 prompt
+    6 user
+    """
+    await log.record_user_message("question")
+    await log.record_llm_response("first answer", 1)
+    await log.record_llm_response("second answer", 2)
+    await log.record_code_execution_prompt("ls", 2)
+    await log.record_code_output("a b c", 3)
+    await log.record_user_message("next question")
+
+
+async def test_tree_traversal(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    await build_tree(log)
+    ids = lambda interactions: [i.interaction_id for i in interactions]
+
+    assert ids(await log.get_conversation_branch(5)) == [1, 2, 3, 5]
+    assert ids(log.iter_ancestors(4)) == [4, 2, 1]
+    assert ids(log.get_children(2)) == [3, 4]
+    assert ids(log.get_children(None)) == [1, 6]
+    assert ids(log.iter_subtree(2)) == [2, 3, 5, 4]
+    assert ids(log.iter_subtree(None)) == [1, 2, 3, 5, 4, 6]
+    assert [ids(branch) for branch in log.iter_branches()] == [[1, 2, 3, 5], [1, 2, 4], [6]]
+    assert [ids(branch) for branch in log.iter_branches(3)] == [[1, 2, 3, 5]]
+    assert ids(await log.playback_conversation(3)) == [1, 2, 3, 4, 5]
+    await log.close()
+
+
+async def test_tree_index_survives_reload(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    await build_tree(log)
+    await log.close()
+
+    loaded = await InteractionLog.load_from_file(log.current_file)
+    assert [[i.interaction_id for i in branch] for branch in loaded.iter_branches()] == [[1, 2, 3, 5], [1, 2, 4], [6]]
@@ -0,0 +1,96 @@
+import time
+
+from chatsh.interaction_log import InteractionLog
+from chatsh.parallel import format_block_outputs, plan_blocks, run_blocks
+from chatsh.resume import replay
+from chatsh.shell_session import ShellSession
+
+
+def depends(codes):
+    return [plan.depends_on for plan in plan_blocks(codes)]
+
+
+def test_read_only_blocks_are_independent():
+    assert depends(["ping -c1 a.example", "ssh b.example uptime", "grep -rn TODO src | wc -l",
+                    "git status && git log -1"]) == [[], [], [], []]
+
+
+def test_state_changes_and_unknown_commands_are_barriers():
+    plans = plan_blocks(["ls", "cd /tmp", "ls", "export A=1", "make", "B=2", "C=3 ls"])
+    assert [plan.barrier for plan in plans] == [False, True, False, True, True, True, False]
+    assert plans[1].depends_on == [0] and plans[2].depends_on == [1]
+    assert plans[6].depends_on == [1, 3, 4, 5]
+    assert "runs make" in plans[4].describe()
+
+
+def test_writing_flags_and_substitutions_are_barriers():
+    for code in ["sed -i s/a/b/ f", "find . -name '*.pyc' -delete", "curl -o x https://e.com",
+                 "ls $(pwd)", "cat <<EOF\nx\nEOF", "sudo reboot", "echo 'unclosed"]:
+        assert plan_blocks([code])[0].barrier, code
+    assert not plan_blocks(["sudo ls /root", "sed -n 1p f"])[1].barrier
+
+
+def test_file_dependencies():
+    codes = ["grep -r TODO src > todo.txt", "wc -l ./todo.txt", "du -sh /var", "echo x | tee out.log",
+             "cat out.log todo.txt"]
+    assert depends(codes) == [[], [0], [], [], [0, 3]]
+
+
+def test_annotations_override_the_analysis():
+    codes = ["cd /tmp", "# chatsh: independent\nmake -j4", "# chatsh: after 1 2\nls", "# chatsh: after 9\nls"]
+    plans = plan_blocks(codes)
+    assert [plan.depends_on for plan in plans] == [[], [], [0, 1], []]
+    assert not plans[1].barrier
+
+
+async def test_independent_blocks_run_concurrently_and_dependent_ones_in_order(tmp_path):
+    shell = ShellSession()
+    finished = []
+
+    async def on_finish(plan, result, wall_seconds):
+        finished.append(plan.index)
+
+    codes = [f"cd {tmp_path}", "sleep 0.5; echo a > a.txt", "sleep 0.5; echo b", "sleep 0.5; echo c", "cat a.txt"]
+    plans = plan_blocks(codes)
+    try:
+        started = time.perf_counter()
+        results = await run_blocks(plans, shell, jobs=4, on_finish=on_finish)
+        elapsed = time.perf_counter() - started
+    finally:
+        await shell.close()
+
+    assert elapsed < 1.4  # three half-second blocks side by side, then the cat
+    assert plans[4].depends_on == [0, 1]
+    assert finished[0] == 0 and finished.index(4) > finished.index(1)
+    # the independent blocks started from the directory the barrier changed to
+    assert results[4].stdout.text() == "a\n"
+    assert [result.exit_code for result in results] == [0] * 5
+
+
+async def test_job_limit(tmp_path):
+    shell = ShellSession()
+    plans = plan_blocks(["sleep 0.3"] * 4)
+    try:
+        started = time.perf_counter()
+        await run_blocks(plans, shell, jobs=2)
+        assert time.perf_counter() - started >= 0.6
+    finally:
+        await shell.close()
+
+
+async def test_replay_combines_block_outputs(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    user_id = await log.record_user_message("check both hosts")
+    reply_id = await log.record_llm_response("```sh\nping a\n```\n```sh\nping b\n```", user_id)
+    prompts = [await log.record_code_execution_prompt(code, reply_id, metadata={"block": i})
+               for i, code in enumerate(["ping a", "ping b"])]
+    for prompt_id in prompts:
+        await log.record_code_execution_decision(True, prompt_id)
+    # outputs are logged as blocks finish, here the second one first
+    await log.record_code_output("b is up", prompts[1], metadata={"block": 1})
+    await log.record_code_output("a is up", prompts[0], metadata={"block": 0})
+    await log.close()
+
+    history, _ = replay((await InteractionLog.load_from_file(log.current_file)).interactions)
+    assert history.entries[-1].execution_output == format_block_outputs({0: "a is up", 1: "b is up"})
+    assert history.entries[-1].execution_output == "[block 1]\na is up\n\n[block 2]\nb is up"
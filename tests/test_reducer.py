@@ -0,0 +1,43 @@
+from chatsh.conversation import ConversationHistory
+from chatsh.reducer import ReducerConfig, estimate_tokens, reduce_output
+
+
+def test_repeated_lines_are_deduplicated():
+    reduced, stats = reduce_output("start\n" + "retrying...\n" * 50 + "done\n", ReducerConfig())
+    assert reduced == "start\nretrying...  [repeated 50 times]\ndone\n"
+    assert stats["deduplicated_lines"] == 49
+
+
+def test_similar_log_lines_are_collapsed():
+    text = "\n".join(f"[2024-01-01 10:00:{i:02d}] GET /item/{i} 200" for i in range(30))
+    reduced, stats = reduce_output(text, ReducerConfig())
+    assert reduced.splitlines() == [
+        "[2024-01-01 10:00:00] GET /item/0 200",
+        "[... 28 similar lines ...]",
+        "[2024-01-01 10:00:29] GET /item/29 200",
+    ]
+    assert stats["collapsed_lines"] == 28
+
+
+def test_budget_keeps_head_and_tail():
+    text = "\n".join(f"line {i} " + "x" * (i % 7) for i in range(5000))
+    config = ReducerConfig(max_tokens=200, collapse_similar=False)
+    reduced, stats = reduce_output(text, config)
+
+    assert reduced.startswith("line 0 ")
+    assert reduced.endswith("line 4999 x")
+    assert "lines omitted" in reduced
+    assert estimate_tokens(reduced) <= config.max_tokens + 10
+    assert stats["omitted_lines"] > 0
+
+
+def test_old_outputs_are_elided():
+    history = ConversationHistory()
+    for i in range(3):
+        history.add_entry('user', f'q{i}')
+        history.add_entry('assistant', f'a{i}', execution_output=f'output {i}')
+    history.add_entry('user', 'q3')
+
+    full = history.construct_full_message("system", keep_last_turns=1)
+    assert "output 2" in full
+    assert "output 0" not in full and "[output elided: 8 characters]" in full
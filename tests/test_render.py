@@ -0,0 +1,52 @@
+import io
+
+import pytest
+from rich.console import Console
+from rich.markdown import Markdown
+
+from chatsh.render import StreamingMarkdown
+
+REPLY = """# Plan
+
+First paragraph
+spans two lines.
+
+```sh
+ls -la
+
+echo done
+```
+
+1. loose item
+
+2. second item
+
+   with more text
+
+Last paragraph."""
+
+
+def render_whole(text):
+    console = Console(file=io.StringIO(), width=60, color_system=None)
+    console.print(Markdown(text))
+    return console.file.getvalue()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1000])
+def test_streamed_output_matches_whole_render(chunk_size):
+    console = Console(file=io.StringIO(), width=60, color_system=None)
+    with StreamingMarkdown(console) as renderer:
+        for i in range(0, len(REPLY), chunk_size):
+            renderer.feed(REPLY[i:i + chunk_size])
+
+    assert console.file.getvalue().rstrip('\n') == render_whole(REPLY).rstrip('\n')
+
+
+def test_finished_blocks_are_frozen_but_open_fence_is_not():
+    console = Console(file=io.StringIO(), width=60, color_system=None)
+    with StreamingMarkdown(console) as renderer:
+        renderer.feed("Intro.\n\n```sh\nls\n\n")
+        assert renderer.tail == "```sh\nls\n\n"
+        renderer.feed("pwd\n```\n")
+        assert renderer.tail == ""
+        assert renderer.frozen_chars == len("Intro.\n\n```sh\nls\n\npwd\n```\n")
@@ -0,0 +1,72 @@
+import os
+import re
+
+import pytest
+
+from chatsh.chat import UsageEvent
+from chatsh.response_cache import CachedChat, CacheMiss, ResponseCache
+from tests.test_conversation import RecordingChat
+
+
+class CountingChat(RecordingChat):
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+
+    async def ask(self, user_message, system, model, **kwargs):
+        self.requests += 1
+        async for chunk in super().ask(user_message, system, model, **kwargs):
+            if isinstance(chunk, UsageEvent):
+                yield chunk
+                continue
+            # several deltas per reply, like a real stream
+            for word in re.findall(r"\S+\s*", chunk):
+                yield word
+
+
+async def collect(chat_instance, message, **kwargs):
+    chunks = [chunk async for chunk in chat_instance.ask(message, system="prompt", model="s", **kwargs)]
+    assert isinstance(chunks[-1], UsageEvent)
+    return chunks[:-1]
+
+
+async def test_second_session_is_replayed_from_the_cache(tmp_path):
+    cache = ResponseCache(tmp_path)
+    recorded = CachedChat(CountingChat(), cache)
+    first = [await collect(recorded, "one"), await collect(recorded, "two")]
+
+    replayed = CachedChat(CountingChat(), cache, replay_only=True)
+    assert [await collect(replayed, "one"), await collect(replayed, "two")] == first
+    assert replayed.inner.requests == 0 and replayed.hits == 2
+    assert replayed.messages == recorded.messages
+    assert replayed.usage[-1]["replayed"]
+
+
+async def test_replay_only_miss_is_an_error(tmp_path):
+    replayed = CachedChat(CountingChat(), ResponseCache(tmp_path), replay_only=True)
+    with pytest.raises(CacheMiss):
+        await collect(replayed, "never recorded")
+    assert replayed.messages == []
+
+
+async def test_key_covers_history_and_parameters(tmp_path):
+    cache = ResponseCache(tmp_path)
+    cached = CachedChat(CountingChat(), cache)
+    await collect(cached, "one")
+    await collect(cached, "one", temperature=0.7)  # not deterministic, so not stored
+    cached.back(4)
+    await collect(cached, "one")
+    await collect(cached, "one")  # same words, different history: a new request
+    assert cached.inner.requests == 3
+    assert len(list(tmp_path.glob("*/*.json"))) == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(tmp_path, max_entries=2)
+    for i, key in enumerate(["aa1", "bb2", "cc3"]):
+        cache.put(key, {"chunks": [key]})
+        os.utime(cache._path(key), (i, i))
+        if key == "bb2":
+            cache.get("aa1")  # touch: aa1 is now the most recent
+    assert cache.get("bb2") is None
+    assert cache.get("aa1") and cache.get("cc3")
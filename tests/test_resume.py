@@ -0,0 +1,129 @@
+import json
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from chatsh.chat import UsageEvent
+from chatsh.conversation import SKIPPED_OUTPUT, ConversationHistory
+from chatsh.interaction_log import Interaction, InteractionLog, InteractionType
+from chatsh.resume import SYSTEM_PROMPT_KEY, find_log, replay
+from tests.test_conversation import RecordingChat
+
+
+async def turn(log, history, chat_instance, message, output=None):
+    """One turn the way main_loop logs it."""
+    user_id = await log.record_user_message(message)
+    history.add_entry('user', message)
+    async for reply in chat_instance.ask(history.construct_turn_message(), system="", model="s"):
+        if isinstance(reply, UsageEvent):
+            continue
+        reply_id = await log.record_llm_response(reply, user_id)
+        history.add_entry('assistant', reply)
+    if output is not None:
+        prompt_id = await log.record_code_execution_prompt("ls", reply_id)
+        await log.record_code_execution_decision(output != SKIPPED_OUTPUT, prompt_id)
+        if output != SKIPPED_OUTPUT:
+            await log.record_code_output(output, prompt_id)
+        history.entries[-1].execution_output = output
+
+
+async def test_replay_matches_the_live_session(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    history, chat_instance = ConversationHistory(), RecordingChat()
+    await log.record_system_message("ChatSH Started with model: s")
+    await log.record_system_message("the system prompt", metadata={SYSTEM_PROMPT_KEY: True})
+
+    await turn(log, history, chat_instance, "first", output="a.txt\n")
+    await turn(log, history, chat_instance, "second", output=SKIPPED_OUTPUT)
+    await turn(log, history, chat_instance, "third")
+    removed = history.handle_back_command("back 1")
+    chat_instance.back(len(removed))
+    await log.record_back_command(len(removed) // 2)
+    # a failed request, and one the session died in the middle of
+    user_id = await log.record_user_message("this one failed")
+    await log.record_error("overloaded", user_id)
+    await log.record_user_message("crashed before the reply")
+    await log.close()
+
+    loaded = await InteractionLog.load_from_file(log.current_file)
+    resumed, system_prompt = replay(loaded.interactions)
+    assert system_prompt == "the system prompt"
+    assert resumed.entries == history.entries
+    # the backend gets exactly the messages that were sent, so the cached prefix still matches
+    assert resumed.get_chat_messages() == chat_instance.messages
+    assert loaded.current_file == log.current_file
+    assert loaded.next_id == log.next_id
+
+
+def test_replay_of_legacy_log_finds_the_system_prompt():
+    interactions = [Interaction(InteractionType.SYSTEM_MESSAGE, text, datetime.now(), interaction_id=i)
+                    for i, text in enumerate(["ChatSH Started with model: s", "prompt"], 1)]
+    assert replay(interactions)[1] == "prompt"
+
+
+def test_find_log(tmp_path):
+    older = tmp_path / "interaction_log_1.jsonl"
+    newer = tmp_path / "interaction_log_2.json"
+    older.write_text("")
+    newer.write_text("[\n]")
+    os.utime(older, (time.time() + 10, time.time() + 10))
+    assert find_log("latest", tmp_path) == older
+    assert find_log(str(newer)) == newer
+    with pytest.raises(FileNotFoundError):
+        find_log(str(tmp_path / "missing.jsonl"))
+
+
+async def test_replay_skips_answers_that_were_not_chosen(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    user_id = await log.record_user_message("hi")
+    await log.record_llm_response("from g", user_id, metadata={"model": "g", "chosen": False})
+    await log.record_llm_response("from s", user_id, metadata={"model": "s", "chosen": True})
+    history, _ = replay(log.interactions)
+    assert [entry.content for entry in history.entries] == ["hi", "from s"]
+    assert [i.content for i in log.get_children(user_id)] == ["from g", "from s"]
+    await log.close()
+
+
+async def test_resume_latest_after_a_crash_mid_write(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    history, chat_instance = ConversationHistory(), RecordingChat()
+    await turn(log, history, chat_instance, "first", output="a.txt\n")
+    await log.close()
+    # the session died while writing its next record
+    with open(log.current_file, 'a') as f:
+        f.write('{"type":"user_message","content":"sec')
+
+    loaded = await InteractionLog.load_from_file(find_log("latest", tmp_path))
+    resumed, _ = replay(loaded.interactions)
+    assert resumed.entries == history.entries
+    await turn(loaded, resumed, chat_instance, "second")
+    await loaded.close()
+
+    # the torn record was cut off, so the file is whole JSONL again
+    lines = log.current_file.read_text().splitlines()
+    assert [json.loads(line)["content"] for line in lines[-2:]] == ["second", "reply 1"]
+    again = await InteractionLog.load_from_file(find_log("latest", tmp_path))
+    assert replay(again.interactions)[0].entries == resumed.entries
+
+
+async def test_resuming_a_legacy_log_keeps_its_history(tmp_path):
+    log = InteractionLog(log_dir=tmp_path)
+    history, chat_instance = ConversationHistory(), RecordingChat()
+    await turn(log, history, chat_instance, "first", output="a.txt\n")
+    await log.close()
+    legacy = tmp_path / "interaction_log_legacy.json"
+    legacy.write_text("[\n" + ",\n".join(json.dumps(i.to_dict()) for i in log.interactions) + "\n]")
+    log.current_file.unlink()
+
+    loaded = await InteractionLog.load_from_file(find_log("latest", tmp_path))
+    assert loaded.current_file == legacy.with_suffix('.jsonl')
+    await turn(loaded, replay(loaded.interactions)[0], RecordingChat(), "second")
+    await loaded.close()
+
+    # the second resume finds the converted log, with the first session's turns in it
+    assert find_log("latest", tmp_path) == legacy.with_suffix('.jsonl')
+    again = await InteractionLog.load_from_file(find_log("latest", tmp_path))
+    assert [entry.content for entry in replay(again.interactions)[0].entries][::2] == ["first", "second"]
+    assert legacy.exists()
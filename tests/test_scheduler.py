@@ -0,0 +1,198 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from chatsh.chat import Chat, UsageEvent
+from chatsh.scheduler import (RateLimiter, ScheduledChat, StreamResumeError, TokenBucket, is_retryable,
+                              parse_rate_limits, retry_after)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = FakeResponse(status_code, headers)
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+class FlakyChat(Chat):
+    """
+    Plays a script of attempts: each is a reply, or (text, error) for a stream that breaks
+    after text. Records the prefill and messages of every attempt.
+    """
+    supports_prefill = False
+
+    def __init__(self, script, headers=None):
+        super().__init__()
+        self.script = script
+        self.attempts = []
+        self.response_headers = headers
+
+    async def ask(self, user_message, system, model, temperature=0.0, max_tokens=4096, stream=True, system_cacheable=False, history_cacheable=False, prefill=""):
+        self.attempts.append({"prefill": prefill, "messages": list(self.messages), "model": model})
+        step = self.script.pop(0)
+        text, error = step if isinstance(step, tuple) else (step, None)
+        for word in text.split(" "):
+            yield word + " " if word != text.split(" ")[-1] else word
+        if error is not None:
+            raise error
+        yield self._finish_turn(user_message, text, {"output_tokens": 1})
+
+
+class PrefillChat(FlakyChat):
+    supports_prefill = True
+
+
+class Sleeps:
+    """A fake asyncio.sleep that moves a fake clock forward."""
+
+    def __init__(self):
+        self.calls = []
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    async def __call__(self, seconds):
+        self.calls.append(seconds)
+        self.now += seconds
+
+
+async def collect(chat_instance, message="hi", model="s"):
+    chunks, usage = [], None
+    async for chunk in chat_instance.ask(message, "system", model):
+        if isinstance(chunk, UsageEvent):
+            usage = chunk.usage
+        else:
+            chunks.append(chunk)
+    return "".join(chunks), usage
+
+
+def scheduled(backends, **kwargs):
+    sleep = Sleeps()
+    chat_instance = ScheduledChat(make_backend=lambda model: backends[model], sleep=sleep,
+                                  limiter=RateLimiter(clock=sleep.clock, sleep=sleep), **kwargs)
+    return chat_instance, sleep
+
+
+def test_classifies_errors():
+    assert is_retryable(StatusError(429)) and is_retryable(StatusError(529))
+    assert not is_retryable(StatusError(400)) and not is_retryable(ValueError("bad"))
+    assert is_retryable(APIConnectionError())
+    overloaded = Exception("stream error")
+    overloaded.body = {"type": "error", "error": {"type": "overloaded_error"}}
+    assert is_retryable(overloaded)
+    assert retry_after(StatusError(429, {"Retry-After": "7"})) == 7.0
+    assert retry_after(StatusError(429, {"retry-after-ms": "250"})) == 0.25
+
+
+async def test_retries_with_backoff_and_keeps_messages_in_sync():
+    backend = FlakyChat([("", StatusError(529)), ("", StatusError(429, {"retry-after": "3"})), "fine"])
+    chat_instance, sleep = scheduled({"s": backend})
+    chat_instance.messages = [{"role": "user", "content": "before"}, {"role": "assistant", "content": "ok"}]
+
+    text, usage = await collect(chat_instance)
+    assert text == "fine"
+    assert usage["retries"] == 2
+    assert len(sleep.calls) == 2 and sleep.now >= 3  # never sooner than retry-after
+    assert all(attempt["messages"] == chat_instance.messages[:2] for attempt in backend.attempts)
+    assert chat_instance.messages[2:] == [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "fine"}]
+
+
+async def test_non_retryable_errors_and_exhausted_retries_raise():
+    chat_instance, _ = scheduled({"s": FlakyChat([("", StatusError(400))])})
+    with pytest.raises(StatusError):
+        await collect(chat_instance)
+    chat_instance, sleep = scheduled({"s": FlakyChat([("", StatusError(529))] * 3)}, max_retries=2)
+    with pytest.raises(StatusError):
+        await collect(chat_instance)
+    assert len(sleep.calls) == 2
+    assert chat_instance.messages == []
+
+
+async def test_resumes_with_prefill_after_a_dropped_stream():
+    backend = PrefillChat([("Let me check the disk.\n", APIConnectionError()), "\n```sh\ndf -h\n```"])
+    chat_instance, _ = scheduled({"s": backend})
+    text, usage = await collect(chat_instance)
+
+    assert backend.attempts[1]["prefill"] == "Let me check the disk.\n"
+    # the repeated newline is dropped, so the text reads as one reply
+    assert text == "Let me check the disk.\n```sh\ndf -h\n```"
+    assert usage["resumed"] and chat_instance.messages[-1]["content"] == text
+
+
+async def test_restarted_reply_must_continue_what_was_shown():
+    backend = FlakyChat([("one two", APIConnectionError()), "one two three"])
+    chat_instance, _ = scheduled({"s": backend})
+    assert (await collect(chat_instance))[0] == "one two three"
+
+    backend = FlakyChat([("one two", APIConnectionError()), "something else"])
+    chat_instance, _ = scheduled({"s": backend})
+    with pytest.raises(StreamResumeError):
+        await collect(chat_instance)
+
+
+async def test_fails_over_to_the_next_model():
+    primary = FlakyChat([("", StatusError(529))] * 2)
+    fallback = FlakyChat(["from haiku"])
+    chat_instance, _ = scheduled({"s": primary, "h": fallback}, fallbacks=["h"], max_retries=1)
+    text, usage = await collect(chat_instance)
+    assert text == "from haiku" and usage["model"] == "h"
+
+    # a long retry-after moves on at once
+    primary = FlakyChat([("", StatusError(429, {"retry-after": "60"}))])
+    chat_instance, sleep = scheduled({"s": primary, "h": FlakyChat(["ok"])}, fallbacks=["h"])
+    assert (await collect(chat_instance))[0] == "ok"
+    assert sleep.calls == []
+
+
+def test_parses_rate_limit_headers():
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    anthropic = {
+        "anthropic-ratelimit-requests-limit": "50", "anthropic-ratelimit-requests-remaining": "10",
+        "anthropic-ratelimit-requests-reset": (now + timedelta(seconds=30)).isoformat().replace("+00:00", "Z"),
+        "anthropic-ratelimit-input-tokens-limit": "40000", "anthropic-ratelimit-input-tokens-remaining": "39000",
+        "anthropic-ratelimit-input-tokens-reset": (now + timedelta(seconds=2)).isoformat(),
+    }
+    assert parse_rate_limits(anthropic, now) == {"requests": (50, 10, 30), "input_tokens": (40000, 39000, 2)}
+    openai = {"x-ratelimit-limit-requests": "500", "x-ratelimit-remaining-requests": "499",
+              "x-ratelimit-reset-requests": "1m0.5s", "x-ratelimit-limit-tokens": "30000",
+              "x-ratelimit-remaining-tokens": "100", "x-ratelimit-reset-tokens": "20ms"}
+    assert parse_rate_limits(openai, now) == {"requests": (500, 499, 60.5), "input_tokens": (30000, 100, 0.02)}
+
+
+async def test_limiter_paces_requests_from_headers():
+    now = [0.0]
+    sleep_calls = []
+
+    async def sleep(seconds):
+        sleep_calls.append(seconds)
+        now[0] += seconds
+
+    limiter = RateLimiter(clock=lambda: now[0], sleep=sleep)
+    assert await limiter.acquire("sonnet", 1000) == 0  # nothing known yet
+    limiter.update("sonnet", {"x-ratelimit-limit-requests": "60", "x-ratelimit-remaining-requests": "1",
+                              "x-ratelimit-reset-requests": "59s"})
+    assert await limiter.acquire("sonnet") == 0
+    # the bucket is empty and refills at one request a second
+    assert await limiter.acquire("sonnet") == pytest.approx(1.0)
+    limiter.pause("sonnet", 5)
+    assert await limiter.acquire("sonnet") == pytest.approx(5.0)
+
+
+def test_token_bucket_caps_large_requests():
+    now = [0.0]
+    bucket = TokenBucket(100, 10, tokens=0, clock=lambda: now[0])
+    assert bucket.delay(1000) == 10  # a request larger than the bucket waits for a full one
+    now[0] = 10
+    bucket.take(1000)
+    assert bucket.tokens == 0
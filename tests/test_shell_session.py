@@ -0,0 +1,78 @@
+import pytest
+
+from chatsh.shell_session import ShellSession
+from tests.test_execution import run_in_terminal
+
+
+@pytest.fixture
+async def session():
+    session = ShellSession()
+    yield session
+    await session.close()
+
+
+async def test_state_persists_between_commands(session, tmp_path):
+    await session.run(f"cd {tmp_path}; export GREETING=hi; greet() {{ echo \"$GREETING from $(pwd)\"; }}")
+    result = await session.run("greet")
+    assert result.stdout.text() == f"hi from {tmp_path}\n"
+    assert result.exit_code == 0
+    assert session.restarts == 0
+
+
+async def test_exit_code_and_separate_streams(session):
+    result = await session.run("echo out; echo err >&2; false")
+    assert result.exit_code == 1
+    assert result.stdout.text() == "out\n"
+    assert result.stderr.text() == "err\n"
+
+
+async def test_output_without_trailing_newline(session):
+    result = await session.run("printf abc")
+    assert result.stdout.text() == "abc"
+
+
+async def test_shell_restarts_after_exit(session):
+    result = await session.run("exit 7")
+    assert result.exit_code == 7
+    result = await session.run("echo back")
+    assert result.stdout.text() == "back\n"
+    assert session.restarts == 1
+
+
+async def test_timeout_kills_and_restarts(session):
+    result = await session.run("sleep 30", timeout=0.2)
+    assert result.timed_out
+    result = await session.run("echo again")
+    assert result.stdout.text() == "again\n"
+
+
+async def test_syntax_error_keeps_session(session):
+    await session.run("export KEEP=1")
+    result = await session.run("if then")
+    assert result.exit_code != 0
+    result = await session.run("echo $KEEP")
+    assert result.stdout.text() == "1\n"
+
+
+SESSION_IN_TERMINAL = """
+import asyncio, os, sys
+os.close(os.open(os.ttyname(0), os.O_RDWR))
+from chatsh.shell_session import ShellSession
+async def main():
+    session = ShellSession()
+    for code in sys.argv[1:]:
+        result = await session.run(code)
+        print(f"[{result.stdout.text().strip()}|{result.exit_code}|{result.cancelled}]", flush=True)
+    await session.close()
+asyncio.run(main())
+"""
+
+
+def test_commands_in_the_session_can_prompt_on_the_terminal():
+    screen = run_in_terminal("printf 'name? ' > /dev/tty; read answer < /dev/tty", "echo $answer",
+                             keys=b"chatsh\n", script=SESSION_IN_TERMINAL)
+    assert "[|0|False]" in screen and "[chatsh|0|False]" in screen
+    # Ctrl-C stops the command, and the shell with it; the next command gets a new shell
+    screen = run_in_terminal("printf '?' > /dev/tty; sleep 30", "echo after", keys=b"\x03",
+                             script=SESSION_IN_TERMINAL)
+    assert "|True]" in screen and "[after|0|False]" in screen
@@ -0,0 +1,66 @@
+"""
+Startup benchmarks, in the spirit of `python -X importtime`.
+
+The import check always runs. The timing check compares against a 150 ms budget for
+reaching the first prompt and only runs with CHATSH_BENCHMARK=1, since wall-clock
+budgets depend on the machine.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ["anthropic", "openai", "google.generativeai", "dataclasses_json",
+                 "rich.markdown", "rich.syntax", "pygments", "markdown_it"]
+FIRST_PROMPT_BUDGET_MS = 150
+
+# Everything main() does before the prompt is shown, minus reading from the terminal
+STARTUP_SCRIPT = """
+import json, sys, time, tempfile
+from pathlib import Path
+started = time.perf_counter()
+from chatsh.chatsh import parse_args, setup_environment, UndeletablePrompt
+from chatsh.chat import chat
+from chatsh.interaction_log import InteractionLog
+args = parse_args([])
+chat_instance = chat(setup_environment(args))
+InteractionLog(log_dir=Path(tempfile.mkdtemp()))
+UndeletablePrompt()
+elapsed_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({"elapsed_ms": elapsed_ms, "modules": sorted(sys.modules)}))
+"""
+
+
+def run_startup(*python_args):
+    proc = subprocess.run([sys.executable, *python_args, "-c", STARTUP_SCRIPT],
+                          capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(proc.stdout.splitlines()[-1]), proc.stderr
+
+
+def slowest_imports(importtime_output, count=10):
+    rows = []
+    for line in importtime_output.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def test_startup_does_not_import_heavy_modules():
+    result, _ = run_startup()
+    loaded = [name for name in HEAVY_MODULES if name in result["modules"]]
+    assert loaded == []
+
+
+@pytest.mark.skipif(os.environ.get("CHATSH_BENCHMARK") != "1", reason="set CHATSH_BENCHMARK=1 to run")
+def test_first_prompt_within_budget():
+    run_startup()  # warm the filesystem cache
+    result, importtime = run_startup("-X", "importtime")
+    timed, _ = run_startup()
+    report = "\n".join(f"{us / 1000:8.1f} ms  {name}" for us, name in slowest_imports(importtime))
+    print(f"first prompt after {timed['elapsed_ms']:.1f} ms\n{report}")
+    assert timed["elapsed_ms"] < FIRST_PROMPT_BUDGET_MS, report
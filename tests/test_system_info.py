@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+import chatsh.system_info as system_info
+from chatsh.system_info import environment_fingerprint, generate_system_description, get_available_commands
+
+
+@pytest.fixture
+def environment(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name in ["rg", "jq", "not-a-tool"]:
+        tool = bin_dir / name
+        tool.write_text("#!/bin/sh\n")
+        tool.chmod(0o755)
+    (bin_dir / "fd").write_text("not executable")
+    monkeypatch.setenv("PATH", str(bin_dir))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.setenv("SHELL", "/bin/sh")
+    return bin_dir
+
+
+def test_available_commands_are_sorted_and_executable(environment):
+    assert get_available_commands() == [
+        "jq: command-line JSON processor",
+        "rg: faster replacement for grep",
+    ]
+
+
+async def test_description_is_cached_and_byte_stable(environment, monkeypatch):
+    first = await generate_system_description()
+    calls = []
+    original = system_info.compute_system_description
+
+    async def counting(catalogue):
+        calls.append(catalogue)
+        return await original(catalogue)
+
+    monkeypatch.setattr(system_info, "compute_system_description", counting)
+    assert await generate_system_description() == first
+    assert calls == []
+
+    assert await generate_system_description(refresh=True) == first
+    assert len(calls) == 1
+
+
+def test_fingerprint_follows_path_and_catalogue(environment, monkeypatch, tmp_path):
+    catalogue = system_info.load_catalogue()
+    fingerprint = environment_fingerprint(catalogue)
+    assert environment_fingerprint(catalogue) == fingerprint
+
+    monkeypatch.setenv("PATH", f"{environment}{os.pathsep}{tmp_path}")
+    assert environment_fingerprint(catalogue) != fingerprint
+    assert environment_fingerprint({**catalogue, "mytool": "mine"}) != environment_fingerprint(catalogue)
+
+
+def test_catalogue_can_be_extended(environment, tmp_path):
+    config = tmp_path / "config" / "chatsh"
+    config.mkdir(parents=True)
+    (config / "tools.json").write_text('{"not-a-tool": "a local helper"}')
+    assert "not-a-tool: a local helper" in get_available_commands()
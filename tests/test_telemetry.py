@@ -0,0 +1,49 @@
+import pytest
+
+from chatsh.interaction_log import InteractionLog
+from chatsh.telemetry import collect, format_stats, openmetrics, percentile, turn_metrics
+
+
+def test_turn_metrics():
+    usage = {"input_tokens": 10, "output_tokens": 50, "cache_creation_input_tokens": 0,
+             "cache_read_input_tokens": 90}
+    metrics = turn_metrics(usage, "claude", started=1.0, first_token_at=1.5, finished=3.5, render_seconds=0.25)
+    assert metrics == {"model": "claude", "time_to_first_token": 0.5, "stream_seconds": 2.0,
+                       "render_seconds": 0.25, "input_tokens": 100, "output_tokens": 50,
+                       "cached_tokens": 90, "tokens_per_second": 25.0}
+    assert "tokens_per_second" not in turn_metrics(None, "claude", 1.0, None, 2.0, 0.0)
+
+
+def test_percentile():
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([5], 99) == 5
+    with pytest.raises(ValueError):
+        percentile([], 50)
+
+
+async def test_stats_across_sessions(tmp_path):
+    files = []
+    for ttft, wall in [(0.5, 1.0), (1.5, 3.0)]:
+        log = InteractionLog(log_dir=tmp_path)
+        log.current_file = tmp_path / f"interaction_log_{ttft}.jsonl"
+        user_id = await log.record_user_message("hi")
+        reply_id = await log.record_llm_response("```sh\nls\n```", user_id, metadata={"telemetry": {
+            "model": "claude", "time_to_first_token": ttft, "render_seconds": 0.01}})
+        prompt_id = await log.record_code_execution_prompt("ls", reply_id)
+        await log.record_code_output("a", prompt_id, metadata={"wall_seconds": wall})
+        await log.close()
+        files.append(log.current_file)
+
+    samples = await collect(files)
+    assert samples == {"claude": {"time_to_first_token": [0.5, 1.5], "render_seconds": [0.01, 0.01],
+                                  "command_seconds": [1.0, 3.0]}}
+    report = format_stats(samples)
+    assert report.splitlines()[0] == "claude"
+    assert "command_seconds" in report
+
+    exported = openmetrics(samples)
+    assert '# TYPE chatsh_time_to_first_token_seconds summary' in exported
+    assert 'chatsh_time_to_first_token_seconds{model="claude",quantile="0.5"} 1' in exported
+    assert 'chatsh_command_seconds_count{model="claude"} 2' in exported
+    assert exported.endswith("# EOF\n")